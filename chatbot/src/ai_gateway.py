@@ -4,29 +4,125 @@ Utility functions related to connecting with the backend services supporting
 the chatbot.
 """
 import os
+import time
+import uuid
 import logging
 import streamlit as st
 from openai import OpenAI
 from llama_stack_client import LlamaStackClient
 from llama_stack_client.types.shared_params.query_config import QueryConfig
 from constants import AGENT_SYSTEM_PROMPT
+from prompt_layout import normalize
+from context_assembler import ContextAssembler, load_tokenizer
+from endpoint_router import EndpointRouter, ROUTED_BASE_URL
+from model_cascade import ModelCascade, TASK_QUESTION
+from llm_scheduler import AdmissionScheduler, LLMOverloaded, LANE_INTERACTIVE
+from retrieval_depth import DepthSelector, QUERY_CHITCHAT
+from local_index import LlamaStackEmbedder, QueryEmbeddingCache, build_index
+from vector_snapshot import content_text, load_snapshot
+from tracing import tracer, record_usage, ATTR_MODEL, ATTR_TIME_TO_FIRST_TOKEN
 
 logger = logging.getLogger(__name__)
 
+
+@st.cache_resource(show_spinner="Building local index...")
+def load_local_index(llama_stack_url: str, embedding_model: str, sources: tuple, max_chunks: int,
+                     _llama_stack_client: LlamaStackClient):
+    """ Builds the in-process index of the source documents once per process,
+        shared by every session.  None when the corpus is too large.
+    """
+    documents = {}
+    for source in sources:
+        with open(source, "r", encoding="utf-8") as f:
+            documents[os.path.basename(source)] = f.read()
+    embedder = LlamaStackEmbedder(_llama_stack_client, embedding_model)
+    return build_index(documents, embedder, max_chunks=max_chunks)
+
+
+@st.cache_resource(show_spinner="Loading vector snapshot...")
+def load_local_snapshot(path: str):
+    """ Memory-maps a vector snapshot once per process, shared by every session.
+
+    :returns: The index and the snapshot's manifest
+    """
+    return load_snapshot(path)
+
+
+@st.cache_resource
+def load_query_embedding_cache(max_entries: int) -> QueryEmbeddingCache:
+    """ Query embedding cache shared by every session in the process. """
+    return QueryEmbeddingCache(max_entries)
+
+
+@st.cache_resource
+def load_context_tokenizer(model_id: str):
+    """ Tokenizer used to budget prompt context, loaded once per process. """
+    return load_tokenizer(model_id)
+
+
+@st.cache_resource
+def load_endpoint_router(urls: tuple, health_interval: float, hedge_percentile: int) -> EndpointRouter:
+    """ LLama Stack endpoint router shared by every session in the process. """
+    router = EndpointRouter(list(urls), health_interval=health_interval, hedge_percentile=hedge_percentile)
+    router.start_health_checks()
+    return router
+
+
+@st.cache_resource
+def load_llm_scheduler(max_concurrent: int, max_queue: int, max_wait_seconds: float) -> AdmissionScheduler:
+    """ LLM admission scheduler shared by every session in the process. """
+    return AdmissionScheduler(max_concurrent, max_queue, max_wait_seconds)
+
+
 class AIGateway:
 
     ENV_LLAMA_STACK_URL = "LLAMA_STACK_URL"
     ENV_API_KEY = "API_KEY"
     ENV_MODEL = "MODEL"
+    ENV_SMALL_MODEL = "SMALL_MODEL"
+    ENV_RAG_BACKEND = "RAG_BACKEND"
+    ENV_LOCAL_INDEX_SOURCE = "LOCAL_INDEX_SOURCE"
+    ENV_LOCAL_INDEX_SNAPSHOT = "LOCAL_INDEX_SNAPSHOT"
+    ENV_LOCAL_INDEX_MAX_CHUNKS = "LOCAL_INDEX_MAX_CHUNKS"
+    ENV_EMBEDDING_MODEL = "EMBEDDING_MODEL"
+    ENV_QUERY_EMBEDDING_CACHE_SIZE = "QUERY_EMBEDDING_CACHE_SIZE"
+    ENV_CONTEXT_TOKEN_BUDGET = "CONTEXT_TOKEN_BUDGET"
+    ENV_CONTEXT_TOKENIZER = "CONTEXT_TOKENIZER"
+    ENV_CONTEXT_MIN_SCORE = "CONTEXT_MIN_SCORE"
+    ENV_CONTEXT_DEDUP_THRESHOLD = "CONTEXT_DEDUP_THRESHOLD"
+    ENV_RAG_DEPTH = "RAG_DEPTH"
+    ENV_RAG_MAX_CHUNKS = "RAG_MAX_CHUNKS"
+    ENV_RAG_FACTUAL_CHUNKS = "RAG_FACTUAL_CHUNKS"
+    ENV_RAG_ELBOW_DROP = "RAG_ELBOW_DROP"
+    ENV_LLM_MAX_CONCURRENT = "LLM_MAX_CONCURRENT"
+    ENV_LLM_MAX_QUEUE = "LLM_MAX_QUEUE"
+    ENV_LLM_MAX_WAIT_SECONDS = "LLM_MAX_WAIT_SECONDS"
+    ENV_LLAMA_STACK_HEALTH_INTERVAL = "LLAMA_STACK_HEALTH_INTERVAL"
+    ENV_LLAMA_STACK_HEDGE_PERCENTILE = "LLAMA_STACK_HEDGE_PERCENTILE"
+
+    RAG_BACKEND_LOCAL = "local"
+    RAG_DEPTH_ADAPTIVE = "adaptive"
+    RAG_DEFAULT_CHUNKS = 5
 
     LLS_OPENAI_URL_SUFFIX = "/v1/openai/v1"
 
     MECHANIC_VECTOR_DB_NAME = "mechanic_vector_db"
 
+    # identical for every request, so the model server can cache its prefix
+    INSTRUCTIONS = normalize(AGENT_SYSTEM_PROMPT)
+
     openai_client : OpenAI = None
     llama_stack_client : LlamaStackClient = None
     previous_response_id = None
     model = None
+    local_index = None
+    embedder = None
+    query_cache = None
+    context_assembler : ContextAssembler = None
+    depth_selector : DepthSelector = None
+    scheduler : AdmissionScheduler = None
+    cascade : ModelCascade = None
+    session_id = None
 
     def connect(self):
         """ Connects to the remote service provider. """
@@ -46,18 +142,31 @@ class AIGateway:
         api_key = os.environ[self.ENV_API_KEY]
         logger.info("LLS/OpenAI API Key: %s", api_key)
 
+        # several comma separated URLs are replicas: route between them
+        urls = [url.strip() for url in llama_stack_url.split(",") if url.strip()]
+        base_url, router = urls[0], None
+        if len(urls) > 1:
+            router = load_endpoint_router(
+                tuple(urls),
+                float(os.environ.get(self.ENV_LLAMA_STACK_HEALTH_INTERVAL, "5")),
+                int(os.environ.get(self.ENV_LLAMA_STACK_HEDGE_PERCENTILE, "95")))
+            base_url = ROUTED_BASE_URL
+            logger.info("Routing across LLama Stack endpoints.  URLs=%s", urls)
+
         # Connect to LLama Stack
-        logger.info("Connecting to LLama Stack.  URL=%s", llama_stack_url)
+        logger.info("Connecting to LLama Stack.  URL=%s", base_url)
         self.llama_stack_client = LlamaStackClient(
-            base_url=llama_stack_url,
+            base_url=base_url,
+            http_client=router.http_client() if router else None,
         )
         logger.info("Successfully connected to LLama Stack.")
 
         # create client connection
-        openai_base_url = llama_stack_url + self.LLS_OPENAI_URL_SUFFIX
+        openai_base_url = base_url + self.LLS_OPENAI_URL_SUFFIX
         logger.info("Initializing OpenAI Client based on a base url value of = %s", openai_base_url)
         openai_client = OpenAI(base_url = openai_base_url,
-                               api_key = api_key)
+                               api_key = api_key,
+                               http_client = router.http_client() if router else None)
         logger.info("OpenAI Initialized")
 
         # get configured model
@@ -74,6 +183,82 @@ class AIGateway:
 
         self.openai_client = openai_client
 
+        # optionally answer with a smaller model first, escalating to MODEL when its answer fails the checks
+        small_model = os.environ.get(self.ENV_SMALL_MODEL, "")
+        self.cascade = ModelCascade(small_model, self.model)
+        if self.cascade.enabled:
+            logger.info("Model cascade.  Small Model=%s. Large Model=%s", small_model, self.model)
+
+        # share the inference server fairly with the other sessions in the process
+        self.scheduler = load_llm_scheduler(
+            int(os.environ.get(self.ENV_LLM_MAX_CONCURRENT, "8")),
+            int(os.environ.get(self.ENV_LLM_MAX_QUEUE, "64")),
+            float(os.environ.get(self.ENV_LLM_MAX_WAIT_SECONDS, "120")),
+        )
+        self.session_id = uuid.uuid4().hex
+
+        # trim retrieved context to a token budget
+        min_score = os.environ.get(self.ENV_CONTEXT_MIN_SCORE)
+        self.context_assembler = ContextAssembler(
+            token_budget=int(os.environ.get(self.ENV_CONTEXT_TOKEN_BUDGET, "3000")),
+            tokenizer=load_context_tokenizer(os.environ.get(self.ENV_CONTEXT_TOKENIZER, "")),
+            min_score=float(min_score) if min_score else None,
+            dedup_threshold=float(os.environ.get(self.ENV_CONTEXT_DEDUP_THRESHOLD, "0.8")),
+        )
+        logger.info("Context Token Budget: %s. Min Score: %s",
+                    self.context_assembler.token_budget, self.context_assembler.min_score)
+
+        # optionally pick the retrieval depth per question
+        if os.environ.get(self.ENV_RAG_DEPTH) == self.RAG_DEPTH_ADAPTIVE:
+            self.depth_selector = DepthSelector(
+                max_chunks=int(os.environ.get(self.ENV_RAG_MAX_CHUNKS, "6")),
+                factual_chunks=int(os.environ.get(self.ENV_RAG_FACTUAL_CHUNKS, "3")),
+                elbow_drop=float(os.environ.get(self.ENV_RAG_ELBOW_DROP, "0.25")),
+                min_score=self.context_assembler.min_score,
+            )
+            logger.info("Adaptive retrieval depth.  Max Chunks=%s. Factual Chunks=%s",
+                        self.depth_selector.max_chunks, self.depth_selector.factual_chunks)
+
+        # optionally retrieve from an in-process index instead of the vector database
+        if os.environ.get(self.ENV_RAG_BACKEND) == self.RAG_BACKEND_LOCAL:
+            self.connect_local_index(llama_stack_url)
+
+    def connect_local_index(self, llama_stack_url: str):
+        """ Loads the local index from LOCAL_INDEX_SNAPSHOT, or builds it from
+            LOCAL_INDEX_SOURCE, falling back to the remote vector database when
+            the corpus is too large.
+        """
+        if self.ENV_LOCAL_INDEX_SNAPSHOT in os.environ:
+            snapshot = os.environ[self.ENV_LOCAL_INDEX_SNAPSHOT]
+            self.local_index, manifest = load_local_snapshot(snapshot)
+            logger.info("Local index.  Snapshot=%s. Version=%s", snapshot, manifest["version"])
+            self.embedder = LlamaStackEmbedder(self.llama_stack_client, manifest["embedding_model"])
+            self.connect_query_cache()
+            return
+
+        for variable in (self.ENV_LOCAL_INDEX_SOURCE, self.ENV_EMBEDDING_MODEL):
+            if variable not in os.environ:
+                msg = f"'{variable}' is required when '{self.ENV_RAG_BACKEND}' is '{self.RAG_BACKEND_LOCAL}'."
+                logger.error(msg)
+                raise ValueError(msg)
+        sources = tuple(os.environ[self.ENV_LOCAL_INDEX_SOURCE].split(","))
+        embedding_model = os.environ[self.ENV_EMBEDDING_MODEL]
+        max_chunks = int(os.environ.get(self.ENV_LOCAL_INDEX_MAX_CHUNKS, "20000"))
+        logger.info("Local index.  Sources=%s. Embedding Model=%s", sources, embedding_model)
+
+        self.local_index = load_local_index(llama_stack_url, embedding_model, sources, max_chunks,
+                                            self.llama_stack_client)
+        if self.local_index is None:
+            logger.warning("Local index unavailable.  Falling back to the remote vector database.")
+            return
+        self.embedder = LlamaStackEmbedder(self.llama_stack_client, embedding_model)
+        self.connect_query_cache()
+
+    def connect_query_cache(self):
+        """ Attaches the process-wide query embedding cache. """
+        max_entries = int(os.environ.get(self.ENV_QUERY_EMBEDDING_CACHE_SIZE, "1024"))
+        self.query_cache = load_query_embedding_cache(max_entries)
+
     def process_user_chat(self, user_input: str, placeholder) -> str:
         """ Process a chat request.
         
@@ -83,40 +268,122 @@ class AIGateway:
             Returns: Chat response
         """
         # Log the user chat and systems prompt
-        logger.info("System Prompt: %s", AGENT_SYSTEM_PROMPT)
+        logger.info("System Prompt: %s", self.INSTRUCTIONS)
         logger.info("User Input: %s", user_input)
 
+        with tracer.start_as_current_span("process_user_chat") as span:
+            span.set_attribute(ATTR_MODEL, self.model)
+            start = time.perf_counter()
+
+            # Wait for a slot, then stream the response while holding it.  An
+            # escalated answer replaces the small model's and continues the
+            # conversation from before it.
+            previous_response_id = self.previous_response_id
+            try:
+                with self.scheduler.slot(LANE_INTERACTIVE, self.session_id) as ticket:
+                    span.set_attribute("llm.queue_seconds", ticket.wait_seconds)
+                    result = self.cascade.run(TASK_QUESTION, lambda model: self._stream_response(
+                        model, previous_response_id, user_input, placeholder, span, start))
+                ai_response = result.text
+                span.set_attribute(ATTR_MODEL, result.model)
+                span.set_attribute("llm.tier", result.tier)
+                if result.escalation:
+                    span.set_attribute("llm.escalation", result.escalation)
+            except LLMOverloaded as e:
+                span.set_attribute("llm.shed", e.reason)
+                ai_response = str(e)
+                with placeholder.container():
+                    st.warning(ai_response)
+
+            return ai_response
+
+    def _stream_response(self, model: str, previous_response_id: str, user_input: str, placeholder, span,
+                         start: float) -> tuple[str, str]:
+        """ Streams the model's response into the placeholder.
+
+            Returns: The response text, and why it was incomplete (None when it completed)
+        """
         # Employ OpenAI Responses AI
         response_stream = self.openai_client.responses.create(
-            model=self.model,
-            instructions=AGENT_SYSTEM_PROMPT,
+            model=model,
+            instructions=self.INSTRUCTIONS,
             input=user_input,
             temperature=0.3,
             max_output_tokens=2048,
             top_p=1,
             store=True,
-            previous_response_id=self.previous_response_id,
+            previous_response_id=previous_response_id,
             stream=True
         )
 
         # Capture response
         ai_response = ""
+        incomplete_reason = None
         for event in response_stream:
             if hasattr(event, "type") and "text.delta" in event.type:
+                if not ai_response:
+                    span.set_attribute(ATTR_TIME_TO_FIRST_TOKEN, time.perf_counter() - start)
                 ai_response += event.delta
                 print(event.delta, end="", flush=True)
                 with placeholder.container():
                     st.write(ai_response)
             elif hasattr(event, "type") and "response.completed" in event.type:
                 self.previous_response_id = event.response.id
+                usage = getattr(event.response, "usage", None)
+                if usage is not None:
+                    record_usage(span, usage.input_tokens, usage.output_tokens)
+            elif hasattr(event, "type") and "response.incomplete" in event.type:
+                self.previous_response_id = event.response.id
+                details = getattr(event.response, "incomplete_details", None)
+                incomplete_reason = getattr(details, "reason", None) or "incomplete"
 
-        return ai_response
+        return ai_response, incomplete_reason
 
-    def rag_search(self, search_string: str, max_chunks: int = 5):
+    def rag_search(self, search_string: str, max_chunks: int = None):
         """ Search vector store for relevant content.
+
+            max_chunks defaults to 5, or with adaptive depth to the depth chosen
+            for the question (0 for chit-chat, which skips retrieval).
+
+            Returns dicts with the chunk text and its similarity score (None when unknown).
         """
-        logger.info("Performing RAG Search.  Search String=%s. Max Chunks=%s", search_string, max_chunks)
-    
+        with tracer.start_as_current_span("rag_search") as span:
+            adaptive = max_chunks is None and self.depth_selector is not None
+            if adaptive:
+                query_class, max_chunks = self.depth_selector.depth(search_string)
+                span.set_attribute("rag.query_class", query_class)
+                if query_class == QUERY_CHITCHAT:
+                    logger.info("Skipping RAG Search for chit-chat.  Search String=%s", search_string)
+                    span.set_attribute("rag.chunks", 0)
+                    return []
+            elif max_chunks is None:
+                max_chunks = self.RAG_DEFAULT_CHUNKS
+            logger.info("Performing RAG Search.  Search String=%s. Max Chunks=%s", search_string, max_chunks)
+            span.set_attribute("rag.max_chunks", max_chunks)
+            if self.local_index is not None:
+                results = self._local_rag_search(search_string, max_chunks, span)
+            else:
+                results = self._rag_search(search_string, max_chunks)
+            if adaptive:
+                results = self.depth_selector.cut(results)
+            span.set_attribute("rag.chunks", len(results))
+            return results
+
+    def _local_rag_search(self, search_string: str, max_chunks: int, span):
+        """ Queries the in-process index with a (possibly cached) query embedding. """
+        query_embedding, hit = self.query_cache.embed_query(self.embedder, search_string)
+        span.set_attribute("rag.embedding_cache_hit", hit)
+        stats = self.query_cache.stats()
+        logger.info("Query embedding cache.  Hit=%s. Hit Rate=%.2f. Saved Seconds=%.3f",
+                    hit, stats["hit_rate"], stats["saved_seconds"])
+        start = time.perf_counter()
+        matches = self.local_index.search(query_embedding, k=max_chunks)
+        logger.info("Local index search.  Matches=%s. Seconds=%.6f", len(matches), time.perf_counter() - start)
+        return matches
+
+    def _rag_search(self, search_string: str, max_chunks: int):
+        """ Finds the mechanic vector database and queries it. """
+
         # Retrieve the vector database for the mechanic application
         logger.info("Searching for the mechanic vector database.  DB_NAME=%s", self.MECHANIC_VECTOR_DB_NAME)
         mechanic_vdb = None
@@ -155,12 +422,17 @@ class AIGateway:
         document_ids = metadata["document_ids"]
         logger.info("Matching Content.  #=%s. DocIds=%s", len(document_ids), document_ids)
 
+        # Newer LLama Stack releases also return the raw chunks and their scores
+        if metadata.get("chunks") and metadata.get("scores"):
+            return [{"text": content_text(chunk), "score": score}
+                    for chunk, score in zip(metadata["chunks"], metadata["scores"])]
+
         # Parse content
         content = content[1]
         results = []
         for result in content:
             text = result.text
             logger.info("Matching Chunk = %s", text)
-            results.append(text)
+            results.append({"text": text, "score": None})
 
         return results
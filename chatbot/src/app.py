@@ -10,6 +10,8 @@ from constants import AppUserInterfaceElements
 from constants import CannedGreetings
 from constants import MessageAttributes
 from ai_gateway import AIGateway
+from prompt_layout import user_message
+from tracing import setup_tracing, tracer
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +20,7 @@ logging.basicConfig(level=logging.INFO,
         # no need from a docker container - logging.FileHandler("mechanic-chatbot.log"),
         logging.StreamHandler()
     ])
+setup_tracing("mechanic-chatbot")
 
 # Prepare engine bay photo
 def get_base64_of_bin_file(bin_file):
@@ -93,21 +96,21 @@ if user_input := st.chat_input():
     st.session_state.messages.append({"role": "user", "content": user_input})
     logger.info ("st.session_state.messages - %s", st.session_state.messages)
 
-    # Search VDB for relevant content
-    matching_content = gateway.rag_search(user_input)
-    expanded_user_input = ""
-    if matching_content is not None and len(matching_content) > 0:
-        expanded_user_input += "Context:\n"
-        for c in matching_content:
-            expanded_user_input += c + "\n"
-        expanded_user_input += "\nQuestion:"
-    expanded_user_input += user_input
-
-    # Process chat
-    ai_response = None
-    with messages.chat_message(MessageAttributes.ASSISTANT):
-        placeholder = st.empty()
-        ai_response = gateway.process_user_chat(expanded_user_input, placeholder)
+    with tracer.start_as_current_span("chat_turn") as span:
+        # Search VDB for relevant content and fit it to the context budget
+        matching_content = gateway.rag_search(user_input)
+        context, context_stats = gateway.context_assembler.assemble(matching_content or [])
+        span.set_attribute("rag.context_tokens", context_stats["tokens"])
+        span.set_attribute("rag.context_chunks", context_stats["kept"])
+        span.set_attribute("rag.duplicate_chunks", context_stats["duplicates"])
+        # context ahead of the question, most relevant first, after the stable system prompt
+        expanded_user_input = user_message(user_input, context)
+
+        # Process chat
+        ai_response = None
+        with messages.chat_message(MessageAttributes.ASSISTANT):
+            placeholder = st.empty()
+            ai_response = gateway.process_user_chat(expanded_user_input, placeholder)
     logger.info ("AI Response Message: %s", ai_response)
 
     # Append AI Response to history
@@ -0,0 +1,113 @@
+""" Model Cascade Benchmark
+
+Runs City Permitting questions and application evaluations against LLama
+Stack (or mock-llama-stack with a small model configured) once with the
+large model only and once through the model cascade, and reports latency,
+the share of calls the small model answered, the escalation rate and how
+many evaluations produced a scorecard.
+
+    SMALL_MODELS=llama32 python app.py    # mock-llama-stack
+    python cascade_bench.py http://localhost:8321 llama32 llama-4-scout-17b-16e-w4a16
+"""
+import re
+import json
+import time
+import random
+import statistics
+from collections import Counter
+import click
+from llama_stack_client import LlamaStackClient
+from model_cascade import ModelCascade, TASK_EVALUATION, TASK_QUESTION, TIER_SMALL
+from permit_prompts import SYSTEM_PROMPT, EVALUATION_INSTRUCTIONS, application_data
+from prompt_bench import QUESTIONS, REGULATIONS, application
+from prompt_layout import user_message
+
+
+def workload(requests: int) -> list[tuple[str, str]]:
+    """ Tasks and their user messages: mostly questions, some evaluations. """
+    rng = random.Random(11)
+    tasks = []
+    for i in range(requests):
+        if i % 5 == 4:
+            tasks.append((TASK_EVALUATION, user_message(application_data(application(i)), REGULATIONS[:4],
+                                                        context_heading="RELEVANT DENVER REGULATIONS",
+                                                        request_heading="REQUEST",
+                                                        instructions=EVALUATION_INSTRUCTIONS)))
+        else:
+            query, regulation_ids = QUESTIONS[rng.randrange(len(QUESTIONS))]
+            tasks.append((TASK_QUESTION, user_message(f"{query} (applicant {i})",
+                                                      [REGULATIONS[r] for r in regulation_ids],
+                                                      context_heading="RELEVANT DENVER REGULATIONS",
+                                                      request_heading="REQUEST")))
+    return tasks
+
+
+def has_scorecard(text: str) -> bool:
+    """ Whether the evaluation answer holds a parseable scorecard. """
+    match = re.search(r'\{.*\}', text, re.DOTALL)
+    try:
+        return bool(match) and "overall_score" in json.loads(match.group())
+    except ValueError:
+        return False
+
+
+def run_mode(client: LlamaStackClient, cascade: ModelCascade, tasks: list) -> dict:
+    """ Answers every task through the cascade. """
+    latencies = {TASK_QUESTION: [], TASK_EVALUATION: []}
+    tiers = Counter()
+    escalations = Counter()
+    scorecards = 0
+
+    for task, message in tasks:
+        def complete(model_id: str):
+            response = client.inference.chat_completion(
+                model_id=model_id,
+                messages=[{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": message}])
+            return response.completion_message.content, response.completion_message.stop_reason
+
+        start = time.perf_counter()
+        result = cascade.run(task, complete)
+        latencies[task].append(time.perf_counter() - start)
+        tiers[result.tier] += 1
+        if result.escalation:
+            escalations[result.escalation] += 1
+        if task == TASK_EVALUATION and has_scorecard(result.text):
+            scorecards += 1
+
+    small_first = sum(1 for task, _ in tasks if cascade.tier(task) == TIER_SMALL)
+    every = latencies[TASK_QUESTION] + latencies[TASK_EVALUATION]
+    return {
+        "requests": len(tasks),
+        "question_mean": statistics.fmean(latencies[TASK_QUESTION]) if latencies[TASK_QUESTION] else 0.0,
+        "evaluation_mean": statistics.fmean(latencies[TASK_EVALUATION]) if latencies[TASK_EVALUATION] else 0.0,
+        "p95": statistics.quantiles(every, n=20)[-1] if len(every) > 1 else every[0],
+        "small_share": tiers[TIER_SMALL] / len(tasks),
+        "escalation_rate": sum(escalations.values()) / small_first if small_first else 0.0,
+        "escalations": dict(escalations),
+        "scorecards": f"{scorecards}/{len(latencies[TASK_EVALUATION])}",
+    }
+
+
+@click.command()
+@click.argument('llama_stack_url')
+@click.argument('small_model')
+@click.argument('large_model')
+@click.option('--requests', default=50, help="Calls per mode, one in five an evaluation")
+def cli(llama_stack_url: str, small_model: str, large_model: str, requests: int):
+    """ Compares the large model alone with the small/large model cascade. """
+    client = LlamaStackClient(base_url=llama_stack_url)
+    tasks = workload(requests)
+    results = [("large only", run_mode(client, ModelCascade("", large_model), tasks)),
+               ("cascade", run_mode(client, ModelCascade(small_model, large_model), tasks))]
+
+    print(f"{'mode':>10} {'question':>8} {'evaluate':>8} {'p95':>7} {'small':>6} {'escalate':>8} {'scorecards':>10}")
+    for mode, r in results:
+        print(f"{mode:>10} {r['question_mean']:>8.3f} {r['evaluation_mean']:>8.3f} {r['p95']:>7.3f} "
+              f"{r['small_share']:>6.1%} {r['escalation_rate']:>8.1%} {r['scorecards']:>10}")
+    print(f"Escalations by reason: {results[1][1]['escalations']}")
+    large, cascade = results[0][1], results[1][1]
+    print(f"Question latency improvement: {1 - cascade['question_mean'] / large['question_mean']:.1%}")
+
+
+if __name__ == '__main__':
+    cli()
@@ -1,444 +1,60 @@
 # City Permitting AI Agent - Streamlit Application
+#
+# The agent runs behind the City Permitting API (permit_api.py); this app is
+# its user interface and calls the API through PermitAPIClient.
 import streamlit as st
-import json
 import os
-import requests
-import tempfile
-import uuid
-from typing import Dict, Any, List
-from io import BytesIO
-
-# Llama Stack imports
-try:
-    from llama_stack_client import LlamaStackClient
-    from llama_stack_client.types import Document
-except ImportError:
-    st.error("Please install llama-stack-client: pip install llama-stack-client")
-    st.stop()
-
-# PDF processing
-try:
-    from pypdf import PdfReader
-except ImportError:
-    st.error("Please install pypdf: pip install pypdf")
-    st.stop()
+import permit_metrics
+from llm_scheduler import LLMOverloaded
+from model_cascade import EVENT_DELTA, EVENT_RESET
+from permit_client import PermitAPIClient
+from tracing import setup_tracing
 
 # ============================================================================
 # Configuration
 # ============================================================================
 
 class Config:
-    """Configuration for the City Permitting Agent"""
-    
-    # Llama Stack Configuration
-    LLAMA_STACK_HOST = os.getenv("LLAMA_STACK_HOST", "localhost")
-    LLAMA_STACK_PORT = os.getenv("LLAMA_STACK_PORT", "8321")
-    #LLAMA_STACK_URL = f"http://{LLAMA_STACK_HOST}:{LLAMA_STACK_PORT}"
-    LLAMA_STACK_URL = "http://llamastack-server.llama-serve.svc.cluster.local:8321"
-    
-    # Model Configuration
-    MODEL_ID = "llama-4-scout-17b-16e-w4a16"
-    EMBEDDING_MODEL = "all-MiniLM-L6-v2"
-    EMBEDDING_DIMENSION = 384
-    
-    # Denver Permit Document URLs with fallbacks
-    PERMIT_DOCS = {
-        "food_rules_2017": {
-            "urls": [
-                # Primary URL
-                "https://www.denvergov.org/files/assets/public/public-health-and-environment/documents/phi/food/revisedfoodrulesandregulationsapril2017compressed.pdf",
-                # Fallback URLs
-                "http://denvergov.org/content/dam/denvergov/Portals/771/documents/PHI/Food/RevisedFoodRulesandregulationsApril2017compressed.pdf",
-            ],
-            "description": "Denver Food Rules and Regulations April 2017"
-        },
-        "mobile_unit_guide_2022": {
-            "urls": [
-                "https://denver.prelive.opencities.com/files/assets/public/v/1/public-health-and-environment/documents/phi/2022_mobileunitguide.pdf",
-            ],
-            "description": "Denver Mobile Unit Guide 2022"
-        }
-    }
-    
-    # Fallback content if PDFs cannot be downloaded
-    FALLBACK_CONTENT = """
-    DENVER MOBILE FOOD TRUCK PERMIT REQUIREMENTS
-    
-    LICENSE REQUIREMENTS:
-    - City and County of Denver 'Retail Food Establishment-Mobile' license required
-    - Complete Mobile Plan Review Packet submission
-    - Processing time: 30 days during busy season
-    - Annual renewal required
-    
-    WATER SYSTEM REQUIREMENTS:
-    - Hand washing sink: minimum 10 inches wide x 10 inches long x 5 inches deep
-    - Water temperature: 100°F to 120°F at the faucet
-    - Soap and single-use paper towels required at all times
-    - Minimum 10 gallons clean water tank OR 3 gallons per hour of operation (whichever is greater)
-    - Wastewater tank must be at least 15% larger than clean water tank
-    - All water tanks must be NSF-approved and labeled
-    
-    COMMISSARY REQUIREMENTS:
-    - Must operate from an approved commissary facility
-    - Report to commissary daily for food preparation, cleaning, and servicing
-    - Affidavit of Commissary form required
-    - Commissary must be licensed by Denver or approved jurisdiction
-    
-    LOCATION RESTRICTIONS:
-    - Cannot operate in Central Business District without special permit
-    - 300 feet minimum from public parks (unless during special event with permission)
-    - 200 feet minimum from other food trucks
-    - 200 feet minimum from eating/drinking establishments (unless written consent)
-    - 50 feet minimum from residential zoning districts
-    - Cannot block fire hydrants, crosswalks, or handicap access
-    
-    EQUIPMENT REQUIREMENTS:
-    - Fire suppression system required for equipment producing grease-laden vapors
-    - Type I hood system required for grills, fryers, etc.
-    - Commercial-grade equipment only (no residential appliances)
-    - All equipment must be NSF or equivalent certified
-    - Adequate ventilation system required
-    
-    FOOD SAFETY REQUIREMENTS:
-    - All food stored minimum 6 inches above ground
-    - Cold potentially hazardous food: 41°F or below
-    - Hot potentially hazardous food: 135°F or above
-    - Accurate thermometers required (± 2°F accuracy)
-    - Food protection from contamination at all times
-    - No bare hand contact with ready-to-eat foods
+    """Configuration for the City Permitting Streamlit app"""
     
-    STRUCTURAL REQUIREMENTS:
-    - Floors: smooth, non-absorbent, easily cleanable
-    - Walls and ceilings: light-colored, smooth, easily cleanable
-    - Adequate lighting: minimum 10 foot-candles on food prep surfaces
-    - Sneeze guards required for customer self-service
-    - Waste containers with lids required
+    # City Permitting API serving the agent
+    PERMIT_API_URL = os.getenv("PERMIT_API_URL", "http://localhost:8000")
+    # Show answers to questions as they are generated
+    STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "true").lower() == "true"
     
-    DOCUMENTATION REQUIRED FOR PERMIT:
-    1. Completed application form with fees
-    2. Vehicle registration and proof of ownership
-    3. Insurance certificate (general liability)
-    4. Commissary affidavit (signed by commissary owner)
-    5. Mobile unit floor plan (to scale)
-    6. Equipment specification sheets
-    7. Menu list
-    8. Water system diagram
-    9. Waste disposal plan
-    10. Certified food manager certificate (at least one per unit)
-    
-    INSPECTION REQUIREMENTS:
-    - Initial inspection required before permit issuance
-    - Routine unannounced inspections throughout operation
-    - Must maintain score of 80 or above
-    - Critical violations must be corrected immediately
-    - Re-inspection fee applies for follow-up inspections
-    
-    FEES (Subject to change):
-    - New mobile unit application: varies by unit type
-    - Annual renewal: varies by unit type
-    - Re-inspection fee: if applicable
-    - Late renewal penalty: if applicable
-    """
+    # Prometheus metrics side port (0 disables)
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "9090"))
 
 # ============================================================================
-# Document Loader with Robust Error Handling
+# Streamlit UI
 # ============================================================================
 
-class DocumentLoader:
-    """Handles document loading with fallback mechanisms"""
-    
-    def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-        })
-    
-    def download_pdf(self, urls: List[str], description: str) -> bytes:
-        """Download PDF with multiple fallback URLs"""
-        for url in urls:
-            try:
-                st.info(f"Attempting to download: {description}")
-                response = self.session.get(
-                    url,
-                    allow_redirects=True,
-                    timeout=30,
-                    verify=True
-                )
-                
-                if response.status_code == 200:
-                    content_type = response.headers.get('content-type', '')
-                    if 'pdf' in content_type.lower() or len(response.content) > 1000:
-                        st.success(f"✓ Downloaded: {description}")
-                        return response.content
-                    else:
-                        st.warning(f"Response not PDF format from {url}")
-                else:
-                    st.warning(f"Status {response.status_code} from {url}")
-                    
-            except requests.exceptions.RequestException as e:
-                st.warning(f"Failed to download from {url}: {str(e)}")
-                continue
-            except Exception as e:
-                st.warning(f"Unexpected error with {url}: {str(e)}")
-                continue
-        
-        return None
-    
-    def extract_text_from_pdf(self, pdf_content: bytes) -> str:
-        """Extract text from PDF bytes"""
+def show_answer(question: str):
+    """Answers a question, streaming the answer into the page when enabled"""
+    with st.spinner("Searching regulations..."), permit_metrics.operation(permit_metrics.OPERATION_QUESTION):
         try:
-            pdf_file = BytesIO(pdf_content)
-            reader = PdfReader(pdf_file)
-            text = ""
-            
-            for page in reader.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n\n"
+            st.markdown("---")
+            st.subheader("Answer")
+            if not Config.STREAM_ANSWERS:
+                st.markdown(st.session_state.agent.query_with_rag(question))
+                return
             
-            return text
-        except Exception as e:
-            st.error(f"Error extracting PDF text: {str(e)}")
-            return ""
-    
-    def load_permit_documents(self) -> List[Document]:
-        """Load all permit requirement documents"""
-        documents = []
-        
-        for doc_id, doc_info in Config.PERMIT_DOCS.items():
-            # Try to download PDF
-            pdf_content = self.download_pdf(doc_info["urls"], doc_info["description"])
-            
-            if pdf_content:
-                # Extract text
-                text_content = self.extract_text_from_pdf(pdf_content)
-                
-                if text_content and len(text_content.strip()) > 100:
-                    doc = Document(
-                        document_id=doc_id,
-                        content=text_content,
-                        mime_type="text/plain",
-                        metadata={
-                            "source": doc_info["urls"][0],
-                            "description": doc_info["description"],
-                            "type": "permit_requirements"
-                        }
-                    )
-                    documents.append(doc)
+            placeholder = st.empty()
+            answer = ""
+            for event, data in st.session_state.agent.stream_query_with_rag(question):
+                if event == EVENT_DELTA:
+                    answer += data
+                elif event == EVENT_RESET:
+                    # a better answer replaces the one shown so far
+                    answer = ""
                 else:
-                    st.warning(f"Insufficient content extracted from {doc_info['description']}")
-        
-        # If no documents loaded, use fallback content
-        if not documents:
-            st.warning("⚠�? Could not download PDFs. Using fallback permit requirements.")
-            fallback_doc = Document(
-                document_id="fallback_requirements",
-                content=Config.FALLBACK_CONTENT,
-                mime_type="text/plain",
-                metadata={
-                    "source": "fallback",
-                    "description": "Denver Permit Requirements (Fallback)",
-                    "type": "permit_requirements"
-                }
-            )
-            documents.append(fallback_doc)
+                    answer = data
+                placeholder.markdown(answer)
         
-        return documents
-
-# ============================================================================
-# Llama Stack Agent Manager
-# ============================================================================
-
-class PermitAgentManager:
-    """Manages Llama Stack client and agent operations"""
-    
-    def __init__(self):
-        self.client = None
-        self.vector_db_id = None
-        self.session_id = None
-        self.messages = []
-    
-    def initialize_client(self) -> bool:
-        """Initialize Llama Stack client"""
-        try:
-            self.client = LlamaStackClient(base_url=Config.LLAMA_STACK_URL)
-            # Test connection
-            self.client.models.list()
-            return True
-        except Exception as e:
-            st.error(f"Failed to connect to Llama Stack at {Config.LLAMA_STACK_URL}: {str(e)}")
-            return False
-    
-    def setup_vector_db(self, documents: List[Document]) -> bool:
-        """Setup vector database and ingest documents"""
-        try:
-            # Generate unique vector DB ID
-            self.vector_db_id = f"permit-db-{uuid.uuid4().hex[:8]}"
-            
-            # Get available providers
-            providers = self.client.providers.list()
-            vector_provider = None
-            
-            for provider in providers:
-                if hasattr(provider, 'api') and provider.api == 'vector_io':
-                    vector_provider = provider
-                    break
-            
-            if not vector_provider:
-                st.error("No vector_io provider found in Llama Stack")
-                return False
-            
-            # Register vector database
-            self.client.vector_dbs.register(
-                vector_db_id=self.vector_db_id,
-                provider_id=vector_provider.provider_id,
-                embedding_model=Config.EMBEDDING_MODEL,
-                embedding_dimension=Config.EMBEDDING_DIMENSION
-            )
-            
-            # Ingest documents
-            self.client.tool_runtime.rag_tool.insert(
-                documents=documents,
-                vector_db_id=self.vector_db_id,
-                chunk_size_in_tokens=1024
-            )
-            
-            st.success(f"✓ Vector database setup complete: {self.vector_db_id}")
-            return True
-            
-        except Exception as e:
-            st.error(f"Error setting up vector database: {str(e)}")
-            return False
-    
-    def create_session(self):
-        """Create new conversation session"""
-        self.session_id = f"session-{uuid.uuid4().hex[:8]}"
-        self.messages = [
-            {
-                "role": "system",
-                "content": """You are an expert City Permitting AI Agent for Denver food truck permits.
-
-Your responsibilities:
-1. Review permit applications for completeness and accuracy
-2. Check compliance with Denver food truck regulations
-3. Identify missing information or errors
-4. Provide clear, actionable feedback with specific regulation references
-5. Generate evaluation scorecards with scores from 0-100
-
-Always be professional, thorough, and cite specific regulations when providing feedback."""
-            }
-        ]
-    
-    def query_with_rag(self, query: str) -> str:
-        """Query with RAG context"""
-        try:
-            # Query vector database for relevant context
-            rag_results = self.client.tool_runtime.rag_tool.query(
-                content=query,
-                vector_db_ids=[self.vector_db_id]
-            )
-            
-            # Extract context from RAG results
-            rag_context = []
-            if hasattr(rag_results, 'content') and rag_results.content:
-                for chunk in rag_results.content:
-                    if hasattr(chunk, 'text'):
-                        rag_context.append(chunk.text)
-            
-            # Build enhanced prompt with RAG context
-            enhanced_query = query
-            if rag_context:
-                context_text = "\n\n".join(rag_context)
-                enhanced_query = f"""{query}
-
-RELEVANT DENVER REGULATIONS:
-{context_text}
-
-Base your response on the regulations provided above."""
-            
-            # Add to conversation messages
-            self.messages.append({
-                "role": "user",
-                "content": enhanced_query
-            })
-            
-            # Get LLM response using Responses API (chat completion)
-            response = self.client.inference.chat_completion(
-                model_id=Config.MODEL_ID,
-                messages=self.messages
-            )
-            
-            # Extract response content
-            if hasattr(response, 'completion_message'):
-                response_text = response.completion_message.content
-            elif hasattr(response, 'choices') and len(response.choices) > 0:
-                response_text = response.choices[0].message.content
-            else:
-                response_text = str(response)
-            
-            # Add assistant response to messages
-            self.messages.append({
-                "role": "assistant",
-                "content": response_text
-            })
-            
-            return response_text
-            
+        except LLMOverloaded as e:
+            st.warning(str(e))
         except Exception as e:
-            error_msg = f"Error querying agent: {str(e)}"
-            st.error(error_msg)
-            return error_msg
-    
-    def evaluate_application(self, application: Dict[str, Any]) -> Dict[str, Any]:
-        """Evaluate permit application"""
-        
-        evaluation_query = f"""Evaluate this Denver food truck permit application:
-
-APPLICATION DATA:
-{json.dumps(application, indent=2)}
-
-Provide a detailed evaluation in JSON format with:
-{{
-  "overall_score": <0-100>,
-  "recommendation": "APPROVED" | "NEEDS_REVISION" | "REJECTED",
-  "categories": {{
-    "completeness": {{"score": <0-100>, "findings": [...], "required_actions": [...]}},
-    "accuracy": {{"score": <0-100>, "findings": [...], "required_actions": [...]}},
-    "compliance": {{"score": <0-100>, "findings": [...], "required_actions": [...]}},
-    "documentation": {{"score": <0-100>, "findings": [...], "required_actions": [...]}},
-    "safety_requirements": {{"score": <0-100>, "findings": [...], "required_actions": [...]}}
-  }},
-  "summary": "<brief summary>",
-  "next_steps": [...]
-}}"""
-        
-        response = self.query_with_rag(evaluation_query)
-        
-        # Try to parse JSON from response
-        try:
-            import re
-            json_match = re.search(r'\{.*\}', response, re.DOTALL)
-            if json_match:
-                evaluation = json.loads(json_match.group())
-            else:
-                # Fallback structure
-                evaluation = {
-                    "overall_score": 0,
-                    "recommendation": "NEEDS_REVIEW",
-                    "raw_response": response
-                }
-        except:
-            evaluation = {
-                "overall_score": 0,
-                "recommendation": "ERROR",
-                "raw_response": response
-            }
-        
-        return evaluation
-
-# ============================================================================
-# Streamlit UI
-# ============================================================================
+            st.error(f"Error: {str(e)}")
 
 def main():
     """Main Streamlit application"""
@@ -479,6 +95,11 @@ def main():
     </style>
     """, unsafe_allow_html=True)
     
+    # Metrics are served on a side port, shared by all sessions
+    permit_metrics.start_metrics_server(Config.METRICS_PORT)
+    setup_tracing("city-permitting")
+    permit_metrics.track_session(st.session_state)
+    
     # Initialize session state
     if "agent" not in st.session_state:
         st.session_state.agent = None
@@ -495,47 +116,19 @@ def main():
         
         # Configuration
         st.subheader("Configuration")
-        llama_host = st.text_input("Llama Stack Host", value=Config.LLAMA_STACK_HOST)
-        llama_port = st.text_input("Llama Stack Port", value=Config.LLAMA_STACK_PORT)
-        
-        Config.LLAMA_STACK_HOST = llama_host
-        Config.LLAMA_STACK_PORT = llama_port
-        Config.LLAMA_STACK_URL = f"http://{llama_host}:{llama_port}"
+        api_url = st.text_input("Permitting API URL", value=Config.PERMIT_API_URL)
+        Config.PERMIT_API_URL = api_url
         
         st.markdown("---")
         
         # Initialization
         if st.button("🚀 Initialize Agent", type="primary"):
-            with st.spinner("Initializing agent..."):
+            with st.spinner("Initializing agent..."), permit_metrics.operation(permit_metrics.OPERATION_INITIALIZE):
                 try:
-                    # Create agent manager
-                    agent = PermitAgentManager()
-                    
-                    # Step 1: Connect to Llama Stack
-                    st.info("Connecting to Llama Stack...")
-                    if not agent.initialize_client():
-                        st.error("Failed to initialize Llama Stack client")
-                        st.stop()
-                    
-                    # Step 2: Load documents
-                    st.info("Loading permit documents...")
-                    loader = DocumentLoader()
-                    documents = loader.load_permit_documents()
-                    
-                    if not documents:
-                        st.error("No documents loaded")
-                        st.stop()
-                    
-                    st.success(f"Loaded {len(documents)} document(s)")
-                    
-                    # Step 3: Setup vector database
-                    st.info("Setting up vector database...")
-                    if not agent.setup_vector_db(documents):
-                        st.error("Failed to setup vector database")
-                        st.stop()
-                    
-                    # Step 4: Create session
-                    agent.create_session()
+                    # Connect to the permitting API, which holds the knowledge base
+                    st.info("Connecting to the permitting API...")
+                    agent = PermitAPIClient(Config.PERMIT_API_URL)
+                    agent.health()
                     
                     # Save to session state
                     st.session_state.agent = agent
@@ -725,7 +318,8 @@ def main():
                 }
                 
                 # Evaluate application
-                with st.spinner("🔄 Evaluating application... This may take a moment."):
+                with st.spinner("🔄 Evaluating application... This may take a moment."), \
+                        permit_metrics.operation(permit_metrics.OPERATION_EVALUATION):
                     try:
                         evaluation = st.session_state.agent.evaluate_application(application)
                         st.session_state.evaluation_history.append({
@@ -802,6 +396,8 @@ def main():
                             with st.expander("🔧 Debug: Raw Response"):
                                 st.text(evaluation["raw_response"])
                         
+                    except LLMOverloaded as e:
+                        st.warning(str(e))
                     except Exception as e:
                         st.error(f"Error during evaluation: {str(e)}")
                         st.exception(e)
@@ -822,16 +418,7 @@ def main():
             if not question:
                 st.warning("Please enter a question")
             else:
-                with st.spinner("Searching regulations..."):
-                    try:
-                        answer = st.session_state.agent.query_with_rag(question)
-                        
-                        st.markdown("---")
-                        st.subheader("Answer")
-                        st.markdown(answer)
-                        
-                    except Exception as e:
-                        st.error(f"Error: {str(e)}")
+                show_answer(question)
         
         # Common questions
         st.markdown("---")
@@ -850,14 +437,7 @@ def main():
         
         for q in common_questions:
             if st.button(q, key=f"common_{q}"):
-                with st.spinner("Searching regulations..."):
-                    try:
-                        answer = st.session_state.agent.query_with_rag(q)
-                        st.markdown("---")
-                        st.subheader("Answer")
-                        st.markdown(answer)
-                    except Exception as e:
-                        st.error(f"Error: {str(e)}")
+                show_answer(q)
     
     # ==================== TAB 3: Evaluation History ====================
     with tab3:
@@ -0,0 +1,147 @@
+""" Context Assembler
+
+Turns retrieved chunks into the context block of a prompt: near-identical
+chunks (overlapping windows of the same manual page, the same passage
+ingested twice) are dropped, the rest are ordered by relevance, optionally
+filtered by a minimum similarity score, and packed into a token budget,
+truncating the last chunk that does not fit.
+
+Tokens are counted with the model's Hugging Face tokenizer when one is named
+(needs transformers), otherwise estimated from the character count.
+"""
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# rough characters per token of English text, matching local_index
+CHARS_PER_TOKEN = 4
+
+# words per shingle when comparing chunks
+SHINGLE_SIZE = 5
+
+# a chunk that would get fewer tokens than this is dropped rather than truncated
+MIN_TRUNCATED_TOKENS = 64
+
+
+class EstimatedTokenizer:
+    """ Character based token estimate, for when no tokenizer is configured. """
+
+    def count(self, text: str) -> int:
+        """ Estimated tokens in the text. """
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """ Text cut to about max_tokens, on a word boundary where possible. """
+        limit = max_tokens * CHARS_PER_TOKEN
+        if len(text) <= limit:
+            return text
+        cut = text.rfind(" ", limit // 2, limit)
+        return text[:cut if cut != -1 else limit]
+
+
+class HuggingFaceTokenizer:
+    """ Counts tokens with a model's Hugging Face tokenizer. """
+
+    def __init__(self, model_id: str):
+        # pylint: disable=import-outside-toplevel
+        from transformers import AutoTokenizer
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id)
+
+    def count(self, text: str) -> int:
+        """ Tokens in the text. """
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """ The text's first max_tokens tokens. """
+        tokens = self.tokenizer.encode(text, add_special_tokens=False)
+        if len(tokens) <= max_tokens:
+            return text
+        return self.tokenizer.decode(tokens[:max_tokens])
+
+
+def load_tokenizer(model_id: str = None):
+    """ The model's tokenizer, or the character estimate when none is named or it cannot be loaded. """
+    if model_id:
+        try:
+            return HuggingFaceTokenizer(model_id)
+        except Exception as e:
+            logger.warning("Unable to load tokenizer %s, estimating tokens.  error=%s", model_id, e)
+    return EstimatedTokenizer()
+
+
+def shingles(text: str) -> set:
+    """ Overlapping word n-grams of the normalized text. """
+    words = re.findall(r"\w+", text.casefold())
+    if len(words) <= SHINGLE_SIZE:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+class ContextAssembler:
+    """ Deduplicates, orders, filters and budgets retrieved chunks. """
+
+    def __init__(self, token_budget: int, tokenizer=None, min_score: float = None,
+                 dedup_threshold: float = 0.8):
+        """
+        :param token_budget: Most tokens the chunks may take
+        :param tokenizer: Object with count(text) and truncate(text, max_tokens)
+        :param min_score: Chunks scored below this are dropped; unscored chunks are kept
+        :param dedup_threshold: Share of the smaller chunk's shingles that, when found
+            in an already selected chunk, makes it a duplicate
+        """
+        self.token_budget = token_budget
+        self.tokenizer = tokenizer or EstimatedTokenizer()
+        self.min_score = min_score
+        self.dedup_threshold = dedup_threshold
+
+    def assemble(self, chunks: list[dict]) -> tuple[list[str], dict]:
+        """ Selects the chunk texts to put in the prompt.
+
+        :param chunks: Dicts with the chunk text and its score (None if unknown), in retrieval order
+        :returns: The chunk texts, best first, and counts of what was dropped and kept
+        """
+        stats = {"retrieved": len(chunks), "below_score": 0, "duplicates": 0, "over_budget": 0,
+                 "truncated": 0, "tokens": 0}
+
+        candidates = []
+        for position, chunk in enumerate(chunks):
+            score = chunk.get("score")
+            if self.min_score is not None and score is not None and score < self.min_score:
+                stats["below_score"] += 1
+                continue
+            candidates.append((position, chunk))
+        # best score first; unscored chunks keep their retrieval order after scored ones
+        candidates.sort(key=lambda c: (c[1].get("score") is None, -(c[1].get("score") or 0), c[0]))
+
+        selected = []
+        selected_shingles = []
+        remaining = self.token_budget
+        for _, chunk in candidates:
+            text = chunk["text"].strip()
+            chunk_shingles = shingles(text)
+            if any(self.is_duplicate(chunk_shingles, other) for other in selected_shingles):
+                stats["duplicates"] += 1
+                continue
+
+            tokens = self.tokenizer.count(text)
+            if tokens > remaining:
+                if remaining < MIN_TRUNCATED_TOKENS:
+                    stats["over_budget"] += 1
+                    continue
+                text = self.tokenizer.truncate(text, remaining)
+                tokens = self.tokenizer.count(text)
+                stats["truncated"] += 1
+            selected.append(text)
+            selected_shingles.append(chunk_shingles)
+            remaining -= tokens
+            stats["tokens"] += tokens
+
+        stats["kept"] = len(selected)
+        logger.info("Assembled context.  %s", stats)
+        return selected, stats
+
+    def is_duplicate(self, chunk_shingles: set, other: set) -> bool:
+        """ Whether most of the smaller of two chunks appears in the other. """
+        smaller = min(len(chunk_shingles), len(other))
+        return smaller > 0 and len(chunk_shingles & other) / smaller >= self.dedup_threshold
@@ -0,0 +1,95 @@
+""" Retrieval Depth Benchmark
+
+Compares fixed depth retrieval (always five chunks) with adaptive depth on a
+labeled question set, reporting mean prompt tokens and recall of the labeled
+passages.  Passages are embedded through LLama Stack (or mock-llama-stack)
+into a local index, so both modes see the same similarity scores.
+
+    python depth_bench.py http://localhost:8321 all-MiniLM-L6-v2
+"""
+import json
+import statistics
+from collections import Counter
+import click
+from llama_stack_client import LlamaStackClient
+from context_assembler import ContextAssembler, EstimatedTokenizer
+from local_index import LlamaStackEmbedder, VectorIndex
+from retrieval_depth import DepthSelector, classify_query
+
+FIXED_DEPTH = 5
+
+
+def prompt_tokens(assembler: ContextAssembler, question: str, chunks: list[dict]) -> tuple[int, list[str]]:
+    """ Tokens of the prompt the mechanic chatbot would send, and its context chunks. """
+    context, stats = assembler.assemble(chunks)
+    return stats["tokens"] + assembler.tokenizer.count(question), context
+
+
+def recall(context: list[str], passages: dict, relevant: list[str]) -> float:
+    """ Share of the relevant passages that made it into the context. """
+    found = sum(1 for passage_id in relevant if any(passages[passage_id][:200] in text for text in context))
+    return found / len(relevant)
+
+
+@click.command()
+@click.argument('llama_stack_url')
+@click.argument('embedding_model')
+@click.option('--labels', default="assets/retrieval_labels.json", help="Labeled passages and questions")
+@click.option('--max-chunks', default=6, help="Adaptive depth for diagnostic questions")
+@click.option('--factual-chunks', default=3, help="Adaptive depth for factual questions")
+@click.option('--elbow-drop', default=0.25, help="Relative score drop that ends the selection")
+@click.option('--token-budget', default=3000, help="Context token budget")
+def cli(llama_stack_url: str, embedding_model: str, labels: str, max_chunks: int, factual_chunks: int,
+        elbow_drop: float, token_budget: int):
+    """ Reports prompt tokens and recall of fixed and adaptive retrieval depth. """
+    with open(labels, "r", encoding="utf-8") as f:
+        labeled = json.load(f)
+    passages = labeled["passages"]
+    questions = labeled["questions"]
+
+    embedder = LlamaStackEmbedder(LlamaStackClient(base_url=llama_stack_url), embedding_model)
+    texts = list(passages.values())
+    embeddings = embedder.embed(texts)
+    index = VectorIndex(embeddings.shape[1])
+    for passage_id, text, embedding in zip(passages, texts, embeddings):
+        index.add(passage_id, [text], embedding[None, :])
+    query_embeddings = embedder.embed([q["question"] for q in questions])
+
+    assembler = ContextAssembler(token_budget, EstimatedTokenizer())
+    selector = DepthSelector(max_chunks=max_chunks, factual_chunks=factual_chunks, elbow_drop=elbow_drop)
+    results = {"fixed": {"tokens": [], "recall": [], "chunks": []},
+               "adaptive": {"tokens": [], "recall": [], "chunks": []}}
+
+    print(f"{'class':>10} {'fixed':>6} {'adapt':>6} {'recall':>7}  question")
+    for labeled_question, query_embedding in zip(questions, query_embeddings):
+        question = labeled_question["question"]
+        relevant = labeled_question["relevant"]
+
+        fixed_chunks = index.search(query_embedding, k=FIXED_DEPTH)
+        query_class, depth = selector.depth(question)
+        adaptive_chunks = selector.cut(index.search(query_embedding, k=depth)) if depth else []
+
+        row = {}
+        for mode, chunks in (("fixed", fixed_chunks), ("adaptive", adaptive_chunks)):
+            tokens, context = prompt_tokens(assembler, question, chunks)
+            results[mode]["tokens"].append(tokens)
+            results[mode]["chunks"].append(len(context))
+            if relevant:
+                results[mode]["recall"].append(recall(context, passages, relevant))
+            row[mode] = len(context)
+        adaptive_recall = results["adaptive"]["recall"][-1] if relevant else float("nan")
+        print(f"{query_class:>10} {row['fixed']:>6} {row['adaptive']:>6} {adaptive_recall:>7.2f}  {question}")
+
+    print()
+    print(f"{'mode':>10} {'chunks':>7} {'tokens':>7} {'recall':>7}")
+    for mode, r in results.items():
+        print(f"{mode:>10} {statistics.fmean(r['chunks']):>7.2f} {statistics.fmean(r['tokens']):>7.0f} "
+              f"{statistics.fmean(r['recall']):>7.3f}")
+    fixed_tokens = statistics.fmean(results["fixed"]["tokens"])
+    adaptive_tokens = statistics.fmean(results["adaptive"]["tokens"])
+    print(f"Prompt token reduction: {1 - adaptive_tokens / fixed_tokens:.1%}")
+    print(f"Questions by class: {dict(Counter(classify_query(q['question']) for q in questions))}")
+
+
+if __name__ == '__main__':
+    cli()
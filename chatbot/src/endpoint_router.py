@@ -0,0 +1,305 @@
+""" LLama Stack Endpoint Router
+
+Spreads the chatbots' LLama Stack traffic over several replicas.  The router
+is an httpx transport, so it sits under both LlamaStackClient and the OpenAI
+client unchanged: they are created with ROUTED_BASE_URL and the router's
+http_client(), and every request is re-addressed to the endpoint chosen for
+it.
+
+  * Balancing picks the healthy endpoint with the lowest
+    (outstanding requests + 1) x EWMA latency, so slow or busy replicas get
+    less traffic.
+  * A background thread polls each endpoint's health path and ejects it after
+    consecutive failures (connection errors and 5xx responses in live
+    traffic count too), re-admitting it once it answers again.  With every
+    endpoint ejected, all are tried rather than failing outright.
+  * Requests that never reached an endpoint fail over to the next one.
+  * Idempotent requests (GETs and the configured read paths: retrieval,
+    embeddings) are hedged: if the first endpoint has not answered within the
+    path's recent latency percentile, the request is also sent to a second
+    endpoint and the first answer wins.
+"""
+import time
+import random
+import logging
+import threading
+import statistics
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import httpx
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+# Clients are created with this base URL; the router replaces it per request
+ROUTED_BASE_URL = "http://llama-stack.routed"
+
+DEFAULT_HEALTH_PATH = "/v1/health"
+DEFAULT_HEDGE_PATHS = ("/v1/tool-runtime/rag-tool/query", "/v1/vector-io/query", "/v1/inference/embeddings")
+
+# latency samples kept per path for the hedging percentile
+LATENCY_WINDOW = 200
+
+# connection failures, and these statuses, count against an endpoint's health
+UNHEALTHY_STATUSES = (502, 503, 504)
+
+REQUESTS = Counter("llama_stack_endpoint_requests_total", "Requests sent to each LLama Stack endpoint",
+                   ["endpoint", "outcome"])
+HEALTHY = Gauge("llama_stack_endpoint_healthy", "Whether the endpoint is in rotation", ["endpoint"])
+OUTSTANDING = Gauge("llama_stack_endpoint_outstanding", "Requests in flight per endpoint", ["endpoint"])
+HEDGES = Counter("llama_stack_hedged_requests_total", "Requests also sent to a second endpoint", ["winner"])
+FAILOVERS = Counter("llama_stack_failovers_total", "Requests retried on another endpoint")
+
+
+class Endpoint:
+    """ One LLama Stack replica and its load and health. """
+
+    def __init__(self, url: str):
+        self.url = httpx.URL(url.rstrip("/"))
+        self.name = str(self.url)
+        # a path prefix such as a proxy's /llama-stack is kept in front of every request path
+        self.prefix = self.url.path.rstrip("/")
+        self.outstanding = 0
+        self.ewma_seconds = None
+        self.healthy = True
+        self.failures = 0
+        HEALTHY.labels(self.name).set(1)
+
+    def cost(self, default_seconds: float) -> float:
+        """ Expected wait: queued requests times typical latency. """
+        latency = self.ewma_seconds if self.ewma_seconds is not None else default_seconds
+        return (self.outstanding + 1) * latency
+
+    def url_for(self, url: httpx.URL) -> httpx.URL:
+        """ The URL re-addressed to this endpoint. """
+        raw_path = self.prefix.encode("ascii") + url.raw_path
+        return url.copy_with(scheme=self.url.scheme, host=self.url.host, port=self.url.port, raw_path=raw_path)
+
+
+class EndpointRouter:
+    """ Least-outstanding, latency-weighted balancing with health checks and hedging. """
+
+    def __init__(self, urls: list[str], health_path: str = DEFAULT_HEALTH_PATH, health_interval: float = 5.0,
+                 unhealthy_threshold: int = 2, ewma_alpha: float = 0.3, hedge_percentile: int = 95,
+                 hedge_paths: tuple = DEFAULT_HEDGE_PATHS, hedge_min_samples: int = 20, transport=None):
+        """
+        :param urls: Base URLs of the replicas
+        :param health_interval: Seconds between health checks; 0 disables them
+        :param unhealthy_threshold: Consecutive failures that eject an endpoint
+        :param ewma_alpha: Weight of the newest latency sample
+        :param hedge_percentile: Path latency percentile after which a request is hedged; 0 disables hedging
+        :param hedge_paths: POST paths that are safe to send twice (GETs always are)
+        :param hedge_min_samples: Samples needed before a path is hedged
+        :param transport: Transport for the actual requests (default httpx.HTTPTransport)
+        """
+        if not urls:
+            raise ValueError("At least one LLama Stack endpoint is required")
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.health_path = health_path
+        self.health_interval = health_interval
+        self.unhealthy_threshold = unhealthy_threshold
+        self.ewma_alpha = ewma_alpha
+        self.hedge_percentile = hedge_percentile
+        self.hedge_paths = tuple(hedge_paths)
+        self.hedge_min_samples = hedge_min_samples
+        self.transport = transport or httpx.HTTPTransport()
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llama-stack-hedge")
+        self._health_thread = None
+
+    # ---- balancing
+
+    def choose(self, exclude: tuple = ()) -> Endpoint:
+        """ The endpoint for the next request, or None when every endpoint is excluded. """
+        with self._lock:
+            candidates = [e for e in self.endpoints if e not in exclude]
+            healthy = [e for e in candidates if e.healthy]
+            # fail open: with nothing healthy, try the rest anyway
+            candidates = healthy or candidates
+            if not candidates:
+                return None
+            known = [e.ewma_seconds for e in self.endpoints if e.ewma_seconds is not None]
+            default = statistics.fmean(known) if known else 1.0
+            best = min(e.cost(default) for e in candidates)
+            endpoint = random.choice([e for e in candidates if e.cost(default) == best])
+            endpoint.outstanding += 1
+        OUTSTANDING.labels(endpoint.name).inc()
+        return endpoint
+
+    def finished(self, endpoint: Endpoint, path: str, seconds: float = None, failed: bool = False):
+        """ Records the end of a request to the endpoint. """
+        with self._lock:
+            endpoint.outstanding -= 1
+            if seconds is not None:
+                self._observe(endpoint, seconds)
+                self._latencies.setdefault(path, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+        OUTSTANDING.labels(endpoint.name).dec()
+        REQUESTS.labels(endpoint.name, "failure" if failed else "success").inc()
+        self.record_health(endpoint, not failed)
+
+    def _observe(self, endpoint: Endpoint, seconds: float):
+        """ Folds a latency sample into the endpoint's EWMA.  Called with the lock held. """
+        endpoint.ewma_seconds = seconds if endpoint.ewma_seconds is None else \
+            self.ewma_alpha * seconds + (1 - self.ewma_alpha) * endpoint.ewma_seconds
+
+    def hedge_delay(self, request: httpx.Request):
+        """ Seconds to wait before hedging the request, or None when it is not hedged. """
+        if self.hedge_percentile <= 0 or len(self.endpoints) < 2:
+            return None
+        if request.method != "GET" and not request.url.path.endswith(self.hedge_paths):
+            return None
+        with self._lock:
+            samples = list(self._latencies.get(request.url.path, ()))
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return statistics.quantiles(samples, n=100)[self.hedge_percentile - 1]
+
+    # ---- health
+
+    def record_health(self, endpoint: Endpoint, ok: bool):
+        """ Ejects the endpoint after consecutive failures and re-admits it on success. """
+        with self._lock:
+            if ok:
+                endpoint.failures = 0
+                changed = not endpoint.healthy
+                endpoint.healthy = True
+            else:
+                endpoint.failures += 1
+                changed = endpoint.healthy and endpoint.failures >= self.unhealthy_threshold
+                if changed:
+                    endpoint.healthy = False
+        if changed:
+            HEALTHY.labels(endpoint.name).set(1 if endpoint.healthy else 0)
+            logger.warning("LLama Stack endpoint %s.  Endpoint=%s",
+                           "restored" if endpoint.healthy else "ejected", endpoint.name)
+
+    def check_health(self):
+        """ Polls every endpoint's health path once.
+
+        Probe latency is folded into the EWMA too, so an endpoint that was slow
+        and lost its traffic is seen to recover.
+        """
+        for endpoint in self.endpoints:
+            start = time.perf_counter()
+            try:
+                request = httpx.Request("GET", endpoint.url_for(httpx.URL(self.health_path)),
+                                        extensions={"timeout": {"connect": 2.0, "read": 2.0,
+                                                                "write": 2.0, "pool": 2.0}})
+                response = self.transport.handle_request(request)
+                response.read()
+                response.close()
+                ok = response.status_code < 500
+            except httpx.TransportError:
+                ok = False
+            if ok:
+                with self._lock:
+                    self._observe(endpoint, time.perf_counter() - start)
+            self.record_health(endpoint, ok)
+
+    def start_health_checks(self):
+        """ Starts polling endpoint health in the background, once. """
+        if self.health_interval <= 0 or self._health_thread is not None:
+            return
+
+        def run():
+            while True:
+                self.check_health()
+                time.sleep(self.health_interval)
+
+        self._health_thread = threading.Thread(target=run, name="llama-stack-health", daemon=True)
+        self._health_thread.start()
+
+    # ---- clients
+
+    def http_client(self, **kwargs) -> httpx.Client:
+        """ An httpx client whose requests are routed across the endpoints. """
+        return httpx.Client(transport=RoutingTransport(self), **kwargs)
+
+
+class _TrackedStream(httpx.SyncByteStream):
+    """ Response body that tells the router when the request is really over. """
+
+    def __init__(self, stream, on_close):
+        self.stream = stream
+        self.on_close = on_close
+
+    def __iter__(self):
+        yield from self.stream
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            if self.on_close is not None:
+                self.on_close()
+                self.on_close = None
+
+
+class RoutingTransport(httpx.BaseTransport):
+    """ Sends each request to the endpoint the router picks. """
+
+    def __init__(self, router: EndpointRouter):
+        self.router = router
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        delay = self.router.hedge_delay(request)
+        if delay is None:
+            return self.send(request)
+
+        executor = self.router._executor    # pylint: disable=protected-access
+        primary = self.router.choose()
+        first = executor.submit(self.send, request, endpoint=primary)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+        second = executor.submit(self.send, request, exclude=(primary,))
+        done, _ = wait([first, second], return_when=FIRST_COMPLETED)
+        winner = next(iter(done))
+        loser = second if winner is first else first
+        if winner.exception() is not None:
+            winner, loser = loser, winner
+        HEDGES.labels("hedge" if winner is second else "primary").inc()
+        loser.add_done_callback(lambda f: f.exception() is None and f.result().close())
+        return winner.result()
+
+    def send(self, request: httpx.Request, exclude: tuple = (), endpoint: Endpoint = None) -> httpx.Response:
+        """ Sends to the best endpoint, failing over while no endpoint has been reached.
+
+        :param exclude: Endpoints not to use
+        :param endpoint: Endpoint already chosen for the first attempt
+        """
+        tried = list(exclude)
+        while True:
+            endpoint = endpoint or self.router.choose(exclude=tuple(tried))
+            if endpoint is None:
+                raise httpx.ConnectError("No LLama Stack endpoint could be reached", request=request)
+            try:
+                return self.send_to(request, endpoint)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                tried.append(endpoint)
+                FAILOVERS.inc()
+                logger.warning("LLama Stack endpoint unreachable, failing over.  Endpoint=%s", endpoint.name)
+                endpoint = None
+
+    def send_to(self, request: httpx.Request, endpoint: Endpoint) -> httpx.Response:
+        """ Sends the request to one endpoint, already counted as outstanding. """
+        path = request.url.path
+        url = endpoint.url_for(request.url)
+        headers = [(k, v) for k, v in request.headers.raw if k.lower() != b"host"]
+        routed = httpx.Request(request.method, url, headers=headers, content=request.content,
+                               extensions=request.extensions)
+        start = time.perf_counter()
+        try:
+            response = self.router.transport.handle_request(routed)
+        except httpx.TransportError:
+            self.router.finished(endpoint, path, failed=True)
+            raise
+
+        # latency is time to the response headers; the request stays outstanding until the body is closed
+        seconds = time.perf_counter() - start
+        failed = response.status_code in UNHEALTHY_STATUSES
+        response.stream = _TrackedStream(response.stream, lambda: self.router.finished(
+            endpoint, path, None if failed else seconds, failed))
+        return response
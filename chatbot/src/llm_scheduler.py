@@ -0,0 +1,176 @@
+""" LLM Admission Scheduler
+
+Process-wide admission control for calls to the inference server.  Every
+Streamlit session runs in its own thread, so without it a burst of
+application evaluations can put dozens of long completions on the model
+server at once and slow every chat turn.  Calls take a slot before they run:
+
+  * at most max_concurrent calls run at once, and each lane (interactive
+    questions, scorecard evaluations) has its own cap, so evaluations can
+    never hold every slot;
+  * when both lanes are waiting, free slots are shared by weight (smooth
+    weighted round robin, interactive first), so neither lane starves;
+  * within a lane, sessions take turns, so one session submitting many
+    requests cannot delay the others;
+  * requests are shed with LLMOverloaded, carrying a message for the user,
+    when the queue is too deep or a request has waited too long.
+"""
+import time
+import logging
+import threading
+import contextlib
+from collections import OrderedDict, deque
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+LANE_INTERACTIVE = "interactive"
+LANE_EVALUATION = "evaluation"
+LANES = (LANE_INTERACTIVE, LANE_EVALUATION)
+
+SHED_QUEUE_FULL = "queue_full"
+SHED_TIMEOUT = "timeout"
+
+OVERLOADED_MESSAGE = ("The assistant is busy with other requests right now. "
+                      "Please try again in a minute.")
+
+QUEUE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+QUEUE_SECONDS = Histogram("llm_scheduler_queue_seconds", "Time LLM calls waited for a slot",
+                          ["lane"], buckets=QUEUE_BUCKETS)
+QUEUE_DEPTH = Gauge("llm_scheduler_queue_depth", "LLM calls waiting for a slot", ["lane"])
+IN_FLIGHT = Gauge("llm_scheduler_in_flight", "LLM calls holding a slot", ["lane"])
+SHED = Counter("llm_scheduler_shed_total", "LLM calls rejected by load shedding", ["lane", "reason"])
+
+
+class LLMOverloaded(Exception):
+    """ A call was shed; str() is a message fit to show the user. """
+
+    def __init__(self, lane: str, reason: str):
+        super().__init__(OVERLOADED_MESSAGE)
+        self.lane = lane
+        self.reason = reason
+
+
+class _Ticket:
+    """ One call waiting for, or holding, a slot. """
+
+    def __init__(self, lane: str, session_id: str):
+        self.lane = lane
+        self.session_id = session_id
+        self.enqueued = time.perf_counter()
+        self.granted = threading.Event()
+        self.wait_seconds = 0.0
+
+
+class AdmissionScheduler:
+    """ Concurrency cap with priority lanes, per session fairness and load shedding. """
+
+    def __init__(self, max_concurrent: int, max_queue: int, max_wait_seconds: float,
+                 lane_limits: dict = None, lane_weights: dict = None):
+        """
+        :param max_concurrent: Calls allowed to run at once; 0 disables admission control
+        :param max_queue: Waiting calls allowed before new ones are shed
+        :param max_wait_seconds: Longest a call may wait for a slot before it is shed
+        :param lane_limits: Calls allowed to run at once per lane (default: evaluations get half)
+        :param lane_weights: Share of free slots per lane when both are waiting (default 3:1)
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.lane_limits = lane_limits or {LANE_INTERACTIVE: max_concurrent,
+                                           LANE_EVALUATION: max(1, max_concurrent // 2)}
+        self.lane_weights = lane_weights or {LANE_INTERACTIVE: 3, LANE_EVALUATION: 1}
+        self._lock = threading.Lock()
+        # waiting tickets by lane, then by session in round robin order
+        self._waiting = {lane: OrderedDict() for lane in LANES}
+        self._queued = {lane: 0 for lane in LANES}
+        self._running = {lane: 0 for lane in LANES}
+        self._credit = {lane: 0 for lane in LANES}
+
+    @contextlib.contextmanager
+    def slot(self, lane: str, session_id: str):
+        """ Holds a slot for the duration of an LLM call, including reading its stream.
+
+        :returns: The ticket, whose wait_seconds is the time spent queued
+        :raises LLMOverloaded: The call was shed
+        """
+        if self.max_concurrent <= 0:
+            yield _Ticket(lane, session_id)
+            return
+        ticket = self._acquire(lane, session_id)
+        try:
+            yield ticket
+        finally:
+            self._release(ticket)
+
+    def stats(self) -> dict:
+        """ Waiting and running calls per lane. """
+        with self._lock:
+            return {"queued": dict(self._queued), "running": dict(self._running)}
+
+    def _acquire(self, lane: str, session_id: str) -> _Ticket:
+        ticket = _Ticket(lane, session_id)
+        with self._lock:
+            if sum(self._queued.values()) >= self.max_queue:
+                self._shed(ticket, SHED_QUEUE_FULL)
+            self._waiting[lane].setdefault(session_id, deque()).append(ticket)
+            self._queued[lane] += 1
+            QUEUE_DEPTH.labels(lane).inc()
+            self._dispatch()
+
+        if not ticket.granted.wait(self.max_wait_seconds):
+            with self._lock:
+                # the slot may have been granted just as the wait timed out
+                if not ticket.granted.is_set():
+                    queue = self._waiting[lane][session_id]
+                    queue.remove(ticket)
+                    if not queue:
+                        del self._waiting[lane][session_id]
+                    self._queued[lane] -= 1
+                    QUEUE_DEPTH.labels(lane).dec()
+                    self._shed(ticket, SHED_TIMEOUT)
+        return ticket
+
+    def _release(self, ticket: _Ticket):
+        with self._lock:
+            self._running[ticket.lane] -= 1
+            IN_FLIGHT.labels(ticket.lane).dec()
+            self._dispatch()
+
+    def _shed(self, ticket: _Ticket, reason: str):
+        SHED.labels(ticket.lane, reason).inc()
+        logger.warning("Shedding LLM call.  Lane=%s. Session=%s. Reason=%s. Queued=%s. Running=%s",
+                       ticket.lane, ticket.session_id, reason, self._queued, self._running)
+        raise LLMOverloaded(ticket.lane, reason)
+
+    def _dispatch(self):
+        """ Grants free slots to waiting tickets.  Called with the lock held. """
+        while sum(self._running.values()) < self.max_concurrent:
+            lanes = [lane for lane in LANES
+                     if self._waiting[lane] and self._running[lane] < self.lane_limits[lane]]
+            if not lanes:
+                return
+
+            # smooth weighted round robin between the lanes that can run
+            for lane in lanes:
+                self._credit[lane] += self.lane_weights[lane]
+            lane = max(lanes, key=lambda l: self._credit[l])
+            self._credit[lane] -= sum(self.lane_weights[l] for l in lanes)
+
+            # round robin between the lane's sessions
+            sessions = self._waiting[lane]
+            session_id, queue = next(iter(sessions.items()))
+            ticket = queue.popleft()
+            if queue:
+                sessions.move_to_end(session_id)
+            else:
+                del sessions[session_id]
+
+            self._queued[lane] -= 1
+            self._running[lane] += 1
+            QUEUE_DEPTH.labels(lane).dec()
+            IN_FLIGHT.labels(lane).inc()
+            ticket.wait_seconds = time.perf_counter() - ticket.enqueued
+            QUEUE_SECONDS.labels(lane).observe(ticket.wait_seconds)
+            ticket.granted.set()
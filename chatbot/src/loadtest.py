@@ -0,0 +1,231 @@
+""" Chatbot Load Generator
+
+Drives many concurrent Streamlit sessions through app.py (mechanic chatbot) or
+city-permitting-streamlit.py, normally against mock-llama-stack, to size pods.
+Sessions are run in this process with Streamlit's AppTest harness, so the
+process stands in for one pod: for each session count it reports turn latency
+percentiles, time to first token (streaming responses only), mean prompt
+tokens per model call and the process' resident memory with that many
+sessions alive.  The permitting app's API (permit_api.py) is served from this
+process too, so the figures cover the UI and the agent together.
+
+    python loadtest.py --app mechanic --sessions 1 --sessions 10 --sessions 25 --turns 3
+"""
+import os
+import sys
+import time
+import logging
+import statistics
+import socket
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+import click
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+import uvicorn
+from streamlit.testing.v1 import AppTest
+from tracing import ATTR_INPUT_TOKENS, ATTR_TIME_TO_FIRST_TOKEN
+
+APP_MECHANIC = "mechanic"
+APP_PERMITTING = "permitting"
+APP_FILES = {
+    APP_MECHANIC: "app.py",
+    APP_PERMITTING: "city-permitting-streamlit.py",
+}
+
+QUESTIONS = [
+    "How do I adjust the headlight vacuum actuators?",
+    "What are the water tank requirements for a food truck?",
+    "Where can I operate my food truck in Denver?",
+    "What fire safety equipment is required?",
+]
+
+# Required permit application fields: (widget type, label, value)
+APPLICATION = [
+    ("text_input", "Business Name *", "Load Test Tacos"),
+    ("text_input", "Operator Name *", "Load Tester"),
+    ("text_area", "Menu Items *", "Tacos\nBurritos"),
+    ("text_input", "Commissary Name *", "Mock Commissary"),
+    ("text_area", "Commissary Address *", "1 Main St, Denver, CO"),
+    ("text_area", "Proposed Operating Locations *", "16th Street Mall"),
+]
+
+logger = logging.getLogger(__name__)
+
+
+def find(elements, label: str):
+    """ First widget whose label contains the text. """
+    return next(e for e in elements if label in e.label)
+
+
+class Session:
+    """ One simulated browser session of an app. """
+
+    def __init__(self, app: str, timeout: float):
+        self.app = app
+        self.at = AppTest.from_file(APP_FILES[app], default_timeout=timeout)
+
+    def start(self):
+        """ Loads the page and, for the permitting app, initializes the agent. """
+        self.run(self.at)
+        if self.app == APP_PERMITTING:
+            self.run(find(self.at.button, "Initialize Agent").click())
+
+    def turn(self, number: int, kind: str) -> float:
+        """ Runs one chat turn, returning its latency. """
+        question = QUESTIONS[number % len(QUESTIONS)]
+        if self.app == APP_MECHANIC:
+            widget = self.at.chat_input[0].set_value(question)
+        elif kind == "evaluation" or (kind == "mixed" and number % 2):
+            for widget_type, label, value in APPLICATION:
+                find(getattr(self.at, widget_type), label).set_value(value)
+            widget = find(self.at.button, "Evaluate Application").click()
+        else:
+            find(self.at.text_area, "Your Question").set_value(question)
+            widget = find(self.at.button, "Get Answer").click()
+
+        start = time.perf_counter()
+        self.run(widget)
+        return time.perf_counter() - start
+
+    @staticmethod
+    def run(widget):
+        """ Runs the script, failing on any exception the app displayed. """
+        at = widget.run()
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+        if at.error:
+            raise RuntimeError(at.error[0].value)
+
+
+def start_permit_api() -> str:
+    """ Serves the permitting API from a thread of this process, returning its URL. """
+    from permit_api import create_app     # pylint: disable=import-outside-toplevel
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(create_app(), host="127.0.0.1", port=port, log_level="warning"))
+    # Streamlit gives uvicorn's access log a handler of its own
+    logging.getLogger("uvicorn.access").disabled = True
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("Permitting API failed to start")
+        time.sleep(0.1)
+    return f"http://127.0.0.1:{port}"
+
+
+def resident_memory_mb() -> float:
+    """ Resident set size of this process. """
+    try:
+        with open("/proc/self/statm", "r", encoding="utf-8") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        import resource     # pylint: disable=import-outside-toplevel
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def percentile(values: list[float], p: int) -> float:
+    """ p-th percentile, or NaN when there are no values. """
+    if not values:
+        return float("nan")
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100)[p - 1]
+
+
+def run_level(app: str, session_count: int, turns: int, kind: str, timeout: float,
+              spans: InMemorySpanExporter) -> dict:
+    """ Runs turns on session_count concurrent sessions. """
+    spans.clear()
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def run_session(session_number: int):
+        session = Session(app, timeout)
+        try:
+            session.start()
+            for number in range(turns):
+                latency = session.turn(session_number + number, kind)
+                with lock:
+                    latencies.append(latency)
+        except Exception as e:
+            logger.warning("Session %s failed.  error=%s", session_number, e)
+            with lock:
+                errors.append(e)
+        return session
+
+    with ThreadPoolExecutor(max_workers=session_count) as executor:
+        sessions = list(executor.map(run_session, range(session_count)))
+    memory = resident_memory_mb()
+    del sessions
+
+    finished = spans.get_finished_spans()
+    ttfts = [span.attributes[ATTR_TIME_TO_FIRST_TOKEN] for span in finished
+             if ATTR_TIME_TO_FIRST_TOKEN in span.attributes]
+    prompt_tokens = [span.attributes[ATTR_INPUT_TOKENS] for span in finished
+                     if ATTR_INPUT_TOKENS in span.attributes]
+    return {
+        "sessions": session_count,
+        "turns": len(latencies),
+        "errors": len(errors),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "ttft_p50": percentile(ttfts, 50),
+        "ttft_p95": percentile(ttfts, 95),
+        "prompt_tokens": statistics.fmean(prompt_tokens) if prompt_tokens else float("nan"),
+        "rss_mb": memory,
+    }
+
+
+@click.command()
+@click.option('--app', type=click.Choice([APP_MECHANIC, APP_PERMITTING]), default=APP_MECHANIC)
+@click.option('--sessions', multiple=True, type=int, default=[1, 5, 10], help="Concurrent session counts to step through")
+@click.option('--turns', default=3, help="Chat turns per session")
+@click.option('--turn-type', type=click.Choice(["question", "evaluation", "mixed"]), default="mixed",
+              help="Permitting app turns: questions, application evaluations or both")
+@click.option('--llama-stack-url', default="http://localhost:8321", help="LLama Stack (or mock) to call")
+@click.option('--model', default="llama32", help="Model for the mechanic chatbot")
+@click.option('--timeout', default=300.0, help="Seconds allowed per script run")
+def cli(app: str, sessions: list, turns: int, turn_type: str, llama_stack_url: str, model: str, timeout: float):
+    """ Steps through session counts and reports latency, TTFT, prompt tokens and memory. """
+    logging.basicConfig(level=logging.WARNING)
+
+    # configure both apps for the target LLama Stack, without side effects
+    # that would clash between sessions in one process
+    host, _, port = llama_stack_url.split("//")[-1].partition(":")
+    os.environ.update(LLAMA_STACK_URL=llama_stack_url, API_KEY=os.environ.get("API_KEY", "nokeyneeded"),
+                      MODEL=model, LLAMA_STACK_HOST=host, LLAMA_STACK_PORT=port or "80",
+                      PERMIT_DOCS_OFFLINE="true", METRICS_PORT="0")
+
+    # the apps' process_user_chat spans carry time to first token
+    spans = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(spans))
+    trace.set_tracer_provider(provider)
+
+    # the permitting app is a client of its API, read from the environment
+    if app == APP_PERMITTING:
+        os.environ["PERMIT_API_URL"] = start_permit_api()
+
+    print(f"App: {app}  Turns/session: {turns}  Baseline RSS: {resident_memory_mb():.0f}MB")
+    print(f"{'sessions':>8} {'turns':>6} {'errors':>6} {'p50':>7} {'p95':>7} {'p99':>7} "
+          f"{'ttft50':>7} {'ttft95':>7} {'prompt':>7} {'rss_mb':>7}")
+    for session_count in sessions:
+        # the mechanic chatbot echoes every streamed token to stdout
+        with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+            r = run_level(app, session_count, turns, turn_type, timeout, spans)
+        print(f"{r['sessions']:>8} {r['turns']:>6} {r['errors']:>6} {r['p50']:>7.2f} {r['p95']:>7.2f} "
+              f"{r['p99']:>7.2f} {r['ttft_p50']:>7.2f} {r['ttft_p95']:>7.2f} {r['prompt_tokens']:>7.0f} "
+              f"{r['rss_mb']:>7.0f}")
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,259 @@
+""" Local Vector Index
+
+In-process retrieval engine for small corpora (the Denver permit PDFs, the
+fallback requirements, a single service manual).  Chunk embeddings are held
+in one contiguous, L2 normalized float32 matrix (optionally int8 quantized)
+so a query is a single matrix-vector product and a top-k partition, with no
+network hop.  Chunk text and document ids are kept in compact arrays rather
+than per chunk objects.
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# LLama Stack chunks by tokens; this is the rough character equivalent
+CHARS_PER_TOKEN = 4
+
+
+def chunk_text(text: str, chunk_size_in_tokens: int = 512, overlap_in_tokens: int = 64) -> list[str]:
+    """ Splits text into overlapping chunks, preferring paragraph and line breaks. """
+    size = chunk_size_in_tokens * CHARS_PER_TOKEN
+    overlap = overlap_in_tokens * CHARS_PER_TOKEN
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            # end on a paragraph, then a line, break in the second half of the chunk
+            for separator in ("\n\n", "\n", " "):
+                split = text.rfind(separator, start + size // 2, end)
+                if split != -1:
+                    end = split
+                    break
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+class LlamaStackEmbedder:
+    """ Embeds text with an embedding model served by LLama Stack. """
+
+    def __init__(self, client, model_id: str, batch_size: int = 64):
+        self.client = client
+        self.model_id = model_id
+        self.batch_size = batch_size
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """ Embeddings of the texts, one float32 row per text. """
+        rows = []
+        for i in range(0, len(texts), self.batch_size):
+            response = self.client.inference.embeddings(model_id=self.model_id,
+                                                        contents=texts[i:i + self.batch_size])
+            rows.extend(response.embeddings)
+        return np.asarray(rows, dtype=np.float32)
+
+
+class QueryEmbeddingCache:
+    """ Size bounded LRU cache of query embeddings, keyed by embedding model and
+        normalized query text, so common and repeated questions skip the
+        embedding call.  Thread safe, so one instance can serve every session.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.miss_seconds = 0.0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """ Case and whitespace insensitive form of a query. """
+        return " ".join(text.casefold().split())
+
+    def embed_query(self, embedder, text: str) -> tuple[np.ndarray, bool]:
+        """ Embedding of the query, from the cache when possible.
+
+        :param embedder: Object with a model_id and an embed(texts) method
+        :returns: The embedding and whether it was a cache hit
+        """
+        key = (embedder.model_id, self.normalize(text))
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return embedding, True
+
+        # embed outside the lock; concurrent misses on one query both embed it
+        start = time.perf_counter()
+        embedding = embedder.embed([text])[0]
+        elapsed = time.perf_counter() - start
+        embedding.flags.writeable = False
+        with self._lock:
+            self.misses += 1
+            self.miss_seconds += elapsed
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return embedding, False
+
+    @property
+    def hit_rate(self) -> float:
+        """ Fraction of lookups served from the cache. """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    @property
+    def average_miss_seconds(self) -> float:
+        """ Mean latency of the embedding calls made on misses. """
+        return self.miss_seconds / self.misses if self.misses else 0.0
+
+    @property
+    def saved_seconds(self) -> float:
+        """ Embedding latency avoided by hits, estimated from the mean miss latency. """
+        return self.hits * self.average_miss_seconds
+
+    def stats(self) -> dict:
+        """ Size, hit rate and saved latency of the cache. """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hit_rate,
+                "saved_seconds": self.saved_seconds,
+            }
+
+
+class VectorIndex:
+    """ Cosine similarity index over an in-memory embedding matrix. """
+
+    def __init__(self, dimension: int, quantize: bool = False):
+        self.dimension = dimension
+        self.quantize = quantize
+        # int8 rows are scaled to +/-127 per row; scales undo that at query time
+        self.vectors = np.empty((0, dimension), dtype=np.int8 if quantize else np.float32)
+        self.scales = np.empty(0, dtype=np.float32)
+        # chunk i is text[offsets[i]:offsets[i + 1]] from document document_ids[documents[i]]
+        self.text = ""
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.documents = np.empty(0, dtype=np.int32)
+        self.document_ids = []
+
+    @classmethod
+    def from_arrays(cls, vectors, scales, text: str, offsets, documents, document_ids: list[str]):
+        """ Wraps existing arrays (e.g. memory-mapped from a snapshot) without copying.
+            Rows of vectors must already be L2 normalized.
+        """
+        index = cls(vectors.shape[1], quantize=vectors.dtype == np.int8)
+        index.vectors = vectors
+        index.scales = scales
+        index.text = text
+        index.offsets = offsets
+        index.documents = documents
+        index.document_ids = list(document_ids)
+        return index
+
+    def __len__(self):
+        return len(self.documents)
+
+    @property
+    def nbytes(self) -> int:
+        """ Memory held by the embeddings and metadata arrays. """
+        return self.vectors.nbytes + self.scales.nbytes + self.offsets.nbytes + self.documents.nbytes
+
+    def add(self, document_id: str, chunks: list[str], embeddings: np.ndarray):
+        """ Adds a document's chunks and their embeddings. """
+        if len(chunks) != len(embeddings):
+            raise ValueError(f"{len(chunks)} chunks but {len(embeddings)} embeddings")
+        if not chunks:
+            return
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.shape[1] != self.dimension:
+            raise ValueError(f"Expected dimension {self.dimension} but got {embeddings.shape[1]}")
+
+        # normalize so the dot product is cosine similarity
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.maximum(norms, 1e-12)
+        if self.quantize:
+            scales = np.abs(embeddings).max(axis=1) / 127
+            rows = np.round(embeddings / np.maximum(scales, 1e-12)[:, None]).astype(np.int8)
+        else:
+            scales = np.ones(len(embeddings), dtype=np.float32)
+            rows = embeddings
+        self.vectors = np.concatenate([self.vectors, rows])
+        self.scales = np.concatenate([self.scales, scales.astype(np.float32)])
+
+        lengths = np.fromiter((len(c) for c in chunks), dtype=np.int64, count=len(chunks))
+        self.offsets = np.concatenate([self.offsets, self.offsets[-1] + np.cumsum(lengths)])
+        self.text += "".join(chunks)
+        self.document_ids.append(document_id)
+        self.documents = np.concatenate([self.documents,
+                                         np.full(len(chunks), len(self.document_ids) - 1, dtype=np.int32)])
+
+    def search(self, query_embedding, k: int = 5) -> list[dict]:
+        """ The k chunks most similar to the query embedding, best first.
+
+            Returns dicts with the chunk text, document_id and cosine score.
+        """
+        if len(self) == 0:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32).ravel()
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+        scores = self.vectors @ query
+        if self.quantize:
+            scores = scores * self.scales
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [self.chunk(i) | {"score": float(scores[i])} for i in top]
+
+    def chunk(self, i: int) -> dict:
+        """ Text and document of chunk i. """
+        return {
+            "text": self.text[self.offsets[i]:self.offsets[i + 1]],
+            "document_id": self.document_ids[self.documents[i]],
+        }
+
+
+def build_index(documents: dict[str, str], embedder, max_chunks: int,
+                chunk_size_in_tokens: int = 512, quantize: bool = False):
+    """ Chunks and embeds the documents into a VectorIndex.
+
+    :param documents: Document text, by document id
+    :param embedder: Object with an embed(texts) method returning a float32 matrix
+    :param max_chunks: Largest corpus to hold locally
+    :returns: The index, or None when the corpus has more than max_chunks chunks
+    """
+    chunked = {doc_id: chunk_text(text, chunk_size_in_tokens) for doc_id, text in documents.items()}
+    chunk_count = sum(len(chunks) for chunks in chunked.values())
+    if chunk_count > max_chunks:
+        logger.warning("Corpus of %s chunks is over the local index limit of %s", chunk_count, max_chunks)
+        return None
+
+    start = time.perf_counter()
+    index = None
+    for doc_id, chunks in chunked.items():
+        if not chunks:
+            continue
+        embeddings = embedder.embed(chunks)
+        if index is None:
+            index = VectorIndex(embeddings.shape[1], quantize=quantize)
+        index.add(doc_id, chunks, embeddings)
+    if index is None:
+        return None
+    logger.info("Built local index.  Chunks=%s. Bytes=%s. Seconds=%.2f",
+                len(index), index.nbytes, time.perf_counter() - start)
+    return index
@@ -0,0 +1,198 @@
+""" Model Cascade
+
+Routes LLM calls between a small, fast model and a large one.  Simple
+retrieval grounded questions go to the small model first; tasks that need
+the large model's judgement (application scorecards) go straight to it.  A
+small model answer is checked before it is used, and the call is escalated
+to the large model when the answer:
+
+  * is empty or too short to be an answer,
+  * was cut off by the token limit,
+  * says it is unsure or that the context does not cover the question,
+  * is not in the required format (a JSON object, for JSON tasks).
+
+Routing decisions, escalations and latency per tier are exported as
+llm_cascade_* Prometheus metrics.  With no small model configured every call
+goes to the large model.
+
+Streamed calls pass the answer on as it arrives; when the small model's
+answer fails its checks a reset event tells the consumer to discard what it
+has shown and the large model's answer is streamed in its place.
+"""
+import re
+import json
+import time
+import logging
+from typing import Callable, Generator, Iterator, Optional
+from prometheus_client import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+TIER_SMALL = "small"
+TIER_LARGE = "large"
+
+TASK_QUESTION = "question"
+TASK_EVALUATION = "evaluation"
+
+ESCALATE_EMPTY = "empty"
+ESCALATE_TRUNCATED = "truncated"
+ESCALATE_UNSURE = "unsure"
+ESCALATE_FORMAT = "format"
+
+# events of a streamed cascade call
+EVENT_DELTA = "delta"
+EVENT_RESET = "reset"
+EVENT_DONE = "done"
+
+# stop reasons of LLama Stack chat_completion and the OpenAI APIs meaning the answer was cut off
+TRUNCATED_STOP_REASONS = ("out_of_tokens", "length", "max_output_tokens")
+
+UNSURE_PHRASES = (
+    "i'm not sure", "i am not sure", "i don't know", "i do not know", "i cannot determine",
+    "i can't determine", "unable to determine", "not enough information", "insufficient information",
+    "do not cover", "does not cover", "not mentioned in", "not provided in",
+)
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+ROUTED = Counter("llm_cascade_routed_total", "LLM calls by task and the tier first tried", ["task", "tier"])
+ANSWERED = Counter("llm_cascade_answered_total", "LLM calls by task and the tier that answered", ["task", "tier"])
+ESCALATIONS = Counter("llm_cascade_escalations_total", "Small model answers escalated to the large model",
+                      ["task", "reason"])
+TIER_SECONDS = Histogram("llm_cascade_seconds", "Latency of each model call by tier", ["tier"],
+                         buckets=LATENCY_BUCKETS)
+
+
+class CascadeResult:
+    """ The answer used, the tier that gave it, and the escalation reason if any. """
+
+    def __init__(self, text: str, tier: str, model: str, escalation: str = None, seconds: float = 0.0):
+        self.text = text
+        self.tier = tier
+        self.model = model
+        self.escalation = escalation
+        self.seconds = seconds
+
+
+class ModelCascade:
+    """ Small model first, large model for hard tasks and failed answers. """
+
+    def __init__(self, small_model: str, large_model: str, large_tasks: tuple = (TASK_EVALUATION,),
+                 json_tasks: tuple = (TASK_EVALUATION,), min_answer_chars: int = 20,
+                 unsure_phrases: tuple = UNSURE_PHRASES):
+        """
+        :param small_model: Model tried first; empty disables the cascade
+        :param large_model: Model for large_tasks and escalations
+        :param large_tasks: Tasks sent straight to the large model
+        :param json_tasks: Tasks whose answer must contain a JSON object
+        :param min_answer_chars: Shorter answers are escalated
+        :param unsure_phrases: Lower case phrases that mark an unsure answer
+        """
+        self.small_model = small_model
+        self.large_model = large_model
+        self.large_tasks = tuple(large_tasks)
+        self.json_tasks = tuple(json_tasks)
+        self.min_answer_chars = min_answer_chars
+        self.unsure_phrases = tuple(unsure_phrases)
+
+    @property
+    def enabled(self) -> bool:
+        """ Whether calls can go to a small model at all. """
+        return bool(self.small_model) and self.small_model != self.large_model
+
+    def tier(self, task: str) -> str:
+        """ The tier to try first for the task. """
+        if not self.enabled or task in self.large_tasks:
+            return TIER_LARGE
+        return TIER_SMALL
+
+    def model(self, tier: str) -> str:
+        """ The model of the tier. """
+        return self.small_model if tier == TIER_SMALL else self.large_model
+
+    def check(self, task: str, text: str, stop_reason: str = None) -> Optional[str]:
+        """ Why the answer should be escalated, or None when it can be used. """
+        if not text or len(text.strip()) < self.min_answer_chars:
+            return ESCALATE_EMPTY
+        if stop_reason in TRUNCATED_STOP_REASONS:
+            return ESCALATE_TRUNCATED
+        if task in self.json_tasks:
+            match = re.search(r'\{.*\}', text, re.DOTALL)
+            try:
+                if not match or not isinstance(json.loads(match.group()), dict):
+                    return ESCALATE_FORMAT
+            except ValueError:
+                return ESCALATE_FORMAT
+        lowered = text.lower()
+        if any(phrase in lowered for phrase in self.unsure_phrases):
+            return ESCALATE_UNSURE
+        return None
+
+    def run(self, task: str, call: Callable[[str], tuple]) -> CascadeResult:
+        """ Calls the first tier's model and escalates a failed small model answer.
+
+        :param call: Called with a model id, returns the answer text and its stop reason
+        """
+        tier = self.tier(task)
+        ROUTED.labels(task, tier).inc()
+        (text, stop_reason), seconds = self._call(tier, call)
+        escalation = None
+        if tier == TIER_SMALL:
+            escalation = self.check(task, text, stop_reason)
+            if escalation is not None:
+                ESCALATIONS.labels(task, escalation).inc()
+                logger.info("Escalating to the large model.  Task=%s. Reason=%s", task, escalation)
+                tier = TIER_LARGE
+                (text, _), large_seconds = self._call(tier, call)
+                seconds += large_seconds
+        ANSWERED.labels(task, tier).inc()
+        return CascadeResult(text, tier, self.model(tier), escalation, seconds)
+
+    def _call(self, tier: str, call: Callable[[str], tuple]) -> tuple[tuple, float]:
+        start = time.perf_counter()
+        result = call(self.model(tier))
+        seconds = time.perf_counter() - start
+        TIER_SECONDS.labels(tier).observe(seconds)
+        return result, seconds
+
+    def stream(self, task: str, call: Callable[[str], Generator]) -> Iterator[tuple]:
+        """ Streams the first tier's answer and escalates a failed small model answer.
+
+        Yields (EVENT_DELTA, text) for each piece of the answer, (EVENT_RESET, reason)
+        when the answer so far is discarded for the large model's, and last
+        (EVENT_DONE, CascadeResult).
+
+        :param call: Called with a model id, yields pieces of the answer text and returns its stop reason
+        """
+        tier = self.tier(task)
+        ROUTED.labels(task, tier).inc()
+        pieces = []
+        stop_reason, seconds = yield from self._stream(tier, call, pieces)
+        escalation = None
+        if tier == TIER_SMALL:
+            escalation = self.check(task, "".join(pieces), stop_reason)
+            if escalation is not None:
+                ESCALATIONS.labels(task, escalation).inc()
+                logger.info("Escalating to the large model.  Task=%s. Reason=%s", task, escalation)
+                yield EVENT_RESET, escalation
+                tier = TIER_LARGE
+                pieces = []
+                _, large_seconds = yield from self._stream(tier, call, pieces)
+                seconds += large_seconds
+        ANSWERED.labels(task, tier).inc()
+        yield EVENT_DONE, CascadeResult("".join(pieces), tier, self.model(tier), escalation, seconds)
+
+    def _stream(self, tier: str, call: Callable[[str], Generator], pieces: list):
+        start = time.perf_counter()
+        answer = call(self.model(tier))
+        while True:
+            try:
+                delta = next(answer)
+            except StopIteration as stop:
+                stop_reason = stop.value
+                break
+            pieces.append(delta)
+            yield EVENT_DELTA, delta
+        seconds = time.perf_counter() - start
+        TIER_SECONDS.labels(tier).observe(seconds)
+        return stop_reason, seconds
@@ -0,0 +1,716 @@
+""" City Permitting Agent
+
+The City Permitting agent without its user interface: configuration, the
+permit document loader and PermitAgentManager, which answers questions and
+evaluates applications with retrieval over the Denver regulations.  Used by
+the permitting API (permit_api.py), which the Streamlit app is a client of.
+Process-wide objects (the admission scheduler, endpoint router, model
+cascade, query embedding cache and vector snapshot) are created once per
+process and shared by every conversation.
+"""
+import re
+import copy
+import json
+import os
+import time
+import uuid
+import logging
+import functools
+from typing import Dict, Any, Iterator, List
+from io import BytesIO
+import requests
+from opentelemetry import trace
+from llama_stack_client import LlamaStackClient
+from llama_stack_client.types import Document
+from pypdf import PdfReader
+import permit_metrics
+from local_index import LlamaStackEmbedder, QueryEmbeddingCache, build_index
+from prompt_layout import user_message
+from endpoint_router import EndpointRouter, ROUTED_BASE_URL
+from model_cascade import ModelCascade, CascadeResult, EVENT_DELTA, EVENT_DONE, TASK_EVALUATION, TASK_QUESTION
+from llm_scheduler import AdmissionScheduler, LLMOverloaded, LANE_EVALUATION, LANE_INTERACTIVE
+from permit_prompts import SYSTEM_PROMPT, EVALUATION_INSTRUCTIONS, application_data
+from vector_snapshot import load_snapshot
+from tracing import tracer, record_usage, ATTR_MODEL, ATTR_TIME_TO_FIRST_TOKEN
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# Configuration
+# ============================================================================
+
+class Config:
+    """Configuration for the City Permitting Agent"""
+    
+    # Llama Stack Configuration
+    LLAMA_STACK_HOST = os.getenv("LLAMA_STACK_HOST", "localhost")
+    LLAMA_STACK_PORT = os.getenv("LLAMA_STACK_PORT", "8321")
+    # Comma separated Llama Stack replicas to route between (overrides the host and port);
+    # the replicas must share their model and vector DB registry.  A single entry is used directly.
+    LLAMA_STACK_URLS = [url.strip() for url in os.getenv("LLAMA_STACK_URLS", "").split(",") if url.strip()]
+    LLAMA_STACK_URL = LLAMA_STACK_URLS[0] if len(LLAMA_STACK_URLS) == 1 else \
+        os.getenv("LLAMA_STACK_URL", f"http://{LLAMA_STACK_HOST}:{LLAMA_STACK_PORT}")
+    LLAMA_STACK_HEALTH_INTERVAL = float(os.getenv("LLAMA_STACK_HEALTH_INTERVAL", "5"))
+    LLAMA_STACK_HEDGE_PERCENTILE = int(os.getenv("LLAMA_STACK_HEDGE_PERCENTILE", "95"))
+    
+    # Model Configuration
+    MODEL_ID = "llama-4-scout-17b-16e-w4a16"
+    # Smaller, faster model tried first for questions; answers failing the
+    # confidence/format checks are escalated to MODEL_ID ("" disables)
+    SMALL_MODEL_ID = os.getenv("SMALL_MODEL_ID", "")
+    EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+    EMBEDDING_DIMENSION = 384
+    
+    # Retrieval backend: "remote" (Llama Stack rag_tool) or "local" (in-process
+    # NumPy index, used while the corpus is at most LOCAL_INDEX_MAX_CHUNKS chunks)
+    RAG_BACKEND = os.getenv("RAG_BACKEND", "remote")
+    LOCAL_INDEX_MAX_CHUNKS = int(os.getenv("LOCAL_INDEX_MAX_CHUNKS", "20000"))
+    LOCAL_INDEX_QUANTIZE = os.getenv("LOCAL_INDEX_QUANTIZE", "false").lower() == "true"
+    # Prebuilt vector snapshot to memory-map instead of embedding the documents
+    LOCAL_INDEX_SNAPSHOT = os.getenv("LOCAL_INDEX_SNAPSHOT", "")
+    RAG_TOP_K = 5
+    # Process-wide LRU cache of query embeddings (local index only)
+    QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+    
+    # Admission control for LLM calls across all sessions in the process
+    # (LLM_MAX_CONCURRENT=0 disables it)
+    LLM_MAX_CONCURRENT = int(os.getenv("LLM_MAX_CONCURRENT", "8"))
+    LLM_EVALUATION_MAX_CONCURRENT = int(os.getenv("LLM_EVALUATION_MAX_CONCURRENT",
+                                                  str(max(1, LLM_MAX_CONCURRENT // 2))))
+    LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+    LLM_MAX_WAIT_SECONDS = float(os.getenv("LLM_MAX_WAIT_SECONDS", "120"))
+    
+    # Prometheus metrics side port (0 disables)
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "9090"))
+    
+    # Permitting API (permit_api.py).  Blocking Llama Stack calls run on a
+    # thread pool big enough for every admitted and queued LLM call.
+    PERMIT_API_PORT = int(os.getenv("PERMIT_API_PORT", "8000"))
+    PERMIT_API_THREADS = int(os.getenv("PERMIT_API_THREADS", str(LLM_MAX_CONCURRENT + LLM_MAX_QUEUE + 8)))
+    # Longest conversation history a request may send (each user turn carries its RAG context)
+    PERMIT_API_MAX_HISTORY = int(os.getenv("PERMIT_API_MAX_HISTORY", "20"))
+    
+    # Denver Permit Document URLs with fallbacks
+    PERMIT_DOCS = {
+        "food_rules_2017": {
+            "urls": [
+                # Primary URL
+                "https://www.denvergov.org/files/assets/public/public-health-and-environment/documents/phi/food/revisedfoodrulesandregulationsapril2017compressed.pdf",
+                # Fallback URLs
+                "http://denvergov.org/content/dam/denvergov/Portals/771/documents/PHI/Food/RevisedFoodRulesandregulationsApril2017compressed.pdf",
+            ],
+            "description": "Denver Food Rules and Regulations April 2017"
+        },
+        "mobile_unit_guide_2022": {
+            "urls": [
+                "https://denver.prelive.opencities.com/files/assets/public/v/1/public-health-and-environment/documents/phi/2022_mobileunitguide.pdf",
+            ],
+            "description": "Denver Mobile Unit Guide 2022"
+        }
+    }
+    
+    # Skip the PDF downloads and use the fallback content (offline and load tests)
+    PERMIT_DOCS_OFFLINE = os.getenv("PERMIT_DOCS_OFFLINE", "false").lower() == "true"
+    
+    # Fallback content if PDFs cannot be downloaded
+    FALLBACK_CONTENT = """
+    DENVER MOBILE FOOD TRUCK PERMIT REQUIREMENTS
+    
+    LICENSE REQUIREMENTS:
+    - City and County of Denver 'Retail Food Establishment-Mobile' license required
+    - Complete Mobile Plan Review Packet submission
+    - Processing time: 30 days during busy season
+    - Annual renewal required
+    
+    WATER SYSTEM REQUIREMENTS:
+    - Hand washing sink: minimum 10 inches wide x 10 inches long x 5 inches deep
+    - Water temperature: 100°F to 120°F at the faucet
+    - Soap and single-use paper towels required at all times
+    - Minimum 10 gallons clean water tank OR 3 gallons per hour of operation (whichever is greater)
+    - Wastewater tank must be at least 15% larger than clean water tank
+    - All water tanks must be NSF-approved and labeled
+    
+    COMMISSARY REQUIREMENTS:
+    - Must operate from an approved commissary facility
+    - Report to commissary daily for food preparation, cleaning, and servicing
+    - Affidavit of Commissary form required
+    - Commissary must be licensed by Denver or approved jurisdiction
+    
+    LOCATION RESTRICTIONS:
+    - Cannot operate in Central Business District without special permit
+    - 300 feet minimum from public parks (unless during special event with permission)
+    - 200 feet minimum from other food trucks
+    - 200 feet minimum from eating/drinking establishments (unless written consent)
+    - 50 feet minimum from residential zoning districts
+    - Cannot block fire hydrants, crosswalks, or handicap access
+    
+    EQUIPMENT REQUIREMENTS:
+    - Fire suppression system required for equipment producing grease-laden vapors
+    - Type I hood system required for grills, fryers, etc.
+    - Commercial-grade equipment only (no residential appliances)
+    - All equipment must be NSF or equivalent certified
+    - Adequate ventilation system required
+    
+    FOOD SAFETY REQUIREMENTS:
+    - All food stored minimum 6 inches above ground
+    - Cold potentially hazardous food: 41°F or below
+    - Hot potentially hazardous food: 135°F or above
+    - Accurate thermometers required (± 2°F accuracy)
+    - Food protection from contamination at all times
+    - No bare hand contact with ready-to-eat foods
+    
+    STRUCTURAL REQUIREMENTS:
+    - Floors: smooth, non-absorbent, easily cleanable
+    - Walls and ceilings: light-colored, smooth, easily cleanable
+    - Adequate lighting: minimum 10 foot-candles on food prep surfaces
+    - Sneeze guards required for customer self-service
+    - Waste containers with lids required
+    
+    DOCUMENTATION REQUIRED FOR PERMIT:
+    1. Completed application form with fees
+    2. Vehicle registration and proof of ownership
+    3. Insurance certificate (general liability)
+    4. Commissary affidavit (signed by commissary owner)
+    5. Mobile unit floor plan (to scale)
+    6. Equipment specification sheets
+    7. Menu list
+    8. Water system diagram
+    9. Waste disposal plan
+    10. Certified food manager certificate (at least one per unit)
+    
+    INSPECTION REQUIREMENTS:
+    - Initial inspection required before permit issuance
+    - Routine unannounced inspections throughout operation
+    - Must maintain score of 80 or above
+    - Critical violations must be corrected immediately
+    - Re-inspection fee applies for follow-up inspections
+    
+    FEES (Subject to change):
+    - New mobile unit application: varies by unit type
+    - Annual renewal: varies by unit type
+    - Re-inspection fee: if applicable
+    - Late renewal penalty: if applicable
+    """
+
+# ============================================================================
+# Document Loader with Robust Error Handling
+# ============================================================================
+
+class DocumentLoader:
+    """Handles document loading with fallback mechanisms"""
+    
+    def __init__(self):
+        self.session = requests.Session()
+        self.session.headers.update({
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+        })
+    
+    def download_pdf(self, urls: List[str], description: str) -> bytes:
+        """Download PDF with multiple fallback URLs"""
+        for attempt, url in enumerate(urls):
+            try:
+                logger.info("Attempting to download.  Document=%s. URL=%s", description, url)
+                response = self.session.get(
+                    url,
+                    allow_redirects=True,
+                    timeout=30,
+                    verify=True
+                )
+                
+                if response.status_code == 200:
+                    content_type = response.headers.get('content-type', '')
+                    if 'pdf' in content_type.lower() or len(response.content) > 1000:
+                        logger.info("Downloaded.  Document=%s", description)
+                        if attempt > 0:
+                            permit_metrics.FALLBACKS.labels("fallback_url").inc()
+                        return response.content
+                    else:
+                        logger.warning("Response not PDF format.  URL=%s", url)
+                else:
+                    logger.warning("Download failed.  Status=%s. URL=%s", response.status_code, url)
+                    
+            except requests.exceptions.RequestException as e:
+                logger.warning("Download failed.  URL=%s. error=%s", url, e)
+                continue
+            except Exception as e:
+                logger.warning("Unexpected download error.  URL=%s. error=%s", url, e)
+                continue
+        
+        return None
+    
+    def extract_text_from_pdf(self, pdf_content: bytes) -> str:
+        """Extract text from PDF bytes"""
+        try:
+            with permit_metrics.stage(permit_metrics.STAGE_TEXT_EXTRACTION):
+                pdf_file = BytesIO(pdf_content)
+                reader = PdfReader(pdf_file)
+                text = ""
+                
+                for page in reader.pages:
+                    page_text = page.extract_text()
+                    if page_text:
+                        text += page_text + "\n\n"
+            
+            return text
+        except Exception as e:
+            logger.error("Error extracting PDF text.  error=%s", e)
+            return ""
+    
+    def load_permit_documents(self) -> List[Document]:
+        """Load all permit requirement documents"""
+        documents = []
+        
+        permit_docs = {} if Config.PERMIT_DOCS_OFFLINE else Config.PERMIT_DOCS
+        for doc_id, doc_info in permit_docs.items():
+            # Try to download PDF
+            with permit_metrics.stage(permit_metrics.STAGE_PDF_DOWNLOAD):
+                pdf_content = self.download_pdf(doc_info["urls"], doc_info["description"])
+            
+            if pdf_content:
+                # Extract text
+                text_content = self.extract_text_from_pdf(pdf_content)
+                
+                if text_content and len(text_content.strip()) > 100:
+                    doc = Document(
+                        document_id=doc_id,
+                        content=text_content,
+                        mime_type="text/plain",
+                        metadata={
+                            "source": doc_info["urls"][0],
+                            "description": doc_info["description"],
+                            "type": "permit_requirements"
+                        }
+                    )
+                    documents.append(doc)
+                else:
+                    logger.warning("Insufficient content extracted.  Document=%s", doc_info['description'])
+        
+        # If no documents loaded, use fallback content
+        if not documents:
+            logger.warning("Could not download PDFs.  Using fallback permit requirements.")
+            permit_metrics.FALLBACKS.labels("fallback_content").inc()
+            fallback_doc = Document(
+                document_id="fallback_requirements",
+                content=Config.FALLBACK_CONTENT,
+                mime_type="text/plain",
+                metadata={
+                    "source": "fallback",
+                    "description": "Denver Permit Requirements (Fallback)",
+                    "type": "permit_requirements"
+                }
+            )
+            documents.append(fallback_doc)
+        
+        return documents
+
+# ============================================================================
+# Llama Stack Agent Manager
+# ============================================================================
+
+@functools.cache
+def llm_scheduler() -> AdmissionScheduler:
+    """LLM admission scheduler shared by every session in the process"""
+    return AdmissionScheduler(
+        max_concurrent=Config.LLM_MAX_CONCURRENT,
+        max_queue=Config.LLM_MAX_QUEUE,
+        max_wait_seconds=Config.LLM_MAX_WAIT_SECONDS,
+        lane_limits={LANE_INTERACTIVE: Config.LLM_MAX_CONCURRENT,
+                     LANE_EVALUATION: Config.LLM_EVALUATION_MAX_CONCURRENT}
+    )
+
+@functools.cache
+def endpoint_router(urls: tuple) -> EndpointRouter:
+    """Llama Stack endpoint router shared by every session in the process"""
+    router = EndpointRouter(list(urls), health_interval=Config.LLAMA_STACK_HEALTH_INTERVAL,
+                            hedge_percentile=Config.LLAMA_STACK_HEDGE_PERCENTILE)
+    router.start_health_checks()
+    return router
+
+@functools.cache
+def model_cascade(small_model: str, large_model: str) -> ModelCascade:
+    """Routing between the small and large model, shared by every session"""
+    return ModelCascade(small_model, large_model)
+
+@functools.cache
+def query_embedding_cache(max_entries: int) -> QueryEmbeddingCache:
+    """Query embedding cache shared by every session in the process"""
+    return QueryEmbeddingCache(max_entries)
+
+@functools.cache
+def load_permit_snapshot(path: str):
+    """Memory-map a vector snapshot once per process, shared by every session"""
+    index, manifest = load_snapshot(path)
+    if manifest["embedding_model"] != Config.EMBEDDING_MODEL:
+        raise ValueError(f"Snapshot was embedded with {manifest['embedding_model']}, "
+                         f"not {Config.EMBEDDING_MODEL}")
+    return index
+
+
+class PermitAgentManager:
+    """Manages Llama Stack client and agent operations
+    
+    One initialized manager holds the client and knowledge base; conversation()
+    gives each conversation its own manager sharing them.
+    """
+    
+    def __init__(self):
+        self.client = None
+        self.vector_db_id = None
+        self.local_index = None
+        self.embedder = None
+        self.session_id = None
+        self.messages = []
+    
+    def initialize_client(self) -> bool:
+        """Initialize Llama Stack client"""
+        try:
+            if len(Config.LLAMA_STACK_URLS) > 1:
+                router = endpoint_router(tuple(Config.LLAMA_STACK_URLS))
+                self.client = LlamaStackClient(base_url=ROUTED_BASE_URL, http_client=router.http_client())
+            else:
+                self.client = LlamaStackClient(base_url=Config.LLAMA_STACK_URL)
+            # Test connection
+            self.client.models.list()
+            return True
+        except Exception as e:
+            logger.error("Failed to connect to Llama Stack.  URL=%s. error=%s", Config.LLAMA_STACK_URL, e)
+            return False
+    
+    def setup_vector_db(self, documents: List[Document]) -> bool:
+        """Setup vector database and ingest documents"""
+        if Config.RAG_BACKEND == "local" and self.setup_local_index(documents):
+            return True
+        try:
+            # Generate unique vector DB ID
+            self.vector_db_id = f"permit-db-{uuid.uuid4().hex[:8]}"
+            
+            # Get available providers
+            providers = self.client.providers.list()
+            vector_provider = None
+            
+            for provider in providers:
+                if hasattr(provider, 'api') and provider.api == 'vector_io':
+                    vector_provider = provider
+                    break
+            
+            if not vector_provider:
+                logger.error("No vector_io provider found in Llama Stack")
+                return False
+            
+            # Register vector database
+            with permit_metrics.stage(permit_metrics.STAGE_VECTOR_DB_REGISTER):
+                self.client.vector_dbs.register(
+                    vector_db_id=self.vector_db_id,
+                    provider_id=vector_provider.provider_id,
+                    embedding_model=Config.EMBEDDING_MODEL,
+                    embedding_dimension=Config.EMBEDDING_DIMENSION
+                )
+            
+            # Ingest documents
+            with permit_metrics.stage(permit_metrics.STAGE_DOCUMENT_INGEST):
+                self.client.tool_runtime.rag_tool.insert(
+                    documents=documents,
+                    vector_db_id=self.vector_db_id,
+                    chunk_size_in_tokens=1024
+                )
+            
+            logger.info("Vector database setup complete.  Vector DB=%s", self.vector_db_id)
+            return True
+            
+        except Exception as e:
+            logger.error("Error setting up vector database.  error=%s", e)
+            return False
+    
+    def setup_local_index(self, documents: List[Document]) -> bool:
+        """Embed documents into an in-process index, unless the corpus is too large"""
+        try:
+            embedder = LlamaStackEmbedder(self.client, Config.EMBEDDING_MODEL)
+            with permit_metrics.stage(permit_metrics.STAGE_LOCAL_INDEX_BUILD):
+                if Config.LOCAL_INDEX_SNAPSHOT:
+                    index = load_permit_snapshot(Config.LOCAL_INDEX_SNAPSHOT)
+                else:
+                    index = build_index(
+                        {doc.document_id: doc.content for doc in documents},
+                        embedder,
+                        max_chunks=Config.LOCAL_INDEX_MAX_CHUNKS,
+                        quantize=Config.LOCAL_INDEX_QUANTIZE
+                    )
+        except Exception as e:
+            logger.warning("Local index unavailable, using the remote vector database.  error=%s", e)
+            return False
+        
+        if index is None:
+            logger.info("Corpus is too large for the local index, using the remote vector database")
+            permit_metrics.FALLBACKS.labels("remote_vector_db").inc()
+            return False
+        
+        self.local_index = index
+        self.embedder = embedder
+        logger.info("Local index ready.  Chunks=%s", len(index))
+        return True
+    
+    def initialize(self):
+        """Connect to Llama Stack, load the permit documents and set up the knowledge base
+        
+        Raises RuntimeError when a step fails
+        """
+        with permit_metrics.operation(permit_metrics.OPERATION_INITIALIZE):
+            if not self.initialize_client():
+                raise RuntimeError(f"Failed to connect to Llama Stack at {Config.LLAMA_STACK_URL}")
+            documents = DocumentLoader().load_permit_documents()
+            logger.info("Loaded %s document(s)", len(documents))
+            if not self.setup_vector_db(documents):
+                raise RuntimeError("Failed to setup vector database")
+            self.create_session()
+    
+    def create_session(self, session_id: str = None):
+        """Create new conversation session"""
+        self.session_id = session_id or f"session-{uuid.uuid4().hex[:8]}"
+        self.messages = [
+            {
+                "role": "system",
+                "content": SYSTEM_PROMPT
+            }
+        ]
+    
+    def conversation(self, session_id: str = None, history: List[Dict[str, str]] = None) -> "PermitAgentManager":
+        """A manager for one conversation, sharing this one's client and knowledge base
+        
+        history holds the conversation's earlier messages, after the system prompt
+        """
+        agent = copy.copy(self)
+        agent.create_session(session_id)
+        agent.messages.extend(history or [])
+        return agent
+    
+    def query_with_rag(self, query: str, lane: str = LANE_INTERACTIVE, instructions: str = None) -> str:
+        """Query with RAG context
+        
+        instructions are static task instructions placed ahead of the context.
+        Raises LLMOverloaded when the LLM call is shed by the admission scheduler
+        """
+        with tracer.start_as_current_span("query_with_rag") as span:
+            span.set_attribute(ATTR_MODEL, Config.MODEL_ID)
+            span.set_attribute("llm.lane", lane)
+            return self._query_with_rag(query, lane, instructions, span)
+    
+    def _query_with_rag(self, query: str, lane: str, instructions: str, span) -> str:
+        """Runs the RAG query and completion inside the query_with_rag span"""
+        try:
+            self._add_request(query, span, instructions)
+            
+            # Get LLM response using Responses API (chat completion), once admitted,
+            # from the small model when it can answer and the large model otherwise
+            cascade = model_cascade(Config.SMALL_MODEL_ID, Config.MODEL_ID)
+            task = TASK_EVALUATION if lane == LANE_EVALUATION else TASK_QUESTION
+            usage = {}
+            
+            def complete(model_id: str):
+                response = self.client.inference.chat_completion(
+                    model_id=model_id,
+                    messages=self.messages
+                )
+                # every attempt is billed, so usage adds up across them
+                for m in (getattr(response, 'metrics', None) or []):
+                    usage[m.metric] = usage.get(m.metric, 0) + m.value
+                message = getattr(response, 'completion_message', None)
+                return self._response_text(response), getattr(message, 'stop_reason', None)
+            
+            try:
+                with llm_scheduler().slot(lane, self.session_id) as ticket:
+                    span.set_attribute("llm.queue_seconds", ticket.wait_seconds)
+                    with permit_metrics.stage(permit_metrics.STAGE_LLM_COMPLETION):
+                        result = cascade.run(task, complete)
+            except LLMOverloaded:
+                # the question was not answered, so leave it out of the conversation
+                self.messages.pop()
+                raise
+            
+            # Record the model that answered and token usage reported by Llama Stack
+            self._record_result(span, result, usage)
+            
+            # Add assistant response to messages
+            self.messages.append({
+                "role": "assistant",
+                "content": result.text
+            })
+            
+            return result.text
+            
+        except LLMOverloaded as e:
+            span.set_attribute("llm.shed", e.reason)
+            raise
+        except Exception as e:
+            span.record_exception(e)
+            span.set_status(trace.Status(trace.StatusCode.ERROR, str(e)))
+            logger.error("Error querying agent.  error=%s", e)
+            raise
+    
+    def stream_query_with_rag(self, query: str, lane: str = LANE_INTERACTIVE) -> Iterator[tuple]:
+        """Query with RAG context, streaming the answer
+        
+        Yields the model cascade's events: (EVENT_DELTA, text) for each piece of
+        the answer, (EVENT_RESET, reason) when the answer so far is replaced by
+        the large model's, and finally (EVENT_DONE, CascadeResult).
+        Raises LLMOverloaded when the LLM call is shed by the admission scheduler
+        """
+        with tracer.start_as_current_span("query_with_rag") as span:
+            span.set_attribute(ATTR_MODEL, Config.MODEL_ID)
+            span.set_attribute("llm.lane", lane)
+            span.set_attribute("llm.stream", True)
+            start = time.perf_counter()
+            try:
+                self._add_request(query, span)
+                cascade = model_cascade(Config.SMALL_MODEL_ID, Config.MODEL_ID)
+                task = TASK_EVALUATION if lane == LANE_EVALUATION else TASK_QUESTION
+                usage = {}
+                
+                def complete(model_id: str):
+                    stop_reason = None
+                    for chunk in self.client.inference.chat_completion(
+                            model_id=model_id, messages=self.messages, stream=True):
+                        delta = getattr(chunk.event.delta, "text", "")
+                        if delta:
+                            yield delta
+                        stop_reason = getattr(chunk.event, "stop_reason", None) or stop_reason
+                        for m in (getattr(chunk, 'metrics', None) or []):
+                            usage[m.metric] = usage.get(m.metric, 0) + m.value
+                    return stop_reason
+                
+                try:
+                    with llm_scheduler().slot(lane, self.session_id) as ticket:
+                        span.set_attribute("llm.queue_seconds", ticket.wait_seconds)
+                        with permit_metrics.stage(permit_metrics.STAGE_LLM_COMPLETION):
+                            first_token = True
+                            for event, data in cascade.stream(task, complete):
+                                if event == EVENT_DELTA and first_token:
+                                    span.set_attribute(ATTR_TIME_TO_FIRST_TOKEN, time.perf_counter() - start)
+                                    first_token = False
+                                if event == EVENT_DONE:
+                                    # the conversation is complete by the time the answer is
+                                    self._record_result(span, data, usage)
+                                    self.messages.append({
+                                        "role": "assistant",
+                                        "content": data.text
+                                    })
+                                yield event, data
+                except LLMOverloaded:
+                    self.messages.pop()
+                    raise
+            except LLMOverloaded as e:
+                span.set_attribute("llm.shed", e.reason)
+                raise
+            except Exception as e:
+                span.record_exception(e)
+                span.set_status(trace.Status(trace.StatusCode.ERROR, str(e)))
+                logger.error("Error querying agent.  error=%s", e)
+                raise
+    
+    def _add_request(self, query: str, span, instructions: str = None):
+        """Retrieves context for the query and adds it, with the query, to the conversation"""
+        # Query vector database for relevant context
+        search_text = f"{instructions}\n\n{query}" if instructions else query
+        if self.local_index is not None:
+            rag_context = self.search_local_index(search_text)
+        else:
+            rag_context = self.search_vector_db(search_text)
+        span.set_attribute("rag.chunks", len(rag_context))
+        
+        # Build enhanced prompt: static instructions, then the RAG context in
+        # relevance order, then the request
+        enhanced_query = user_message(query, rag_context,
+                                      context_heading="RELEVANT DENVER REGULATIONS",
+                                      request_heading="REQUEST",
+                                      instructions=instructions)
+        if not rag_context:
+            permit_metrics.FALLBACKS.labels("no_rag_context").inc()
+        
+        # Add to conversation messages
+        self.messages.append({
+            "role": "user",
+            "content": enhanced_query
+        })
+    
+    @staticmethod
+    def _record_result(span, result: CascadeResult, usage: Dict[str, float]):
+        """Records the model that answered and the token usage reported by Llama Stack"""
+        span.set_attribute(ATTR_MODEL, result.model)
+        span.set_attribute("llm.tier", result.tier)
+        if result.escalation:
+            span.set_attribute("llm.escalation", result.escalation)
+        record_usage(span, usage.get("prompt_tokens"), usage.get("completion_tokens"))
+    
+    @staticmethod
+    def _response_text(response) -> str:
+        """Content of a chat completion response"""
+        if hasattr(response, 'completion_message'):
+            return response.completion_message.content
+        elif hasattr(response, 'choices') and len(response.choices) > 0:
+            return response.choices[0].message.content
+        return str(response)
+    
+    def search_vector_db(self, query: str) -> List[str]:
+        """Relevant chunks from the Llama Stack vector database"""
+        with permit_metrics.stage(permit_metrics.STAGE_RAG_QUERY):
+            rag_results = self.client.tool_runtime.rag_tool.query(
+                content=query,
+                vector_db_ids=[self.vector_db_id]
+            )
+        
+        # Extract context from RAG results
+        rag_context = []
+        if hasattr(rag_results, 'content') and rag_results.content:
+            for chunk in rag_results.content:
+                if hasattr(chunk, 'text'):
+                    rag_context.append(chunk.text)
+        return rag_context
+    
+    def search_local_index(self, query: str) -> List[str]:
+        """Relevant chunks from the in-process index"""
+        cache = query_embedding_cache(Config.QUERY_EMBEDDING_CACHE_SIZE)
+        with permit_metrics.stage(permit_metrics.STAGE_QUERY_EMBEDDING):
+            query_embedding, hit = cache.embed_query(self.embedder, query)
+        permit_metrics.record_cache(permit_metrics.CACHE_QUERY_EMBEDDING, hit, cache.average_miss_seconds)
+        trace.get_current_span().set_attribute("rag.embedding_cache_hit", hit)
+        with permit_metrics.stage(permit_metrics.STAGE_RAG_QUERY):
+            results = self.local_index.search(query_embedding, k=Config.RAG_TOP_K)
+        return [result["text"] for result in results]
+    
+    def evaluate_application(self, application: Dict[str, Any]) -> Dict[str, Any]:
+        """Evaluate permit application"""
+        with tracer.start_as_current_span("evaluate_application") as span:
+            evaluation = self._evaluate_application(application)
+            span.set_attribute("permit.recommendation", str(evaluation.get("recommendation")))
+            span.set_attribute("permit.overall_score", str(evaluation.get("overall_score")))
+            return evaluation
+    
+    def _evaluate_application(self, application: Dict[str, Any]) -> Dict[str, Any]:
+        """Builds the evaluation prompt and parses the scorecard from the response"""
+        
+        response = self.query_with_rag(application_data(application), lane=LANE_EVALUATION,
+                                       instructions=EVALUATION_INSTRUCTIONS)
+        
+        # Try to parse JSON from response
+        try:
+            with permit_metrics.stage(permit_metrics.STAGE_JSON_PARSE):
+                json_match = re.search(r'\{.*\}', response, re.DOTALL)
+                if json_match:
+                    evaluation = json.loads(json_match.group())
+                else:
+                    # Fallback structure
+                    permit_metrics.PARSE_FAILURES.labels("no_json").inc()
+                    evaluation = {
+                        "overall_score": 0,
+                        "recommendation": "NEEDS_REVIEW",
+                        "raw_response": response
+                    }
+        except:
+            permit_metrics.PARSE_FAILURES.labels("invalid_json").inc()
+            evaluation = {
+                "overall_score": 0,
+                "recommendation": "ERROR",
+                "raw_response": response
+            }
+        
+        return evaluation
+
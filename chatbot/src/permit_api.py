@@ -0,0 +1,209 @@
+""" City Permitting API
+
+Serves the City Permitting agent over HTTP so any number of Streamlit
+front ends (or other clients) share one process-wide Llama Stack client,
+knowledge base, admission scheduler and model cascade, and the agent can be
+scaled independently of the UI.
+
+The API is stateless: a client sends the conversation so far with each
+request and gets back the messages of the new turn to append to it.
+
+    POST /v1/questions          {"question": ..., "session_id": ..., "history": [...]}
+    POST /v1/questions/stream   same body, answered as server-sent events
+    POST /v1/evaluations        {"application": {...}, "session_id": ..., "history": [...]}
+    GET  /v1/health
+
+Llama Stack calls block, so they run on a thread pool sized for every
+admitted and queued LLM call (PERMIT_API_THREADS).  A call shed by the
+admission scheduler is answered 503 with a Retry-After header.
+
+    python permit_api.py
+"""
+import json
+import logging
+import contextlib
+from typing import AsyncIterator, Iterator
+import anyio
+import uvicorn
+from opentelemetry import context, propagate
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+import permit_metrics
+from llm_scheduler import LLMOverloaded
+from model_cascade import EVENT_DONE
+from permit_agent import Config, PermitAgentManager
+from tracing import setup_tracing
+
+logger = logging.getLogger(__name__)
+
+RETRY_AFTER_SECONDS = 5
+
+EVENT_ERROR = "error"
+
+HISTORY_ROLES = ("user", "assistant")
+
+
+class BadRequest(Exception):
+    """ The request body is missing a field or malformed. """
+
+
+async def read_body(request: Request, field: str, kind: type) -> dict:
+    """ The JSON body, which must hold the field as the given type. """
+    try:
+        body = await request.json()
+    except ValueError as e:
+        raise BadRequest("Body must be a JSON object") from e
+    if not isinstance(body, dict) or not isinstance(body.get(field), kind) or not body[field]:
+        raise BadRequest(f"'{field}' is required")
+    history = body.get("history", [])
+    if not isinstance(history, list):
+        raise BadRequest("'history' must be a list of messages")
+    if len(history) > Config.PERMIT_API_MAX_HISTORY:
+        raise BadRequest(f"'history' is limited to {Config.PERMIT_API_MAX_HISTORY} messages")
+    for message in history:
+        # only the agent sets the system prompt
+        if not isinstance(message, dict) or message.get("role") not in HISTORY_ROLES \
+                or not isinstance(message.get("content"), str):
+            raise BadRequest("'history' messages must have a role of user or assistant and string content")
+    return body
+
+
+def overloaded(e: LLMOverloaded) -> JSONResponse:
+    """ 503 for a call shed by the admission scheduler. """
+    return JSONResponse({"detail": str(e), "lane": e.lane, "reason": e.reason}, status_code=503,
+                        headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+
+async def stream_in_thread(events: Iterator[tuple], buffer: int = 64) -> AsyncIterator[tuple]:
+    """ Runs a blocking event generator on one pool thread, passing its events on.
+
+    The generator holds a scheduler slot and a tracing span, so it is not moved
+    between threads the way iterate_in_threadpool would.  An exception it raises
+    is passed on as an (EVENT_ERROR, exception) event.
+    """
+    send, receive = anyio.create_memory_object_stream(buffer)
+
+    def produce():
+        with send, contextlib.closing(events):
+            try:
+                for event in events:
+                    anyio.from_thread.run(send.send, event)
+            except (anyio.BrokenResourceError, anyio.ClosedResourceError):
+                pass    # the client went away
+            except Exception as e:     # pylint: disable=broad-except
+                anyio.from_thread.run(send.send, (EVENT_ERROR, e))
+
+    async with anyio.create_task_group() as tasks, receive:
+        tasks.start_soon(run_in_threadpool, produce)
+        async for event in receive:
+            yield event
+
+
+@contextlib.contextmanager
+def caller_trace(request: Request):
+    """ Continues the caller's trace (the Streamlit app's httpx calls carry traceparent). """
+    token = context.attach(propagate.extract(request.headers))
+    try:
+        yield
+    finally:
+        context.detach(token)
+
+
+def sse(event: str, data) -> str:
+    """ One server-sent event. """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def create_app(agent: PermitAgentManager = None) -> Starlette:
+    """ Builds the API, initializing the agent on startup unless one is given. """
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app: Starlette):
+        anyio.to_thread.current_default_thread_limiter().total_tokens = Config.PERMIT_API_THREADS
+        permit_metrics.start_metrics_server(Config.METRICS_PORT)
+        setup_tracing("city-permitting-api")
+        if agent is None:
+            app.state.agent = PermitAgentManager()
+            await run_in_threadpool(app.state.agent.initialize)
+        else:
+            app.state.agent = agent
+        logger.info("Permitting API ready.  Threads=%s", Config.PERMIT_API_THREADS)
+        yield
+
+    async def conversation(request: Request, body: dict) -> PermitAgentManager:
+        # scheduler fairness is per session, so anonymous callers are told apart by address
+        session_id = body.get("session_id") or (request.client.host if request.client else None)
+        history = [{"role": m["role"], "content": m["content"]} for m in body.get("history", [])]
+        return request.app.state.agent.conversation(session_id, history)
+
+    async def health(request: Request):
+        return JSONResponse({"status": "ok", "llama_stack_url": Config.LLAMA_STACK_URL})
+
+    async def question(request: Request):
+        try:
+            body = await read_body(request, "question", str)
+        except BadRequest as e:
+            return JSONResponse({"detail": str(e)}, status_code=400)
+        agent = await conversation(request, body)
+        start = len(agent.messages)
+        try:
+            with caller_trace(request), permit_metrics.operation(permit_metrics.OPERATION_QUESTION):
+                answer = await run_in_threadpool(agent.query_with_rag, body["question"])
+        except LLMOverloaded as e:
+            return overloaded(e)
+        return JSONResponse({"answer": answer, "messages": agent.messages[start:]})
+
+    async def stream_question(request: Request):
+        try:
+            body = await read_body(request, "question", str)
+        except BadRequest as e:
+            return JSONResponse({"detail": str(e)}, status_code=400)
+        agent = await conversation(request, body)
+        start = len(agent.messages)
+
+        async def events():
+            with caller_trace(request), permit_metrics.operation(permit_metrics.OPERATION_QUESTION):
+                async for event, data in stream_in_thread(agent.stream_query_with_rag(body["question"])):
+                    if event == EVENT_DONE:
+                        yield sse(event, {"answer": data.text, "model": data.model, "tier": data.tier,
+                                          "escalation": data.escalation, "messages": agent.messages[start:]})
+                    elif event == EVENT_ERROR and isinstance(data, LLMOverloaded):
+                        yield sse(event, {"detail": str(data), "lane": data.lane, "reason": data.reason,
+                                          "status": 503})
+                    elif event == EVENT_ERROR:
+                        # the response has started, so the error goes in the stream
+                        yield sse(event, {"detail": str(data), "status": 500})
+                    else:
+                        yield sse(event, data)
+
+        return StreamingResponse(events(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache"})
+
+    async def evaluation(request: Request):
+        try:
+            body = await read_body(request, "application", dict)
+        except BadRequest as e:
+            return JSONResponse({"detail": str(e)}, status_code=400)
+        agent = await conversation(request, body)
+        start = len(agent.messages)
+        try:
+            with caller_trace(request), permit_metrics.operation(permit_metrics.OPERATION_EVALUATION):
+                result = await run_in_threadpool(agent.evaluate_application, body["application"])
+        except LLMOverloaded as e:
+            return overloaded(e)
+        return JSONResponse({"evaluation": result, "messages": agent.messages[start:]})
+
+    return Starlette(lifespan=lifespan, routes=[
+        Route("/v1/health", health),
+        Route("/v1/questions", question, methods=["POST"]),
+        Route("/v1/questions/stream", stream_question, methods=["POST"]),
+        Route("/v1/evaluations", evaluation, methods=["POST"]),
+    ])
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    uvicorn.run(create_app(), host="0.0.0.0", port=Config.PERMIT_API_PORT)
@@ -0,0 +1,120 @@
+""" City Permitting API Client
+
+Client of the City Permitting API (permit_api.py) with the interface the
+Streamlit app used to call PermitAgentManager through: it keeps the
+conversation and sends it with each request, since the API holds no state.
+"""
+import json
+import uuid
+import logging
+from typing import Any, Dict, Iterator
+import httpx
+from llm_scheduler import LLMOverloaded
+from model_cascade import EVENT_DELTA, EVENT_DONE, EVENT_RESET
+
+logger = logging.getLogger(__name__)
+
+EVENT_ERROR = "error"
+
+# the API's default limit on the history sent with a request
+MAX_HISTORY = 20
+
+
+class PermitAPIError(Exception):
+    """ The API failed a request; str() is its detail. """
+
+
+class PermitAPIClient:
+    """ One conversation with the City Permitting API. """
+
+    def __init__(self, base_url: str, session_id: str = None, timeout: float = 300.0,
+                 max_history: int = MAX_HISTORY):
+        """
+        :param base_url: URL of the API, i.e. http://permit-api:8000
+        :param session_id: Session the API's admission scheduler shares calls fairly between
+        :param timeout: Seconds allowed for a request, including queueing for an LLM slot
+        :param max_history: Most recent messages sent with each request, at most the
+            API's PERMIT_API_MAX_HISTORY
+        """
+        self.base_url = base_url.rstrip("/")
+        self.session_id = session_id or f"session-{uuid.uuid4().hex[:8]}"
+        self.max_history = max_history
+        self.messages = []
+        self.http = httpx.Client(base_url=self.base_url, timeout=timeout)
+
+    def health(self) -> Dict[str, Any]:
+        """ The API's health, raising PermitAPIError when it is not serving. """
+        try:
+            response = self.http.get("/v1/health")
+        except httpx.TransportError as e:
+            raise PermitAPIError(f"Unable to reach the permitting API at {self.base_url}: {e}") from e
+        self._raise_for_status(response)
+        return response.json()
+
+    def query_with_rag(self, query: str) -> str:
+        """ Answers a question about the permit regulations. """
+        body = self._post("/v1/questions", {"question": query})
+        return body["answer"]
+
+    def stream_query_with_rag(self, query: str) -> Iterator[tuple]:
+        """ Answers a question, yielding the answer as it is generated.
+
+        Yields (EVENT_DELTA, text) pieces, (EVENT_RESET, reason) when the pieces so
+        far are to be discarded for a better answer, and last (EVENT_DONE, answer).
+        """
+        with self.http.stream("POST", "/v1/questions/stream", json=self._request(question=query)) as response:
+            if response.status_code != 200:
+                response.read()
+                self._raise_for_status(response)
+            for event, data in self._events(response):
+                if event == EVENT_ERROR:
+                    self._raise_error(data.get("status", 500), data)
+                elif event == EVENT_DONE:
+                    self.messages.extend(data["messages"])
+                    yield event, data["answer"]
+                elif event in (EVENT_DELTA, EVENT_RESET):
+                    yield event, data
+
+    def evaluate_application(self, application: Dict[str, Any]) -> Dict[str, Any]:
+        """ Evaluates a permit application, returning its scorecard. """
+        body = self._post("/v1/evaluations", {"application": application})
+        return body["evaluation"]
+
+    def _request(self, **fields) -> Dict[str, Any]:
+        history = self.messages[-self.max_history:] if self.max_history > 0 else []
+        return dict(fields, session_id=self.session_id, history=history)
+
+    def _post(self, path: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+        response = self.http.post(path, json=self._request(**fields))
+        self._raise_for_status(response)
+        body = response.json()
+        self.messages.extend(body["messages"])
+        return body
+
+    @staticmethod
+    def _events(response: httpx.Response) -> Iterator[tuple]:
+        """ Server-sent events of a streamed response. """
+        event, data = None, []
+        for line in response.iter_lines():
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data.append(line[len("data:"):].strip())
+            elif not line and event:
+                yield event, json.loads("\n".join(data))
+                event, data = None, []
+
+    def _raise_for_status(self, response: httpx.Response):
+        if response.status_code >= 400:
+            try:
+                body = response.json()
+            except ValueError:
+                body = {"detail": response.text}
+            self._raise_error(response.status_code, body)
+
+    @staticmethod
+    def _raise_error(status: int, body: Dict[str, Any]):
+        if status == 503 and "lane" in body:
+            raise LLMOverloaded(body["lane"], body.get("reason"))
+        logger.error("Permitting API request failed.  Status=%s. Detail=%s", status, body.get("detail"))
+        raise PermitAPIError(body.get("detail") or f"Permitting API returned {status}")
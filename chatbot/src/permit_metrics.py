@@ -0,0 +1,124 @@
+""" Prometheus metrics for the City Permitting app.
+
+Two processes register and serve these metrics, each from its own side port
+(METRICS_PORT) through prometheus_client, and each pod is scraped separately:
+
+- permit_api.py, the Starlette API, records the agent's stages (including
+  LLM completions), caches, parse failures and fallbacks, and the operations
+  as the API serves them.  Its port also serves the admission scheduler,
+  model cascade and endpoint router metrics.
+- city-permitting-streamlit.py records user sessions and the operations as
+  users see them, including the call to the API.  Streamlit re-runs the app
+  script on every interaction, so the metrics live in this module, which is
+  only imported (and registered) once per process.
+"""
+import time
+import logging
+import threading
+import weakref
+import contextlib
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+logger = logging.getLogger(__name__)
+
+# Stages of DocumentLoader and PermitAgentManager
+STAGE_PDF_DOWNLOAD = "pdf_download"
+STAGE_TEXT_EXTRACTION = "text_extraction"
+STAGE_VECTOR_DB_REGISTER = "vector_db_register"
+STAGE_DOCUMENT_INGEST = "document_ingest"
+STAGE_LOCAL_INDEX_BUILD = "local_index_build"
+STAGE_QUERY_EMBEDDING = "query_embedding"
+STAGE_RAG_QUERY = "rag_query"
+STAGE_LLM_COMPLETION = "llm_completion"
+STAGE_JSON_PARSE = "json_parse"
+
+# Caches
+CACHE_QUERY_EMBEDDING = "query_embedding"
+
+# User facing operations
+OPERATION_INITIALIZE = "initialize"
+OPERATION_QUESTION = "question"
+OPERATION_EVALUATION = "evaluation"
+
+# LLM calls take tens of seconds, so the buckets reach further than the defaults
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram("permit_stage_seconds", "Time spent in each processing stage",
+                          ["stage"], buckets=LATENCY_BUCKETS)
+OPERATION_SECONDS = Histogram("permit_operation_seconds", "End to end latency of user operations",
+                              ["operation"], buckets=LATENCY_BUCKETS)
+OPERATIONS_IN_PROGRESS = Gauge("permit_operations_in_progress", "User operations currently running",
+                               ["operation"])
+STAGE_ERRORS = Counter("permit_stage_errors_total", "Stages that raised an error", ["stage"])
+CACHE_REQUESTS = Counter("permit_cache_requests_total", "Cache lookups by cache and result",
+                         ["cache", "result"])
+PARSE_FAILURES = Counter("permit_parse_failures_total", "Evaluations whose JSON could not be parsed",
+                         ["reason"])
+SECONDS_SAVED = Counter("permit_cache_seconds_saved_total", "Estimated latency avoided by cache hits",
+                        ["cache"])
+FALLBACKS = Counter("permit_fallbacks_total", "Times a fallback path was taken", ["kind"])
+ACTIVE_SESSIONS = Gauge("permit_active_sessions", "Streamlit sessions held by this process")
+
+_server_lock = threading.Lock()
+_server_port = None
+
+
+def start_metrics_server(port: int):
+    """ Serves /metrics on the port, once per process.  0 disables the server. """
+    global _server_port     # pylint: disable=global-statement
+    with _server_lock:
+        if _server_port is not None or port == 0:
+            return
+        try:
+            start_http_server(port)
+            _server_port = port
+            logger.info("Serving metrics on port %s", port)
+        except OSError as e:
+            logger.error("Unable to serve metrics on port %s.  error=%s", port, e)
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    """ Times a processing stage, counting it as an error if it raises. """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.labels(name).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - start)
+
+
+@contextlib.contextmanager
+def operation(name: str):
+    """ Times a user operation and tracks how many are running. """
+    in_progress = OPERATIONS_IN_PROGRESS.labels(name)
+    in_progress.inc()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        OPERATION_SECONDS.labels(name).observe(time.perf_counter() - start)
+        in_progress.dec()
+
+
+def record_cache(cache: str, hit: bool, saved_seconds: float = 0.0):
+    """ Counts a cache lookup and the latency a hit saved. """
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+    if hit:
+        SECONDS_SAVED.labels(cache).inc(saved_seconds)
+
+
+class _SessionToken:
+    """ Lives in a session's state, so it is collected when the session ends. """
+
+
+def track_session(session_state):
+    """ Counts the Streamlit session as active until its state is discarded. """
+    if "metrics_session" in session_state:
+        return
+    token = _SessionToken()
+    session_state.metrics_session = token
+    ACTIVE_SESSIONS.inc()
+    weakref.finalize(token, ACTIVE_SESSIONS.dec)
@@ -0,0 +1,47 @@
+""" Prompts of the City Permitting app.
+
+Static prompt text is kept apart from the per-request material and comes
+first, ahead of the retrieved regulations and the request, so the model
+server can reuse its prefix cache across questions and sessions (see
+prompt_layout).
+"""
+from typing import Any, Dict
+from prompt_layout import canonical_json, normalize
+
+SYSTEM_PROMPT = normalize("""
+You are an expert City Permitting AI Agent for Denver food truck permits.
+
+Your responsibilities:
+1. Review permit applications for completeness and accuracy
+2. Check compliance with Denver food truck regulations
+3. Identify missing information or errors
+4. Provide clear, actionable feedback with specific regulation references
+5. Generate evaluation scorecards with scores from 0-100
+
+Always be professional, thorough, and cite specific regulations when providing feedback.
+When RELEVANT DENVER REGULATIONS are provided, base your response on them.
+""")
+
+EVALUATION_INSTRUCTIONS = normalize("""
+Evaluate the Denver food truck permit application below.
+
+Provide a detailed evaluation in JSON format with:
+{
+  "overall_score": <0-100>,
+  "recommendation": "APPROVED" | "NEEDS_REVISION" | "REJECTED",
+  "categories": {
+    "completeness": {"score": <0-100>, "findings": [...], "required_actions": [...]},
+    "accuracy": {"score": <0-100>, "findings": [...], "required_actions": [...]},
+    "compliance": {"score": <0-100>, "findings": [...], "required_actions": [...]},
+    "documentation": {"score": <0-100>, "findings": [...], "required_actions": [...]},
+    "safety_requirements": {"score": <0-100>, "findings": [...], "required_actions": [...]}
+  },
+  "summary": "<brief summary>",
+  "next_steps": [...]
+}
+""")
+
+
+def application_data(application: Dict[str, Any]) -> str:
+    """The application being evaluated, to follow EVALUATION_INSTRUCTIONS"""
+    return f"APPLICATION DATA:\n{canonical_json(application)}"
@@ -0,0 +1,192 @@
+""" Prompt Layout Benchmark
+
+Replays City Permitting conversations (questions and application
+evaluations, several sessions interleaved) against mock-llama-stack with its
+prefix cache enabled, once with the original prompt layout (question ahead
+of the regulations, application data ahead of the evaluation instructions)
+and once with the prefix-cache-friendly layout of prompt_layout and
+permit_prompts.  Reports the share of prompt tokens served from the prefix
+cache and the time to first token of each layout.
+
+    PREFILL_TOKENS_PER_SECOND=2000 PREFIX_CACHE_BLOCKS=100000 python app.py    # mock-llama-stack
+    python prompt_bench.py http://localhost:8321 --sessions 8 --turns 4
+"""
+import json
+import time
+import random
+import statistics
+import click
+import httpx
+from llama_stack_client import LlamaStackClient
+from prompt_layout import user_message
+from permit_prompts import SYSTEM_PROMPT, EVALUATION_INSTRUCTIONS, application_data
+
+LAYOUT_ORIGINAL = "original"
+LAYOUT_PREFIX = "prefix"
+
+REGULATIONS = [
+    "Hand washing sink: minimum 10 inches wide x 10 inches long x 5 inches deep. Water temperature: "
+    "100F to 120F at the faucet.",
+    "Wastewater tank must be at least 15% larger than the clean water tank. Minimum 30 gallon clean "
+    "water tank for units that prepare food.",
+    "Type I hood required over all cooking equipment that produces grease-laden vapors, with a fire "
+    "suppression system inspected every six months.",
+    "Mobile units must operate from a licensed commissary and return to it daily for cleaning, "
+    "servicing and wastewater disposal.",
+    "Mobile food vendors may not operate within 200 feet of a restaurant during its business hours "
+    "without written permission, nor within 50 feet of a park boundary without a permit.",
+    "Refrigeration must hold potentially hazardous food at 41F or below; hot holding equipment must "
+    "hold food at 135F or above.",
+]
+
+# questions and the regulations retrieved for them
+QUESTIONS = [
+    ("What are the water tank requirements for a food truck?", [0, 1, 3]),
+    ("Where can I operate my food truck in Denver?", [4, 3, 1]),
+    ("What fire safety equipment is required?", [2, 5, 0]),
+    ("How cold does my refrigerator need to be?", [5, 2, 3]),
+]
+
+ORIGINAL_SYSTEM_PROMPT = """You are an expert City Permitting AI Agent for Denver food truck permits.
+
+Your responsibilities:
+1. Review permit applications for completeness and accuracy
+2. Check compliance with Denver food truck regulations
+3. Identify missing information or errors
+4. Provide clear, actionable feedback with specific regulation references
+5. Generate evaluation scorecards with scores from 0-100
+
+Always be professional, thorough, and cite specific regulations when providing feedback."""
+
+
+def original_user_message(query: str, context: list[str]) -> str:
+    """ The original layout: the request, then the regulations in retrieval order. """
+    return f"""{query}
+
+RELEVANT DENVER REGULATIONS:
+{chr(10).join(context)}
+
+Base your response on the regulations provided above."""
+
+
+def original_evaluation_request(application: dict) -> str:
+    """ The original layout: the application data ahead of the evaluation instructions. """
+    return f"""Evaluate this Denver food truck permit application:
+
+APPLICATION DATA:
+{json.dumps(application, indent=2)}
+
+Provide a detailed evaluation in JSON format with:
+{{
+  "overall_score": <0-100>,
+  "recommendation": "APPROVED" | "NEEDS_REVISION" | "REJECTED",
+  "categories": {{
+    "completeness": {{"score": <0-100>, "findings": [...], "required_actions": [...]}},
+    "accuracy": {{"score": <0-100>, "findings": [...], "required_actions": [...]}},
+    "compliance": {{"score": <0-100>, "findings": [...], "required_actions": [...]}},
+    "documentation": {{"score": <0-100>, "findings": [...], "required_actions": [...]}},
+    "safety_requirements": {{"score": <0-100>, "findings": [...], "required_actions": [...]}}
+  }},
+  "summary": "<brief summary>",
+  "next_steps": [...]
+}}"""
+
+
+def application(session: int) -> dict:
+    """ A permit application that differs between sessions. """
+    return {
+        "business_name": f"Benchmark Tacos {session}",
+        "operator_name": f"Operator {session}",
+        "vehicle_type": "Food Truck",
+        "commissary": "Mock Commissary",
+        "commissary_address": f"{100 + session} Main St, Denver, CO",
+        "water_system": {"clean_water_tank_size": f"{30 + session} gallons",
+                         "wastewater_tank_size": f"{40 + session} gallons"},
+        "menu": ["Tacos", "Burritos"],
+    }
+
+
+def build_turn(layout: str, session: int, turn: int, rng: random.Random) -> str:
+    """ The user message of a session's turn: alternately a question and an evaluation. """
+    query, regulation_ids = QUESTIONS[(session + turn) % len(QUESTIONS)]
+    instructions = None
+    if turn % 2:
+        if layout == LAYOUT_ORIGINAL:
+            query = original_evaluation_request(application(session))
+        else:
+            query, instructions = application_data(application(session)), EVALUATION_INSTRUCTIONS
+        regulation_ids = [0, 1, 2, 3]
+    # retrieval scores vary between phrasings, so the chunks come back in varying order
+    context = [REGULATIONS[i] for i in regulation_ids]
+    rng.shuffle(context)
+    if layout == LAYOUT_ORIGINAL:
+        return original_user_message(query, context)
+    return user_message(query, context, context_heading="RELEVANT DENVER REGULATIONS", request_heading="REQUEST",
+                        instructions=instructions)
+
+
+def complete(client: LlamaStackClient, model: str, messages: list) -> tuple[str, float, dict]:
+    """ Streams a chat completion, returning its text, time to first token and metrics. """
+    start = time.perf_counter()
+    first_token = None
+    text = ""
+    metrics = {}
+    for chunk in client.inference.chat_completion(model_id=model, messages=messages, stream=True):
+        delta = getattr(chunk.event.delta, "text", "")
+        if delta and first_token is None:
+            first_token = time.perf_counter() - start
+        text += delta
+        metrics.update({m.metric: m.value for m in chunk.metrics or []})
+    return text, first_token or time.perf_counter() - start, metrics
+
+
+def run_layout(client: LlamaStackClient, url: str, model: str, layout: str, sessions: int, turns: int) -> dict:
+    """ Replays the conversations with one layout on a cleared prefix cache. """
+    httpx.delete(f"{url}/mock/prefix-cache")
+    rng = random.Random(7)
+    system_prompt = ORIGINAL_SYSTEM_PROMPT if layout == LAYOUT_ORIGINAL else SYSTEM_PROMPT
+    conversations = [[{"role": "system", "content": system_prompt}] for _ in range(sessions)]
+    ttfts = []
+    prompt_tokens = cached_tokens = 0
+
+    # sessions take turns, as concurrent users would
+    for turn in range(turns):
+        for session, messages in enumerate(conversations):
+            messages.append({"role": "user", "content": build_turn(layout, session, turn, rng)})
+            text, ttft, metrics = complete(client, model, messages)
+            messages.append({"role": "assistant", "content": text, "stop_reason": "end_of_turn"})
+            ttfts.append(ttft)
+            prompt_tokens += int(metrics.get("prompt_tokens", 0))
+            cached_tokens += int(metrics.get("cached_prompt_tokens", 0))
+
+    return {
+        "layout": layout,
+        "requests": len(ttfts),
+        "prompt_tokens": prompt_tokens,
+        "reuse": cached_tokens / prompt_tokens if prompt_tokens else 0.0,
+        "ttft_mean": statistics.fmean(ttfts),
+        "ttft_p95": statistics.quantiles(ttfts, n=20)[-1] if len(ttfts) > 1 else ttfts[0],
+    }
+
+
+@click.command()
+@click.argument('llama_stack_url')
+@click.option('--model', default="llama-4-scout-17b-16e-w4a16", help="Model to call")
+@click.option('--sessions', default=8, help="Concurrent conversations")
+@click.option('--turns', default=4, help="Turns per conversation, alternating questions and evaluations")
+def cli(llama_stack_url: str, model: str, sessions: int, turns: int):
+    """ Compares prefix cache reuse and TTFT of the original and prefix-friendly prompt layouts. """
+    client = LlamaStackClient(base_url=llama_stack_url)
+    results = [run_layout(client, llama_stack_url, model, layout, sessions, turns)
+               for layout in (LAYOUT_ORIGINAL, LAYOUT_PREFIX)]
+
+    print(f"{'layout':>10} {'requests':>8} {'prompt':>8} {'reuse':>7} {'ttft':>7} {'ttft95':>7}")
+    for r in results:
+        print(f"{r['layout']:>10} {r['requests']:>8} {r['prompt_tokens']:>8} {r['reuse']:>7.1%} "
+              f"{r['ttft_mean']:>7.3f} {r['ttft_p95']:>7.3f}")
+    original, prefix = results
+    print(f"TTFT improvement: {1 - prefix['ttft_mean'] / original['ttft_mean']:.1%}")
+
+
+if __name__ == '__main__':
+    cli()
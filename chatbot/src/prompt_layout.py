@@ -0,0 +1,45 @@
+""" Prompt Layout
+
+Builds prompts so a model server with automatic prefix caching (vLLM) can
+reuse as much of each one as possible.  A cached prefix ends at the first
+token that differs, so material is laid out from most to least stable: the
+static system prompt and instructions first, retrieved context next, and the
+per-request material (the question, the application being evaluated) last.
+Retrieved chunks change with every query, so sorting them buys little cache
+reuse; they keep the order (and deduplication) the retriever or context
+assembler gave them, most relevant first.  Whitespace is normalized so equal
+content always renders to identical text.
+"""
+import json
+import textwrap
+
+
+def normalize(text: str) -> str:
+    """ Dedented, stripped text with trailing whitespace removed from every line. """
+    return "\n".join(line.rstrip() for line in textwrap.dedent(text).strip().splitlines())
+
+
+def normalize_chunks(chunks: list[str]) -> list[str]:
+    """ The non-empty chunks, normalized, in their given order. """
+    return [normalize(chunk) for chunk in chunks if chunk and chunk.strip()]
+
+
+def canonical_json(data) -> str:
+    """ JSON with sorted keys, so equal data always renders the same. """
+    return json.dumps(data, indent=2, sort_keys=True)
+
+
+def user_message(request: str, context: list[str] = None, context_heading: str = "Context",
+                 request_heading: str = "Question", instructions: str = None) -> str:
+    """ A user turn with static instructions first, then the retrieved context, then the request.
+
+    :param request: The per-request material, placed last
+    :param context: Retrieved chunks in relevance order
+    :param instructions: Static task instructions, placed first
+    """
+    parts = [normalize(instructions)] if instructions else []
+    chunks = normalize_chunks(context or [])
+    if chunks:
+        parts.append(f"{context_heading}:\n" + "\n\n".join(chunks))
+    parts.append(f"{request_heading}:\n{normalize(request)}")
+    return "\n\n".join(parts)
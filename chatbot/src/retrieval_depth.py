@@ -0,0 +1,98 @@
+""" Adaptive Retrieval Depth
+
+Picks how many chunks to retrieve for a question instead of always asking
+for five.  The question is classified first: chit-chat ("thanks!", "hello")
+skips retrieval, short factual questions get a few chunks and diagnostic
+questions get up to the maximum.  When the retriever reports similarity
+scores, the ranked chunks are then cut at the score elbow, the largest drop
+relative to the best score, so only the chunks that clearly stand out are
+sent to the model.
+"""
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+QUERY_CHITCHAT = "chitchat"
+QUERY_FACTUAL = "factual"
+QUERY_DIAGNOSTIC = "diagnostic"
+
+_CHITCHAT_PHRASES = (
+    r"hi|hello|hey|yo|thanks|thank you|thx|ty|ok|okay|cool|great|awesome|nice|perfect|got it|"
+    r"bye|goodbye|see ya|good (morning|afternoon|evening|night)|how are you|who are you|what can you do"
+)
+# words that may follow a chit-chat phrase ("hi there", "thanks so much")
+_CHITCHAT_FILLER = r"there|so much|a lot|again|all"
+
+# the whole message must be chit-chat, so "ok, why won't it start?" is a question
+CHITCHAT_PATTERN = re.compile(
+    rf"^\s*(?:{_CHITCHAT_PHRASES})\b(?:[\s,.!]+(?:{_CHITCHAT_PHRASES}|{_CHITCHAT_FILLER})\b)*[\s.!?]*$",
+    re.IGNORECASE)
+
+# words that mark a troubleshooting question, which needs more context
+DIAGNOSTIC_WORDS = frozenset((
+    "why", "wont", "won't", "doesnt", "doesn't", "isnt", "isn't", "not", "noise", "noisy", "leak", "leaks",
+    "leaking", "problem", "issue", "diagnose", "troubleshoot", "intermittent", "intermittently", "stall",
+    "stalls", "overheat", "overheats", "overheating", "rough", "fail", "fails", "failing", "vibration",
+    "vibrates", "smell", "smoke", "knock", "knocking", "misfire", "symptom", "stuck", "sticks", "slips",
+))
+
+# questions this long are treated as diagnostic whatever their words
+DIAGNOSTIC_WORD_COUNT = 20
+
+
+def classify_query(text: str) -> str:
+    """ Chit-chat, factual or diagnostic. """
+    words = re.findall(r"[\w']+", text.casefold())
+    if not words or CHITCHAT_PATTERN.match(text):
+        return QUERY_CHITCHAT
+    if len(words) >= DIAGNOSTIC_WORD_COUNT or DIAGNOSTIC_WORDS.intersection(words):
+        return QUERY_DIAGNOSTIC
+    return QUERY_FACTUAL
+
+
+class DepthSelector:
+    """ Chooses the retrieval depth of a question and trims the ranked results. """
+
+    def __init__(self, max_chunks: int = 6, factual_chunks: int = 3, elbow_drop: float = 0.25,
+                 min_score: float = None):
+        """
+        :param max_chunks: Chunks retrieved for diagnostic questions
+        :param factual_chunks: Chunks retrieved for factual questions
+        :param elbow_drop: Smallest drop between consecutive scores, as a share of the
+            best score, that ends the selection
+        :param min_score: Chunks scored below this are dropped
+        """
+        self.max_chunks = max_chunks
+        self.factual_chunks = factual_chunks
+        self.elbow_drop = elbow_drop
+        self.min_score = min_score
+
+    def depth(self, query: str) -> tuple[str, int]:
+        """ The query's class and how many chunks to retrieve for it. """
+        query_class = classify_query(query)
+        depth = {
+            QUERY_CHITCHAT: 0,
+            QUERY_FACTUAL: min(self.factual_chunks, self.max_chunks),
+            QUERY_DIAGNOSTIC: self.max_chunks,
+        }[query_class]
+        return query_class, depth
+
+    def cut(self, chunks: list[dict]) -> list[dict]:
+        """ The chunks up to the score elbow, best first.  Chunks are returned
+            unchanged when any is unscored.
+        """
+        if not chunks or any(chunk.get("score") is None for chunk in chunks):
+            return chunks
+        ranked = sorted(chunks, key=lambda chunk: chunk["score"], reverse=True)
+        if self.min_score is not None:
+            ranked = [chunk for chunk in ranked if chunk["score"] >= self.min_score]
+        if len(ranked) < 2 or ranked[0]["score"] <= 0:
+            return ranked
+
+        scores = [chunk["score"] for chunk in ranked]
+        drops = [(scores[i] - scores[i + 1]) / scores[0] for i in range(len(scores) - 1)]
+        elbow = max(range(len(drops)), key=drops.__getitem__)
+        if drops[elbow] >= self.elbow_drop:
+            ranked = ranked[:elbow + 1]
+        return ranked
@@ -0,0 +1,159 @@
+""" Endpoint Router Check
+
+Starts several mock-llama-stack servers as stand-in LLama Stack replicas and
+drives retrieval and chat traffic through the endpoint router while faults
+are injected: first all replicas healthy, then one slowed down, then one
+unhealthy (answering 503), then one killed.  Reports how the traffic split
+between the replicas, how many requests were hedged or failed over, request
+latency, and whether any request failed.
+
+    python router_bench.py ../../mock-llama-stack/src/app.py --replicas 3
+"""
+import os
+import sys
+import time
+import socket
+import logging
+import statistics
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import click
+import httpx
+from llama_stack_client import LlamaStackClient
+from llama_stack_client.types.shared_params.query_config import QueryConfig
+import endpoint_router
+from endpoint_router import EndpointRouter, ROUTED_BASE_URL
+
+VECTOR_DB_ID = "mechanic_vector_db"
+
+
+def free_port() -> int:
+    """ A TCP port nothing is listening on. """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_mock(mock_app: str, port: int) -> subprocess.Popen:
+    """ Starts a mock-llama-stack on the port and waits for it to answer. """
+    env = dict(os.environ, MOCK_PORT=str(port), LOG_LEVEL="warning", RETRIEVAL_LATENCY_MS="20",
+               TTFT_MS="50", TOKENS_PER_SECOND="2000", OUTPUT_TOKENS="20")
+    process = subprocess.Popen([sys.executable, os.path.basename(mock_app)], cwd=os.path.dirname(mock_app) or ".",
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/v1/health")
+            return process
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Mock LLama Stack on port {port} did not start")
+
+
+def request_counts() -> dict:
+    """ Requests sent to each endpoint so far, from the router's metrics. """
+    counts = {}
+    for metric in endpoint_router.REQUESTS.collect():
+        for sample in metric.samples:
+            if sample.name.endswith("_total"):
+                counts[sample.labels["endpoint"]] = counts.get(sample.labels["endpoint"], 0) + sample.value
+    return counts
+
+
+def metric_total(counter) -> float:
+    """ The sum of a counter over its labels. """
+    return sum(s.value for m in counter.collect() for s in m.samples if s.name.endswith("_total"))
+
+
+def one_turn(client: LlamaStackClient, model: str, question: str):
+    """ A mechanic chatbot turn: retrieval, then a streamed answer. """
+    client.tool_runtime.rag_tool.query(vector_db_ids=[VECTOR_DB_ID], content=question,
+                                       query_config=QueryConfig(max_chunks=3))
+    for _ in client.inference.chat_completion(model_id=model, stream=True,
+                                              messages=[{"role": "user", "content": question}]):
+        pass
+
+
+def run_phase(name: str, client: LlamaStackClient, model: str, turns: int, concurrency: int) -> dict:
+    """ Runs turns through the router and reports what happened. """
+    before = request_counts()
+    hedges = metric_total(endpoint_router.HEDGES)
+    failovers = metric_total(endpoint_router.FAILOVERS)
+    latencies, errors = [], 0
+
+    def timed(i):
+        start = time.perf_counter()
+        one_turn(client, model, f"Why does my engine make a knocking noise? ({i})")
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(timed, i) for i in range(turns)]
+        for future in futures:
+            try:
+                latencies.append(future.result())
+            except Exception:   # pylint: disable=broad-except
+                errors += 1
+
+    after = request_counts()
+    return {
+        "phase": name,
+        "split": {endpoint: int(after[endpoint] - before.get(endpoint, 0)) for endpoint in after},
+        "hedges": int(metric_total(endpoint_router.HEDGES) - hedges),
+        "failovers": int(metric_total(endpoint_router.FAILOVERS) - failovers),
+        "errors": errors,
+        "p50": statistics.median(latencies) if latencies else 0.0,
+        "p95": statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else 0.0,
+    }
+
+
+@click.command()
+@click.argument('mock_app')
+@click.option('--replicas', default=3, help="Mock LLama Stack servers to start")
+@click.option('--turns', default=60, help="Chat turns per phase")
+@click.option('--concurrency', default=6, help="Concurrent chat turns")
+@click.option('--slow-ms', default=400, help="Latency injected into the slow replica")
+@click.option('--settle', default=3.0, help="Seconds between phases for health checks to catch up")
+@click.option('--model', default="llama-4-scout-17b-16e-w4a16", help="Model to call")
+def cli(mock_app: str, replicas: int, turns: int, concurrency: int, slow_ms: int, settle: float,
+        model: str):
+    """ Checks balancing, hedging, ejection and failover of the endpoint router. """
+    if replicas < 3:
+        raise click.BadParameter("At least three replicas are needed", param_hint="--replicas")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    ports = [free_port() for _ in range(replicas)]
+    processes = [start_mock(mock_app, port) for port in ports]
+    urls = [f"http://127.0.0.1:{port}" for port in ports]
+    try:
+        router = EndpointRouter(urls, health_interval=0.5, hedge_min_samples=10)
+        router.start_health_checks()
+        client = LlamaStackClient(base_url=ROUTED_BASE_URL, http_client=router.http_client())
+
+        results = [run_phase("healthy", client, model, turns, concurrency)]
+
+        httpx.post(f"{urls[0]}/mock/fault", json={"latency_ms": slow_ms})
+        results.append(run_phase("slow", client, model, turns, concurrency))
+
+        # let the health checks see the slow replica recover
+        httpx.post(f"{urls[0]}/mock/fault", json={"latency_ms": 0})
+        time.sleep(settle)
+        httpx.post(f"{urls[1]}/mock/fault", json={"healthy": False})
+        results.append(run_phase("unhealthy", client, model, turns, concurrency))
+
+        httpx.post(f"{urls[1]}/mock/fault", json={"healthy": True})
+        processes[2].terminate()
+        processes[2].wait()
+        results.append(run_phase("killed", client, model, turns, concurrency))
+
+        print(f"replicas: {', '.join(f'{i}={url}' for i, url in enumerate(urls))}")
+        print(f"{'phase':>10} {'split':>20} {'hedges':>6} {'failover':>8} {'errors':>6} {'p50':>6} {'p95':>6}")
+        for r in results:
+            split = "/".join(str(r["split"].get(str(httpx.URL(url)), 0)) for url in urls)
+            print(f"{r['phase']:>10} {split:>20} {r['hedges']:>6} {r['failovers']:>8} {r['errors']:>6} "
+                  f"{r['p50']:>6.3f} {r['p95']:>6.3f}")
+        print("healthy: " + ", ".join(f"{e.name}={e.healthy}" for e in router.endpoints))
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,72 @@
+""" OpenTelemetry Tracing
+
+Sets up span export for the chatbots.  Spans go to the OTLP endpoint in
+OTEL_EXPORTER_OTLP_ENDPOINT, or are appended as JSON lines to TRACE_FILE, and
+tracing is a no-op when neither is set.  The httpx clients used by the
+LLama Stack and OpenAI SDKs are instrumented, so every call to LLama Stack
+carries the current trace context in its traceparent header.
+"""
+import os
+import logging
+import threading
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+from opentelemetry.instrumentation.httpx import HTTPXClientInstrumentor
+
+ENV_OTLP_ENDPOINT = "OTEL_EXPORTER_OTLP_ENDPOINT"
+ENV_TRACE_FILE = "TRACE_FILE"
+
+# OpenTelemetry GenAI semantic convention attributes
+ATTR_MODEL = "gen_ai.request.model"
+ATTR_INPUT_TOKENS = "gen_ai.usage.input_tokens"
+ATTR_OUTPUT_TOKENS = "gen_ai.usage.output_tokens"
+ATTR_TIME_TO_FIRST_TOKEN = "gen_ai.response.time_to_first_token"
+
+logger = logging.getLogger(__name__)
+
+tracer = trace.get_tracer("chatbot")
+
+_setup_lock = threading.Lock()
+_setup_done = False
+
+
+def setup_tracing(service_name: str):
+    """ Configures span export once per process.
+
+        Streamlit re-runs the app script on every interaction, so repeat calls
+        are ignored.
+    """
+    global _setup_done      # pylint: disable=global-statement
+    with _setup_lock:
+        if _setup_done:
+            return
+        _setup_done = True
+
+        if ENV_OTLP_ENDPOINT in os.environ:
+            # pylint: disable=import-outside-toplevel
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            exporter = OTLPSpanExporter()
+            logger.info("Exporting traces to %s", os.environ[ENV_OTLP_ENDPOINT])
+        elif ENV_TRACE_FILE in os.environ:
+            trace_file = open(os.environ[ENV_TRACE_FILE], "a", encoding="utf-8")   # pylint: disable=consider-using-with
+            exporter = ConsoleSpanExporter(out=trace_file,
+                                           formatter=lambda span: span.to_json(indent=None) + "\n")
+            logger.info("Writing traces to %s", os.environ[ENV_TRACE_FILE])
+        else:
+            logger.info("Tracing disabled.  Set %s or %s to enable.", ENV_OTLP_ENDPOINT, ENV_TRACE_FILE)
+            return
+
+        provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+        trace.set_tracer_provider(provider)
+        HTTPXClientInstrumentor().instrument()
+
+
+def record_usage(span, input_tokens, output_tokens):
+    """ Records token counts on a span, skipping any the server didn't report. """
+    if input_tokens is not None:
+        span.set_attribute(ATTR_INPUT_TOKENS, input_tokens)
+    if output_tokens is not None:
+        span.set_attribute(ATTR_OUTPUT_TOKENS, output_tokens)
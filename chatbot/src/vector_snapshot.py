@@ -0,0 +1,270 @@
+""" Vector Snapshots
+
+Portable, versioned copy of an ingested corpus: chunk embeddings as .npy
+matrices that are memory-mapped (not read) when loaded, plus compact chunk
+text and document metadata.  A snapshot can be exported from the Milvus
+collection behind a LLama Stack vector DB (or saved from a local index),
+loaded straight into a local index at pod startup, or bulk-restored with its
+embeddings into a fresh LLama Stack vector DB without re-embedding anything.
+
+Layout, where each export adds a new version directory and updates LATEST:
+
+    <snapshot dir>/LATEST
+    <snapshot dir>/<version>/manifest.json, vectors.npy, scales.npy,
+                             offsets.npy, documents.npy, text.txt, document_ids.json
+
+    python vector_snapshot.py build http://llamastack:8321 all-MiniLM-L6-v2 snapshots/ c3_repair.md
+    python vector_snapshot.py export-milvus http://milvus:19530 mechanic_vector_db all-MiniLM-L6-v2 snapshots/
+    python vector_snapshot.py restore http://llamastack:8321 snapshots/ mechanic_vector_db milvus
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import tempfile
+import click
+import numpy as np
+from local_index import LlamaStackEmbedder, VectorIndex, build_index
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT_VERSION = 1
+LATEST_FILE = "LATEST"
+MANIFEST_FILE = "manifest.json"
+
+# LLama Stack's Milvus provider keeps each chunk's content and metadata in this JSON field
+DEFAULT_MILVUS_TEXT_FIELD = "chunk_content"
+
+
+def write_snapshot(snapshot_dir: str, index: VectorIndex, embedding_model: str, source: str) -> str:
+    """ Writes the index as a new snapshot version and points LATEST at it.
+
+    :returns: Path of the new version
+    """
+    version = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    os.makedirs(snapshot_dir, exist_ok=True)
+
+    # write to a temporary directory first, so readers never see a partial version
+    staging = tempfile.mkdtemp(prefix=".staging-", dir=snapshot_dir)
+    np.save(os.path.join(staging, "vectors.npy"), np.ascontiguousarray(index.vectors))
+    np.save(os.path.join(staging, "scales.npy"), index.scales)
+    np.save(os.path.join(staging, "offsets.npy"), index.offsets)
+    np.save(os.path.join(staging, "documents.npy"), index.documents)
+    # offsets index characters of the text, so line endings are written (and read) untranslated
+    with open(os.path.join(staging, "text.txt"), "w", encoding="utf-8", newline="") as f:
+        f.write(index.text)
+    with open(os.path.join(staging, "document_ids.json"), "w", encoding="utf-8") as f:
+        json.dump(index.document_ids, f)
+    with open(os.path.join(staging, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "version": version,
+            "source": source,
+            "embedding_model": embedding_model,
+            "dimension": index.dimension,
+            "dtype": str(index.vectors.dtype),
+            "chunks": len(index),
+            "documents": len(index.document_ids),
+        }, f, indent=2)
+
+    path = os.path.join(snapshot_dir, version)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(staging, path)
+    with open(os.path.join(snapshot_dir, LATEST_FILE), "w", encoding="utf-8") as f:
+        f.write(version)
+    logger.info("Wrote snapshot.  Path=%s. Chunks=%s. Bytes=%s", path, len(index), index.nbytes)
+    return path
+
+
+def resolve_snapshot(path: str) -> str:
+    """ The version directory for path, following LATEST when given the snapshot directory. """
+    if os.path.exists(os.path.join(path, MANIFEST_FILE)):
+        return path
+    latest = os.path.join(path, LATEST_FILE)
+    if not os.path.exists(latest):
+        raise FileNotFoundError(f"No snapshot found at {path}")
+    with open(latest, "r", encoding="utf-8") as f:
+        return os.path.join(path, f.read().strip())
+
+
+def read_manifest(path: str) -> dict:
+    """ Manifest of a snapshot, checking its format version. """
+    with open(os.path.join(resolve_snapshot(path), MANIFEST_FILE), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format version {manifest.get('format_version')}")
+    return manifest
+
+
+def load_snapshot(path: str) -> tuple[VectorIndex, dict]:
+    """ Maps a snapshot into a local index.  The embedding matrix is
+        memory-mapped read only, so loading takes milliseconds and the pages
+        are shared between processes on the node.
+
+    :returns: The index and the snapshot's manifest
+    """
+    start = time.perf_counter()
+    manifest = read_manifest(path)
+    path = resolve_snapshot(path)
+
+    def array(name: str):
+        return np.load(os.path.join(path, name), mmap_mode="r")
+
+    with open(os.path.join(path, "text.txt"), "r", encoding="utf-8", newline="") as f:
+        text = f.read()
+    with open(os.path.join(path, "document_ids.json"), "r", encoding="utf-8") as f:
+        document_ids = json.load(f)
+    index = VectorIndex.from_arrays(array("vectors.npy"), array("scales.npy"), text,
+                                    array("offsets.npy"), array("documents.npy"), document_ids)
+    logger.info("Loaded snapshot.  Path=%s. Chunks=%s. Seconds=%.3f",
+                path, len(index), time.perf_counter() - start)
+    return index, manifest
+
+
+def restore_snapshot(client, path: str, vector_db_id: str, provider_id: str, batch_size: int = 256):
+    """ Registers a LLama Stack vector DB and bulk inserts the snapshot's
+        chunks with their stored embeddings, so nothing is re-embedded.
+    """
+    index, manifest = load_snapshot(path)
+    client.vector_dbs.register(
+        vector_db_id=vector_db_id,
+        provider_id=provider_id,
+        embedding_model=manifest["embedding_model"],
+        embedding_dimension=manifest["dimension"],
+    )
+    for start in range(0, len(index), batch_size):
+        end = min(start + batch_size, len(index))
+        embeddings = np.asarray(index.vectors[start:end], dtype=np.float32) * index.scales[start:end, None]
+        chunks = [
+            {
+                "content": chunk["text"],
+                "metadata": {"document_id": chunk["document_id"]},
+                "embedding": embedding.tolist(),
+            }
+            for chunk, embedding in zip((index.chunk(i) for i in range(start, end)), embeddings)
+        ]
+        client.vector_io.insert(vector_db_id=vector_db_id, chunks=chunks)
+        logger.info("Restored %s of %s chunks", end, len(index))
+
+
+def content_text(content) -> str:
+    """ Flattens LLama Stack interleaved content into plain text. """
+    if isinstance(content, str):
+        return content
+    if isinstance(content, dict):
+        return content.get("text", "")
+    return "".join(content_text(c) for c in content or [])
+
+
+def export_milvus(uri: str, token: str, collection: str, embedding_model: str, snapshot_dir: str,
+                  text_field: str = DEFAULT_MILVUS_TEXT_FIELD, batch_size: int = 1000) -> str:
+    """ Exports every chunk of a Milvus collection into a new snapshot version. """
+    # pylint: disable=import-outside-toplevel
+    from pymilvus import MilvusClient, DataType
+
+    client = MilvusClient(uri=uri, token=token)
+    fields = client.describe_collection(collection)["fields"]
+    vector_field = next(f["name"] for f in fields if f["type"] == DataType.FLOAT_VECTOR)
+    logger.info("Exporting Milvus collection.  Collection=%s. Vector Field=%s. Text Field=%s",
+                collection, vector_field, text_field)
+
+    # group chunks by document, keeping insertion order
+    documents = {}
+    iterator = client.query_iterator(collection_name=collection, batch_size=batch_size,
+                                     output_fields=[vector_field, text_field])
+    try:
+        while batch := iterator.next():
+            for row in batch:
+                value = row[text_field]
+                if isinstance(value, str):
+                    try:
+                        value = json.loads(value)
+                    except ValueError:
+                        value = {"content": value}
+                metadata = value.get("metadata") or {}
+                texts, vectors = documents.setdefault(str(metadata.get("document_id", "unknown")), ([], []))
+                texts.append(content_text(value.get("content")))
+                vectors.append(row[vector_field])
+    finally:
+        iterator.close()
+    if not documents:
+        raise ValueError(f"Collection {collection} is empty")
+
+    index = None
+    for document_id, (texts, vectors) in documents.items():
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if index is None:
+            index = VectorIndex(vectors.shape[1])
+        index.add(document_id, texts, vectors)
+    return write_snapshot(snapshot_dir, index, embedding_model, f"milvus:{collection}")
+
+
+@click.group()
+def cli():
+    """ Export, inspect and restore vector snapshots. """
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+
+
+@cli.command("build")
+@click.argument('llama_stack_url')
+@click.argument('embedding_model')
+@click.argument('snapshot_dir')
+@click.argument('sources', nargs=-1, required=True)
+@click.option('--quantize', is_flag=True, help="Store int8 embeddings")
+def build_command(llama_stack_url: str, embedding_model: str, snapshot_dir: str, sources: tuple, quantize: bool):
+    """ Chunks and embeds text or markdown SOURCES into SNAPSHOT_DIR. """
+    # pylint: disable=import-outside-toplevel
+    from llama_stack_client import LlamaStackClient
+
+    documents = {}
+    for source in sources:
+        with open(source, "r", encoding="utf-8") as f:
+            documents[os.path.basename(source)] = f.read()
+    embedder = LlamaStackEmbedder(LlamaStackClient(base_url=llama_stack_url), embedding_model)
+    index = build_index(documents, embedder, max_chunks=sys.maxsize, quantize=quantize)
+    if index is None:
+        raise click.ClickException("Sources have no text")
+    print(write_snapshot(snapshot_dir, index, embedding_model, ",".join(sources)))
+
+
+@cli.command("export-milvus")
+@click.argument('milvus_uri')
+@click.argument('collection')
+@click.argument('embedding_model')
+@click.argument('snapshot_dir')
+@click.option('--token', default="", help="Milvus token (user:password)")
+@click.option('--text-field', default=DEFAULT_MILVUS_TEXT_FIELD, help="Field holding the chunk content")
+def export_milvus_command(milvus_uri: str, collection: str, embedding_model: str, snapshot_dir: str,
+                          token: str, text_field: str):
+    """ Exports a Milvus collection to SNAPSHOT_DIR. """
+    print(export_milvus(milvus_uri, token, collection, embedding_model, snapshot_dir, text_field))
+
+
+@cli.command("info")
+@click.argument('snapshot')
+def info_command(snapshot: str):
+    """ Prints a snapshot's manifest. """
+    print(json.dumps(read_manifest(snapshot), indent=2))
+
+
+@cli.command("restore")
+@click.argument('llama_stack_url')
+@click.argument('snapshot')
+@click.argument('vector_db_id')
+@click.argument('provider_id')
+@click.option('--batch-size', default=256, help="Chunks per insert call")
+def restore_command(llama_stack_url: str, snapshot: str, vector_db_id: str, provider_id: str, batch_size: int):
+    """ Restores SNAPSHOT into a new LLama Stack vector DB. """
+    # pylint: disable=import-outside-toplevel
+    from llama_stack_client import LlamaStackClient
+
+    start = time.perf_counter()
+    restore_snapshot(LlamaStackClient(base_url=llama_stack_url), snapshot, vector_db_id, provider_id, batch_size)
+    print(f"Restored {snapshot} into {vector_db_id} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,5 @@
+""" The chatbot modules are run from chatbot/src, so the tests import them from there. """
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
@@ -0,0 +1,22 @@
+""" Tests of vector_snapshot. """
+import numpy as np
+from local_index import VectorIndex
+from vector_snapshot import load_snapshot, write_snapshot
+
+
+def test_round_trip_keeps_chunk_text(tmp_path):
+    chunks = ["Torque the bolts\r\nto 35 ft-lb.\r\n", "Käse, crème brûlée 🚚\n", "last\rchunk"]
+    index = VectorIndex(4)
+    index.add("doc-1", chunks[:2], np.eye(4, dtype=np.float32)[:2])
+    index.add("doc-2", chunks[2:], np.eye(4, dtype=np.float32)[2:3])
+
+    write_snapshot(str(tmp_path), index, "test-model", "test")
+    loaded, manifest = load_snapshot(str(tmp_path))
+
+    assert manifest["chunks"] == 3
+    assert loaded.text == index.text
+    assert [loaded.chunk(i) for i in range(len(loaded))] == [
+        {"text": chunks[0], "document_id": "doc-1"},
+        {"text": chunks[1], "document_id": "doc-1"},
+        {"text": chunks[2], "document_id": "doc-2"},
+    ]
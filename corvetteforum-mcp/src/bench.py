@@ -0,0 +1,93 @@
+""" Offline MCP Benchmark
+
+Starts stub_server.py on recorded fixtures and the MCP server pointed at it,
+then measures tool latency, throughput and page conversion time under
+concurrent MCP clients.  Repeat --workers to compare conversion pool sizes.
+
+    python bench.py ../fixtures --clients 16 --calls 5 --workers 1 --workers 4
+"""
+import os
+import sys
+import time
+import asyncio
+import subprocess
+import click
+import httpx
+from loadtest import run, print_summary
+
+
+def wait_until_healthy(url: str, timeout: float):
+    """ Polls url until it answers 200. """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise click.ClickException(f"{url} did not become healthy within {timeout}s")
+
+
+def bench_once(fixtures_dir: str, workers: int, options: dict) -> dict:
+    """ Benchmarks one conversion pool size against a fresh server. """
+    stub_port = options["stub_port"]
+    mcp_port = options["mcp_port"]
+    stub = subprocess.Popen([
+        sys.executable, "stub_server.py", fixtures_dir, "--port", str(stub_port),
+        "--search-latency-ms", str(options["search_latency_ms"]),
+        "--page-latency-ms", str(options["page_latency_ms"]),
+    ])
+    env = dict(os.environ,
+               MCP_PORT=str(mcp_port),
+               SEARCH_URL=f"http://127.0.0.1:{stub_port}/customsearch/v1",
+               GCP_API_KEY=os.environ.get("GCP_API_KEY", "replay"),
+               GOOGLE_CX=os.environ.get("GOOGLE_CX", "replay"),
+               CONVERT_WORKERS=str(workers),
+               LOG_LEVEL="warning")
+    if not options["cache"]:
+        env.update(SEARCH_CACHE_MAX_ENTRIES="0", PAGE_CACHE_MAX_ENTRIES="0")
+    server = subprocess.Popen([sys.executable, "app.py"], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        base_url = f"http://127.0.0.1:{mcp_port}"
+        wait_until_healthy(base_url + "/ready", options["startup_timeout"])
+        summary = asyncio.run(run(base_url + "/sse", options["clients"], options["calls"],
+                                  distinct=not options["cache"]))
+        summary["stats"] = httpx.get(base_url + "/stats", timeout=5).json()
+        return summary
+    finally:
+        server.terminate()
+        stub.terminate()
+        server.wait()
+        stub.wait()
+
+
+@click.command()
+@click.argument('fixtures_dir')
+@click.option('--workers', multiple=True, type=int, default=[1], help="Conversion pool sizes to compare")
+@click.option('--clients', default=8, help="Concurrent MCP sessions")
+@click.option('--calls', default=5, help="Tool calls per session")
+@click.option('--cache/--no-cache', default=False, help="Leave the server's caches on")
+@click.option('--search-latency-ms', default=100, help="Simulated search API latency")
+@click.option('--page-latency-ms', default=300, help="Simulated forum page latency")
+@click.option('--stub-port', default=9090)
+@click.option('--mcp-port', default=8089)
+@click.option('--startup-timeout', default=120.0, help="Seconds to wait for the MCP server")
+def cli(fixtures_dir: str, workers: list, **options):
+    """ Benchmarks the MCP server offline against FIXTURES_DIR. """
+    fixtures_dir = os.path.abspath(fixtures_dir)
+    for pool_size in workers:
+        print(f"=== CONVERT_WORKERS={pool_size} ===")
+        summary = bench_once(fixtures_dir, pool_size, options)
+        print_summary(summary)
+        conversions = summary["stats"]["conversions"]
+        if conversions["count"]:
+            print(f"Conversions: {conversions['count']}  "
+                  f"mean={conversions['seconds'] / conversions['count']:.2f}s "
+                  f"max={conversions['max_seconds']:.2f}s")
+        print()
+
+
+if __name__ == '__main__':
+    cli()
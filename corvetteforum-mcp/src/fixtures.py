@@ -0,0 +1,43 @@
+""" Recorded search API responses and forum pages for offline replay.
+
+Fixtures are laid out as:
+
+    <fixtures_dir>/search/<key>.json   {"query": ..., "response": <search API response>}
+    <fixtures_dir>/pages/<key>.html    raw forum page
+
+where key is derived from the normalized query or the page url.
+"""
+import os
+import json
+import hashlib
+
+
+def fixture_key(text: str) -> str:
+    """ File name safe key for a query or url. """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+def search_fixture_path(fixtures_dir: str, query: str) -> str:
+    """ Location of the recorded search response for a normalized query. """
+    return os.path.join(fixtures_dir, "search", fixture_key(query) + ".json")
+
+
+def page_fixture_path(fixtures_dir: str, url: str) -> str:
+    """ Location of the recorded page for a url. """
+    return os.path.join(fixtures_dir, "pages", fixture_key(url) + ".html")
+
+
+def record_search(fixtures_dir: str, query: str, response: dict):
+    """ Saves a search API response. """
+    path = search_fixture_path(fixtures_dir, query)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"query": query, "response": response}, f, indent=2)
+
+
+def record_page(fixtures_dir: str, url: str, page_contents: bytes):
+    """ Saves a downloaded forum page. """
+    path = page_fixture_path(fixtures_dir, url)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(page_contents)
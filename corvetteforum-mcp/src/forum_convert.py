@@ -0,0 +1,84 @@
+""" HTML to markdown conversion of forum pages.
+
+Runs in the MCP server's conversion process pool, so it only depends on
+docling and is kept free of the server's configuration and state.  docling
+takes seconds to import, so it is loaded on first use (or by warm_up()) rather
+than when this module is imported.
+"""
+import io
+import time
+
+# docling classes, loaded by load_docling()
+_docling = None
+
+# barrier the pool's workers meet at after warming up, set by init_worker()
+_warm_up_barrier = None
+
+
+def init_worker(warm_up_barrier):
+    """ Conversion pool initializer. """
+    global _warm_up_barrier     # pylint: disable=global-statement
+    _warm_up_barrier = warm_up_barrier
+
+
+def load_docling():
+    """ Imports docling's HTML backend once per process. """
+    global _docling     # pylint: disable=global-statement
+    if _docling is None:
+        # pylint: disable=import-outside-toplevel
+        from docling.backend.html_backend import HTMLDocumentBackend
+        from docling.datamodel.base_models import InputFormat
+        from docling.datamodel.document import InputDocument
+        _docling = (HTMLDocumentBackend, InputFormat, InputDocument)
+    return _docling
+
+
+def html_to_markdown(page_contents: bytes) -> str:
+    """ Converts a downloaded forum page to markdown.
+
+    :param page_contents: Raw HTML
+    :returns: Page contents as markdown
+    """
+    HTMLDocumentBackend, InputFormat, InputDocument = load_docling()     # pylint: disable=invalid-name
+    page_contents_stream = io.BytesIO(page_contents)
+    input_doc = InputDocument(
+        path_or_stream=page_contents_stream,
+        format=InputFormat.HTML,
+        backend=HTMLDocumentBackend,
+        filename="does_not_matter.html",
+    )
+    backend = HTMLDocumentBackend(in_doc=input_doc, path_or_stream=page_contents_stream)
+    doc_result = backend.convert()
+    return doc_result.export_to_markdown()
+
+
+def timed_html_to_markdown(page_contents: bytes) -> tuple[str, float]:
+    """ Converts a forum page, timing just the conversion (not the wait for a worker).
+
+    :returns: Page contents as markdown and the seconds taken
+    """
+    start = time.perf_counter()
+    markdown = html_to_markdown(page_contents)
+    return markdown, time.perf_counter() - start
+
+
+def warm_up() -> float:
+    """ Loads docling and runs a tiny conversion so the first real page is fast.
+
+    :returns: Seconds taken
+    """
+    start = time.perf_counter()
+    html_to_markdown(b"<html><body><h1>Warm Up</h1><p>C3 Corvette</p></body></html>")
+    return time.perf_counter() - start
+
+
+def warm_up_worker(timeout: float) -> float:
+    """ Warms up this worker, then waits until every worker of the pool has
+        warmed up, so no worker takes a second warm-up while another gets none.
+
+    :returns: Seconds taken by the warm-up
+    """
+    try:
+        return warm_up()
+    finally:
+        _warm_up_barrier.wait(timeout)
@@ -0,0 +1,409 @@
+""" Corvette Forum MCP Server
+
+Searches Corvette Forum's C3 tech support through the Google Custom Search
+API and returns the most relevant sections of the top threads.  Started by
+app.py, which is kept minimal because spawned conversion workers re-import
+the main script.
+"""
+import time
+# taken before the remaining imports so time-to-ready includes them
+process_start = time.monotonic()
+# pylint: disable=wrong-import-position
+import os
+import logging
+import json
+import asyncio
+import threading
+import multiprocessing
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+import httpx
+from mcp.server.fastmcp import FastMCP, Context
+import uvicorn
+from starlette.responses import JSONResponse
+import forum_convert
+from fixtures import record_search, record_page
+from section_ranker import select_sections
+from ttl_cache import TTLCache
+from tracing import setup_tracing, tracer, caller_context
+
+# configurable parameters
+ENV_MCP_PORT = "MCP_PORT"
+ENV_LOG_LEVEL = "LOG_LEVEL"
+ENV_GCP_API_KEY = "GCP_API_KEY"
+ENV_GOOGLE_CX = "GOOGLE_CX"
+ENV_FETCH_TOP_N = "FETCH_TOP_N"
+ENV_FETCH_BUDGET_SECONDS = "FETCH_BUDGET_SECONDS"
+ENV_PAGE_CACHE_TTL_SECONDS = "PAGE_CACHE_TTL_SECONDS"
+ENV_PAGE_CACHE_MAX_ENTRIES = "PAGE_CACHE_MAX_ENTRIES"
+ENV_SEARCH_CACHE_TTL_SECONDS = "SEARCH_CACHE_TTL_SECONDS"
+ENV_SEARCH_CACHE_MAX_ENTRIES = "SEARCH_CACHE_MAX_ENTRIES"
+ENV_SEARCH_CACHE_DIR = "SEARCH_CACHE_DIR"
+ENV_CONVERT_WORKERS = "CONVERT_WORKERS"
+ENV_RESULT_TOKEN_BUDGET = "RESULT_TOKEN_BUDGET"
+ENV_SEARCH_URL = "SEARCH_URL"
+ENV_RECORD_FIXTURES_DIR = "RECORD_FIXTURES_DIR"
+ENV_CONVERT_WARMUP = "CONVERT_WARMUP"
+
+# Constants
+DEFAULT_SEARCH_URL = "https://customsearch.googleapis.com/customsearch/v1"
+# sent as a header rather than the "key" parameter so it stays out of traced urls
+SEARCH_HEADER_KEY = "X-goog-api-key"
+SEARCH_PARAM_CX = "cx"
+SEARCH_PARAM_QUERY = "q"
+
+# Headers
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'}
+
+# Setup Logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# setup MCP server
+mcp_port = 8080
+if ENV_MCP_PORT in os.environ:
+    mcp_port = int(os.environ[ENV_MCP_PORT])
+logger.info("MCP Port: %s", mcp_port)
+
+# Retrieve config
+if ENV_GCP_API_KEY not in os.environ:
+    msg = "'GCP_API_KEY' is required and has not been set!"
+    logger.fatal(msg)
+    raise ValueError(msg)
+gcp_api_key = os.environ[ENV_GCP_API_KEY]
+if ENV_GOOGLE_CX not in os.environ:
+    msg = "'GOOGLE_CX' is required and has not been set!"
+    logger.fatal(msg)
+    raise ValueError(msg)
+google_cx = os.environ[ENV_GOOGLE_CX]
+
+# The search API can be pointed at stub_server.py to replay recorded fixtures
+search_url = os.environ.get(ENV_SEARCH_URL, DEFAULT_SEARCH_URL)
+logger.info("Search URL: %s", search_url)
+
+# When set, every search response and forum page is saved for later replay
+record_fixtures_dir = os.environ.get(ENV_RECORD_FIXTURES_DIR)
+if record_fixtures_dir:
+    logger.info("Recording fixtures to: %s", record_fixtures_dir)
+
+# Forum page retrieval: how many of the top results to download, and how long
+# the whole download and conversion may take before the tool answers anyway
+fetch_top_n = int(os.environ.get(ENV_FETCH_TOP_N, "3"))
+fetch_budget_seconds = float(os.environ.get(ENV_FETCH_BUDGET_SECONDS, "10"))
+logger.info("Fetching top %s results within %ss", fetch_top_n, fetch_budget_seconds)
+
+# Approximate number of tokens of forum content returned per tool call
+result_token_budget = int(os.environ.get(ENV_RESULT_TOKEN_BUDGET, "1500"))
+logger.info("Result Token Budget: %s", result_token_budget)
+
+# Converted forum pages, by url
+page_cache = TTLCache(
+    max_entries=int(os.environ.get(ENV_PAGE_CACHE_MAX_ENTRIES, "256")),
+    ttl_seconds=float(os.environ.get(ENV_PAGE_CACHE_TTL_SECONDS, "3600")),
+)
+
+# Search API responses, by normalized query.  Optionally kept on disk so the
+# cache (and the API quota it saves) survives restarts.
+search_cache = TTLCache(
+    max_entries=int(os.environ.get(ENV_SEARCH_CACHE_MAX_ENTRIES, "1024")),
+    ttl_seconds=float(os.environ.get(ENV_SEARCH_CACHE_TTL_SECONDS, "86400")),
+    persist_dir=os.environ.get(ENV_SEARCH_CACHE_DIR),
+)
+
+# Pooled async HTTP connections for the search API and the forum, created on
+# first use since they belong to the event loop that opened them
+http_client = None
+http_client_loop = None
+
+# docling's HTML conversion is CPU bound, so it runs in a bounded pool of
+# worker processes instead of on the event loop, created by main().  Spawned
+# rather than forked so the workers don't inherit the event loop's threads.
+convert_workers = int(os.environ.get(ENV_CONVERT_WORKERS, str(os.cpu_count() or 1)))
+convert_executor = None
+logger.info("Conversion Workers: %s", convert_workers)
+
+# How long a warmed up worker waits for the others before giving up
+WARM_UP_TIMEOUT_SECONDS = 300
+
+# Optionally load docling in every conversion worker in the background at
+# startup, so the first searches don't pay for it.  Until the warm-up is done
+# the server is live (/health) but not ready (/ready).
+convert_warmup = os.environ.get(ENV_CONVERT_WARMUP, "true").lower() == "true"
+logger.info("Conversion Warm-up: %s", convert_warmup)
+startup_stats = {"initialized_seconds": None, "ready_seconds": None, "warmup_seconds": None}
+
+# Background conversions that outlived a tool call's budget
+background_tasks = set()
+
+# Time spent converting pages in the process pool, not counting time queued
+conversion_stats = {"count": 0, "seconds": 0.0, "max_seconds": 0.0}
+
+# Start MCP Server
+mcp = FastMCP(name="Corvette Forum MCP Server")
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """ Returns the pooled HTTP client for the running event loop. """
+    global http_client, http_client_loop    # pylint: disable=global-statement
+    loop = asyncio.get_running_loop()
+    if http_client is None or http_client_loop is not loop:
+        http_client = httpx.AsyncClient(
+            timeout=fetch_budget_seconds,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+        )
+        http_client_loop = loop
+    return http_client
+
+
+def normalize_query(query: str) -> str:
+    """ Canonical form of a query, so trivially different queries share a cache entry. """
+    return " ".join(query.lower().split())
+
+
+async def search_forum(query: str) -> dict:
+    """ Calls the Google Custom Search API.
+
+    :param query: Search Query
+    :returns: Search API response
+    """
+    logger.info("Calling search API.  Query=%s", query)
+
+    # build url
+    query_parameters = {
+        SEARCH_PARAM_CX: google_cx,
+        SEARCH_PARAM_QUERY: query,
+    }
+    url = search_url + "?" + urllib.parse.urlencode(query_parameters)
+
+    # make get request
+    response = await get_http_client().get(url, headers={SEARCH_HEADER_KEY: gcp_api_key})
+    if response.status_code != 200:
+        msg = f"Unable to perform search.  HTTP Status Code = {response.status_code}"
+        logger.error(msg)
+        raise ValueError(msg)
+
+    # process results
+    search_results = response.json()
+    pretty_json = json.dumps(search_results, indent=4)
+    logger.debug("Search Results for query (%s) == %s", query, pretty_json)
+
+    if record_fixtures_dir:
+        record_search(record_fixtures_dir, query, search_results)
+    return search_results
+
+
+async def fetch_page_markdown(url: str) -> str:
+    """ Downloads a forum page and converts it to markdown, reusing the cached
+        conversion when the page was fetched recently.
+
+    :param url: Forum page url
+    :returns: Page contents as markdown
+    """
+    return await page_cache.get_or_load_async(url, lambda: convert_page(url))
+
+
+async def convert_page(url: str) -> str:
+    """ Downloads a forum page and converts it to markdown.
+
+    :param url: Forum page url
+    :returns: Page contents as markdown
+    """
+    # download page content
+    logger.info("Download forum content for url: %s", url)
+    response = await get_http_client().get(url, headers=HEADERS)
+    response.raise_for_status()
+    if record_fixtures_dir:
+        record_page(record_fixtures_dir, url, response.content)
+
+    # convert html to markdown
+    logger.info("Converting page contents to markdown.  url=%s", url)
+    loop = asyncio.get_running_loop()
+    markdown, elapsed = await loop.run_in_executor(convert_executor, forum_convert.timed_html_to_markdown,
+                                                   response.content)
+    conversion_stats["count"] += 1
+    conversion_stats["seconds"] += elapsed
+    conversion_stats["max_seconds"] = max(conversion_stats["max_seconds"], elapsed)
+    return markdown
+
+
+@mcp.tool(
+    annotations={
+        "title": "Search Corvette Forum's C3 Corvette Tech Support Website",
+        "readOnlyHint": True,
+        "openWorldHint": True,
+    }
+)
+async def search_c3_tech_support(query: str, ctx: Context) -> list[dict]:
+    """ Search's Corvette Forum's online community for C3 performance and tech support.
+
+    :param query: Search Query
+    :returns: Search results, with the forum content of the top results
+    """
+    with tracer.start_as_current_span("search_c3_tech_support", context=caller_context(ctx)) as span:
+        span.set_attribute("forum.query", query)
+        matching_content = await search_and_extract(query)
+        span.set_attribute("forum.results", len(matching_content))
+        span.set_attribute("forum.pages_extracted", sum(1 for c in matching_content if "content" in c))
+        return matching_content
+
+
+async def search_and_extract(query: str) -> list[dict]:
+    """ Searches the forum and extracts the relevant content of the top results.
+
+    :param query: Search Query
+    :returns: Search results, with the forum content of the top results
+    """
+    logger.info ("Searching C3 Tech Support.  Query=%s", query)
+
+    # validate parameters
+    if query is None or len(query) == 0:
+        msg = "Query is required but is empty!"
+        logger.error(msg)
+        raise ValueError(msg)
+
+    # search, sharing the results of identical queries (including ones that
+    # are still in progress for another session)
+    normalized_query = normalize_query(query)
+    search_results = await search_cache.get_or_load_async(normalized_query,
+                                                          lambda: search_forum(normalized_query))
+
+    # extract meaningful content
+    matching_content = []
+    for item in search_results.get("items", []):
+        link = item["link"]
+        snippet = item["snippet"]
+
+        content = {"link": link,
+                   "snippet": snippet}
+
+        matching_content.append(content)
+    logger.info("# of Matches Found for Query:  Count=%s. Query=%s", len(matching_content), query)
+    logger.debug("Matching Content:  Count=%s  Items=%s", len(matching_content), matching_content)
+
+    # download and convert the top results concurrently.  Pages that are not
+    # ready when the budget runs out are left out of this response, but keep
+    # converting in the background so they are cached for the next call.
+    tasks = {
+        asyncio.create_task(fetch_page_markdown(content["link"])): content
+        for content in matching_content[:fetch_top_n]
+    }
+    pages = {}
+    if tasks:
+        done, not_done = await asyncio.wait(tasks, timeout=fetch_budget_seconds)
+        for task in done:
+            content = tasks[task]
+            try:
+                pages[content["link"]] = task.result()
+            except Exception as e:
+                logger.warning("Unable to retrieve forum content.  url=%s error=%s", content["link"], e)
+        for task in not_done:
+            logger.warning("Forum content not ready within %ss.  url=%s",
+                           fetch_budget_seconds, tasks[task]["link"])
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+
+    # whole threads would swamp the model's context, so only return the
+    # sections most relevant to the query
+    extracted = select_sections(query, pages, result_token_budget)
+    for content in matching_content:
+        if content["link"] in extracted:
+            content["content"] = extracted[content["link"]]
+    logger.info("Extracted relevant content from %s of %s pages.  Chars=%s",
+                len(extracted), len(pages), sum(len(c) for c in extracted.values()))
+
+    return matching_content
+
+
+def create_convert_executor() -> ProcessPoolExecutor:
+    """ The conversion process pool.  Its workers share a barrier so that the
+        start-up warm-up reaches every one of them.
+    """
+    context = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(max_workers=convert_workers, mp_context=context,
+                               initializer=forum_convert.init_worker,
+                               initargs=(context.Barrier(convert_workers),))
+
+
+def start_warm_up():
+    """ Submits a warm-up to each conversion worker, marking the server ready
+        once they have all finished.
+    """
+    startup_stats["initialized_seconds"] = time.monotonic() - process_start
+    logger.info("Initialized in %.2fs", startup_stats["initialized_seconds"])
+    if not convert_warmup:
+        mark_ready()
+        return
+
+    # a warmed up worker waits for the others, so each worker takes one warm-up
+    futures = [convert_executor.submit(forum_convert.warm_up_worker, WARM_UP_TIMEOUT_SECONDS)
+               for _ in range(convert_workers)]
+
+    def wait_for_warm_up():
+        for future in futures:
+            try:
+                seconds = future.result()
+                startup_stats["warmup_seconds"] = max(startup_stats["warmup_seconds"] or 0.0, seconds)
+            except Exception as e:
+                # not fatal: search still works, and conversions report their own errors
+                logger.error("Conversion warm-up failed.  error=%s", e)
+        mark_ready()
+
+    threading.Thread(target=wait_for_warm_up, name="warm-up", daemon=True).start()
+
+
+def mark_ready():
+    """ Records and reports the time from process start until ready. """
+    startup_stats["ready_seconds"] = time.monotonic() - process_start
+    logger.info("Ready in %.2fs.  Conversion warm-up=%s",
+                startup_stats["ready_seconds"],
+                "skipped" if startup_stats["warmup_seconds"] is None else f"{startup_stats['warmup_seconds']:.2f}s")
+
+
+async def health_check(request):
+    """ Liveness endpoint for the MCP Server, answered as soon as it is serving. """
+    return JSONResponse({"status": "ok"})
+
+
+async def readiness_check(request):
+    """ Readiness endpoint, failing until the conversion workers are warmed up. """
+    if startup_stats["ready_seconds"] is None:
+        return JSONResponse({"status": "warming up", **startup_stats}, status_code=503)
+    return JSONResponse({"status": "ready", **startup_stats})
+
+
+async def cache_stats(request):
+    """ Cache hit ratios, upstream call counts and conversion times. """
+    return JSONResponse({
+        "search_cache": search_cache.stats(),
+        "page_cache": page_cache.stats(),
+        "conversions": conversion_stats,
+        "startup": startup_stats,
+    })
+
+
+sse_app = mcp.sse_app()
+sse_app.add_route("/health", health_check)
+sse_app.add_route("/ready", readiness_check)
+sse_app.add_route("/stats", cache_stats)
+
+
+def main():
+    """ Runs the MCP server. """
+    global convert_executor     # pylint: disable=global-statement
+    port = 8080
+    if ENV_MCP_PORT in os.environ:
+        port = int(os.environ[ENV_MCP_PORT])
+    print ("Port: ", port)
+
+    log_level = "info"
+    if ENV_LOG_LEVEL in os.environ:
+        log_level = os.environ[ENV_LOG_LEVEL]
+    print ("Log Level: ", log_level)
+
+    setup_tracing("corvetteforum-mcp")
+    convert_executor = create_convert_executor()
+    start_warm_up()
+
+    print ("Starting MCP Server...")
+    uvicorn.run(sse_app, host="0.0.0.0", port=port, log_level=log_level)
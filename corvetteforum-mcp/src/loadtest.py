@@ -0,0 +1,102 @@
+""" MCP Load Test
+
+Opens concurrent MCP client sessions against the forum server and calls
+search_c3_tech_support from each, reporting throughput and latency.  Run it
+at a few CONVERT_WORKERS settings to see throughput scale with the pool.
+
+    python loadtest.py http://localhost:8080/sse --clients 16 --calls 10 --distinct
+"""
+import time
+import asyncio
+import statistics
+import click
+from mcp import ClientSession
+from mcp.client.sse import sse_client
+
+QUERIES = [
+    "lights",
+    "headlight vacuum actuator",
+    "slow engine crank",
+    "cooling system drain and refill",
+    "power brake booster",
+    "wiper door",
+]
+
+
+async def run_client(url: str, client_id: int, calls: int, distinct: bool, latencies: list, errors: list):
+    """ One MCP session making sequential tool calls.  A session that fails
+        counts as an error rather than ending the run.
+    """
+    try:
+        await run_session(url, client_id, calls, distinct, latencies, errors)
+    except Exception as e:     # pylint: disable=broad-except
+        errors.append(f"client {client_id}: {e!r}")
+
+
+async def run_session(url: str, client_id: int, calls: int, distinct: bool, latencies: list, errors: list):
+    async with sse_client(url) as (read_stream, write_stream):
+        async with ClientSession(read_stream, write_stream) as session:
+            await session.initialize()
+            for i in range(calls):
+                query = QUERIES[(client_id + i) % len(QUERIES)]
+                if distinct:
+                    # defeat the server's caches so every call does real work
+                    query = f"{query} {client_id}-{i}"
+                start = time.perf_counter()
+                result = await session.call_tool("search_c3_tech_support", {"query": query})
+                latencies.append(time.perf_counter() - start)
+                if result.isError:
+                    errors.append(query)
+
+
+async def run(url: str, clients: int, calls: int, distinct: bool) -> dict:
+    """ Runs the load test and returns its throughput and latency summary. """
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        run_client(url, client_id, calls, distinct, latencies, errors)
+        for client_id in range(clients)
+    ])
+    elapsed = time.perf_counter() - start
+
+    return {
+        "clients": clients,
+        "calls": len(latencies),
+        "errors": len(errors),
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+
+
+def percentile(values: list[float], p: int) -> float:
+    """ p-th percentile, or NaN when there are no values. """
+    if not values:
+        return float("nan")
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100)[p - 1]
+
+
+def print_summary(summary: dict):
+    """ Prints a run() summary. """
+    print(f"Clients: {summary['clients']}  Calls: {summary['calls']}  Errors: {summary['errors']}")
+    print(f"Throughput: {summary['throughput']:.2f} calls/s over {summary['elapsed']:.1f}s")
+    print(f"Latency p50={summary['p50']:.2f}s p95={summary['p95']:.2f}s p99={summary['p99']:.2f}s")
+
+
+@click.command()
+@click.argument('url')
+@click.option('--clients', default=8, help="Concurrent MCP sessions")
+@click.option('--calls', default=5, help="Tool calls per session")
+@click.option('--distinct', is_flag=True, help="Make every query unique to bypass the caches")
+def cli(url: str, clients: int, calls: int, distinct: bool):
+    """ Load tests the MCP server's SSE endpoint at URL. """
+    print_summary(asyncio.run(run(url, clients, calls, distinct)))
+
+
+if __name__ == '__main__':
+    cli()
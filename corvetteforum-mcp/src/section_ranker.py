@@ -0,0 +1,123 @@
+""" Query relevant section extraction for converted forum pages.
+
+Forum threads are far longer than the part that answers a question, so pages
+are split into sections (posts, or paragraphs of very long posts), scored
+against the query with BM25, and only the best sections that fit in a token
+budget are returned to the model.
+"""
+import re
+import math
+from collections import Counter
+
+# BM25 tuning
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Sections longer than this are split on paragraph boundaries
+MAX_SECTION_CHARS = 2000
+
+# Rough characters per token for English text
+CHARS_PER_TOKEN = 4
+
+HEADER_PATTERN = re.compile(r"^#{1,6}\s", re.MULTILINE)
+TERM_PATTERN = re.compile(r"[a-z0-9]+")
+STOP_WORDS = frozenset("""
+    a an and are as at be but by for from has have how i if in is it my of on
+    or so that the this to was what when where which who why will with you
+""".split())
+
+
+def estimate_tokens(text: str) -> int:
+    """ Approximate token count, good enough for budgeting. """
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def tokenize(text: str) -> list[str]:
+    """ Lower cased terms without stop words. """
+    return [t for t in TERM_PATTERN.findall(text.lower()) if t not in STOP_WORDS]
+
+
+def split_sections(markdown: str) -> list[str]:
+    """ Splits markdown on headers, then splits long sections on paragraphs. """
+    sections = []
+    starts = [m.start() for m in HEADER_PATTERN.finditer(markdown)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    for start, end in zip(starts, starts[1:] + [len(markdown)]):
+        section = markdown[start:end].strip()
+        if not section:
+            continue
+        if len(section) <= MAX_SECTION_CHARS:
+            sections.append(section)
+            continue
+
+        # pack paragraphs into chunks no longer than MAX_SECTION_CHARS
+        chunk = ""
+        for paragraph in section.split("\n\n"):
+            if chunk and len(chunk) + len(paragraph) > MAX_SECTION_CHARS:
+                sections.append(chunk.strip())
+                chunk = ""
+            chunk += paragraph + "\n\n"
+        if chunk.strip():
+            sections.append(chunk.strip())
+    return sections
+
+
+def bm25_scores(query: str, sections: list[str]) -> list[float]:
+    """ BM25 score of each section for the query. """
+    query_terms = set(tokenize(query))
+    documents = [tokenize(section) for section in sections]
+    if not query_terms or not documents:
+        return [0.0] * len(sections)
+
+    average_length = sum(len(d) for d in documents) / len(documents) or 1
+    document_frequency = Counter(t for d in documents for t in set(d) if t in query_terms)
+
+    scores = []
+    for document in documents:
+        term_counts = Counter(document)
+        score = 0.0
+        for term in query_terms:
+            tf = term_counts.get(term, 0)
+            if not tf:
+                continue
+            n = document_frequency[term]
+            idf = math.log(1 + (len(documents) - n + 0.5) / (n + 0.5))
+            norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * len(document) / average_length)
+            score += idf * tf * (BM25_K1 + 1) / norm
+        scores.append(score)
+    return scores
+
+
+def select_sections(query: str, pages: dict[str, str], token_budget: int) -> dict[str, str]:
+    """ Picks the most relevant sections across all pages within the budget.
+
+    :param query: Search query the sections should answer
+    :param pages: Markdown of each page, by url
+    :param token_budget: Approximate number of tokens to return in total
+    :returns: Extracted content of each page that had a relevant section, by url,
+              with the sections kept in their original page order
+    """
+    candidates = [
+        (url, position, section)
+        for url, markdown in pages.items()
+        for position, section in enumerate(split_sections(markdown))
+    ]
+    scores = bm25_scores(query, [section for _, _, section in candidates])
+
+    selected = []
+    remaining = token_budget
+    ranked = sorted(zip(scores, candidates), key=lambda s: -s[0])
+    for score, (url, position, section) in ranked:
+        if score <= 0:
+            break
+        tokens = estimate_tokens(section)
+        if tokens > remaining:
+            continue
+        selected.append((url, position, section))
+        remaining -= tokens
+
+    extracted = {}
+    for url, _, section in sorted(selected, key=lambda s: (s[0], s[1])):
+        extracted[url] = extracted[url] + "\n\n" + section if url in extracted else section
+    return extracted
@@ -0,0 +1,87 @@
+""" Replay Stub Server
+
+Serves fixtures recorded with RECORD_FIXTURES_DIR as a local stand-in for the
+Google Custom Search API and the forum, so the MCP server can be run and
+benchmarked without network access or API keys.  Point the MCP server at it
+with SEARCH_URL=http://localhost:9090/customsearch/v1.
+
+    python stub_server.py ../fixtures --port 9090 --page-latency-ms 300
+"""
+import os
+import json
+import glob
+import asyncio
+import logging
+import itertools
+import click
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from fixtures import fixture_key, search_fixture_path
+
+logger = logging.getLogger(__name__)
+
+
+def create_app(fixtures_dir: str, search_latency: float, page_latency: float, fallback: bool) -> Starlette:
+    """ Builds the stub application for a fixtures directory. """
+    recorded_searches = sorted(glob.glob(os.path.join(fixtures_dir, "search", "*.json")))
+    if not recorded_searches:
+        raise click.ClickException(f"No recorded searches found in {fixtures_dir}")
+    logger.info("Loaded %s recorded searches", len(recorded_searches))
+    fallback_searches = itertools.cycle(recorded_searches)
+
+    def load_search(query: str):
+        path = search_fixture_path(fixtures_dir, " ".join(query.lower().split()))
+        if not os.path.exists(path):
+            if not fallback:
+                return None
+            # unknown queries (i.e. from a benchmark defeating the caches) get
+            # one of the recorded responses
+            path = next(fallback_searches)
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)["response"]
+
+    async def search(request: Request):
+        await asyncio.sleep(search_latency)
+        response = load_search(request.query_params.get("q", ""))
+        if response is None:
+            return JSONResponse({"error": {"code": 404, "message": "No recorded search"}}, status_code=404)
+
+        # send the forum links back to this server
+        base_url = str(request.base_url).rstrip("/")
+        for item in response.get("items", []):
+            item["link"] = f"{base_url}/pages/{fixture_key(item['link'])}"
+        return JSONResponse(response)
+
+    async def page(request: Request):
+        await asyncio.sleep(page_latency)
+        path = os.path.join(fixtures_dir, "pages", request.path_params["key"] + ".html")
+        if not os.path.exists(path):
+            return Response("Not recorded", status_code=404)
+        with open(path, "rb") as f:
+            return Response(f.read(), media_type="text/html")
+
+    return Starlette(routes=[
+        Route("/customsearch/v1", search),
+        Route("/pages/{key}", page),
+    ])
+
+
+@click.command()
+@click.argument('fixtures_dir')
+@click.option('--port', default=9090, help="Port to listen on")
+@click.option('--search-latency-ms', default=0, help="Delay added to every search")
+@click.option('--page-latency-ms', default=0, help="Delay added to every forum page")
+@click.option('--fallback/--no-fallback', default=True,
+              help="Answer unrecorded queries with a recorded search")
+def cli(fixtures_dir: str, port: int, search_latency_ms: int, page_latency_ms: int, fallback: bool):
+    """ Serves the recorded fixtures in FIXTURES_DIR. """
+    logging.basicConfig(level=logging.INFO)
+    app = create_app(fixtures_dir, search_latency_ms / 1000, page_latency_ms / 1000, fallback)
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+if __name__ == '__main__':
+    cli()
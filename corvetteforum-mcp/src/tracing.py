@@ -0,0 +1,59 @@
+""" OpenTelemetry tracing for the MCP server.
+
+Spans go to the OTLP endpoint in OTEL_EXPORTER_OTLP_ENDPOINT, or are appended
+as JSON lines to TRACE_FILE, and tracing is a no-op when neither is set.  Tool
+calls join the caller's trace through the traceparent header of the MCP
+message request, and the httpx client is instrumented so search API and forum
+downloads show up as child spans.
+"""
+import os
+import logging
+from opentelemetry import trace, propagate
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+from opentelemetry.instrumentation.httpx import HTTPXClientInstrumentor
+
+ENV_OTLP_ENDPOINT = "OTEL_EXPORTER_OTLP_ENDPOINT"
+ENV_TRACE_FILE = "TRACE_FILE"
+
+logger = logging.getLogger(__name__)
+
+tracer = trace.get_tracer("corvetteforum-mcp")
+
+
+def setup_tracing(service_name: str):
+    """ Configures span export for the process. """
+    if ENV_OTLP_ENDPOINT in os.environ:
+        # pylint: disable=import-outside-toplevel
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter()
+        logger.info("Exporting traces to %s", os.environ[ENV_OTLP_ENDPOINT])
+    elif ENV_TRACE_FILE in os.environ:
+        trace_file = open(os.environ[ENV_TRACE_FILE], "a", encoding="utf-8")   # pylint: disable=consider-using-with
+        exporter = ConsoleSpanExporter(out=trace_file,
+                                       formatter=lambda span: span.to_json(indent=None) + "\n")
+        logger.info("Writing traces to %s", os.environ[ENV_TRACE_FILE])
+    else:
+        logger.info("Tracing disabled.  Set %s or %s to enable.", ENV_OTLP_ENDPOINT, ENV_TRACE_FILE)
+        return
+
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    HTTPXClientInstrumentor().instrument()
+
+
+def caller_context(ctx):
+    """ Trace context propagated by the client in the headers of the MCP
+        request being handled, or None when there isn't one.
+
+    :param ctx: FastMCP request context
+    """
+    try:
+        request = ctx.request_context.request
+    except ValueError:
+        return None
+    if request is None or not hasattr(request, "headers"):
+        return None
+    return propagate.extract(dict(request.headers))
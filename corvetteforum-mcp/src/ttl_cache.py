@@ -0,0 +1,239 @@
+""" Thread safe in-memory cache with LRU eviction and per entry expiry. """
+import os
+import json
+import asyncio
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+# result handed to followers of a cancelled load, telling them to retry
+_LEADER_CANCELLED = object()
+
+
+class TTLCache:
+    """ Bounded LRU cache whose entries expire ttl_seconds after being stored.
+
+        When persist_dir is set, entries (which must be JSON serializable) are
+        also written to disk so they survive a restart of the server.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, persist_dir: str = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persist_dir = persist_dir
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._next_prune = 0.0
+
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.coalesced = 0
+
+        if persist_dir:
+            os.makedirs(persist_dir, exist_ok=True)
+
+    def get(self, key):
+        """ Returns the cached value, or None when missing or expired. """
+        with self._lock:
+            value = self._lookup(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """ Stores the value, evicting the least recently used entries when full. """
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        with self._lock:
+            self._store(key, expires_at, value)
+            prune = self.persist_dir and now >= self._next_prune
+            if prune:
+                self._next_prune = expires_at
+        if self.persist_dir:
+            try:
+                with open(self._persist_path(key), "w", encoding="utf-8") as f:
+                    json.dump({"expires_at": expires_at, "value": value}, f)
+            except (OSError, TypeError) as e:
+                logger.warning("Unable to persist cache entry.  key=%s error=%s", key, e)
+        if prune:
+            self._prune_persisted()
+
+    def get_or_load(self, key, loader):
+        """ Returns the cached value, calling loader() to produce it on a miss.
+
+            Concurrent callers missing on the same key share a single call to
+            loader() rather than each making their own.
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            self.misses += 1
+
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            value = loader()
+            self.loads += 1
+            self.put(key, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    async def get_or_load_async(self, key, loader):
+        """ Async form of get_or_load(), where loader is a coroutine function.
+
+            Followers wait on the leader's result without blocking the event loop.
+            When the leader is cancelled (its caller went away), one of the
+            followers takes over the load rather than all of them failing.
+        """
+        counted = False
+        while True:
+            with self._lock:
+                value = self._lookup(key)
+                if value is not None:
+                    if not counted:
+                        self.hits += 1
+                    return value
+                if not counted:
+                    self.misses += 1
+                    counted = True
+
+                future = self._in_flight.get(key)
+                leader = future is None
+                if leader:
+                    future = self._in_flight[key] = Future()
+                else:
+                    self.coalesced += 1
+            if leader:
+                return await self._lead_async(key, loader, future)
+            # shielded, so a follower's own cancellation leaves the shared future alone
+            value = await asyncio.shield(asyncio.wrap_future(future))
+            if value is not _LEADER_CANCELLED:
+                return value
+
+    async def _lead_async(self, key, loader, future: Future):
+        """ Runs the loader for get_or_load_async() and hands its outcome to the followers. """
+        try:
+            value = await loader()
+        except Exception as e:
+            self._end_load(key, future)
+            future.set_exception(e)
+            raise
+        except BaseException:
+            # not the loader's failure, so the followers retry instead
+            self._end_load(key, future)
+            future.set_result(_LEADER_CANCELLED)
+            raise
+        self.loads += 1
+        self.put(key, value)
+        self._end_load(key, future)
+        future.set_result(value)
+        return value
+
+    def _end_load(self, key, future: Future):
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def stats(self) -> dict:
+        """ Hit ratio and upstream load counts for monitoring. """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "loads": self.loads,
+                "coalesced": self.coalesced,
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _lookup(self, key):
+        """ Finds a live entry in memory, then on disk.  Caller holds the lock. """
+        entry = self._entries.get(key)
+        persisted = entry is None and self.persist_dir
+        if persisted:
+            entry = self._load_persisted(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            self._entries.pop(key, None)
+            if self.persist_dir:
+                self._remove_persisted(key)
+            return None
+        if persisted:
+            self._store(key, expires_at, value)
+        else:
+            self._entries.move_to_end(key)
+        return value
+
+    def _store(self, key, expires_at, value):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _persist_path(self, key) -> str:
+        digest = hashlib.sha256(str(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.persist_dir, digest + ".json")
+
+    def _load_persisted(self, key):
+        try:
+            with open(self._persist_path(key), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            return entry["expires_at"], entry["value"]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Ignoring unreadable cache entry.  key=%s error=%s", key, e)
+            return None
+
+    def _remove_persisted(self, key):
+        try:
+            os.remove(self._persist_path(key))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("Unable to remove cache entry.  key=%s error=%s", key, e)
+
+    def _prune_persisted(self):
+        """ Deletes persisted entries that have expired, at most once per ttl_seconds,
+            so entries that are never looked up again do not accumulate on disk.
+        """
+        expired_before = time.time() - self.ttl_seconds
+        try:
+            with os.scandir(self.persist_dir) as files:
+                for file in files:
+                    # an entry expires ttl_seconds after it was written
+                    if file.name.endswith(".json") and file.stat().st_mtime < expired_before:
+                        os.remove(file.path)
+        except OSError as e:
+            logger.warning("Unable to prune cache entries.  dir=%s error=%s", self.persist_dir, e)
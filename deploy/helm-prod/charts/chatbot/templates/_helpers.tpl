@@ -60,3 +60,11 @@ Create the name of the service account to use
 {{- default "default" .Values.serviceAccount.name }}
 {{- end }}
 {{- end }}
+
+{{/*
+Selector labels of the permitting API, distinct from the chatbot's
+*/}}
+{{- define "mechanic.permitApiSelectorLabels" -}}
+app.kubernetes.io/name: {{ include "mechanic.name" . }}-permit-api
+app.kubernetes.io/instance: {{ .Release.Name }}
+{{- end }}
@@ -0,0 +1,232 @@
+""" Local Embedding Server
+
+CPU stand-in for LLama Stack's embedding endpoints.  Concurrent requests are
+micro-batched together before being sent through the SentenceTransformer model
+so that ingest and retrieval can be benchmarked and run offline.
+"""
+import os
+import time
+import asyncio
+import logging
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from prometheus_client import Gauge, Histogram, Counter, generate_latest, CONTENT_TYPE_LATEST
+
+# configurable parameters
+ENV_EMBEDDING_PORT = "EMBEDDING_PORT"
+ENV_EMBEDDING_MODEL = "EMBEDDING_MODEL"
+ENV_EMBEDDING_MODEL_ID = "EMBEDDING_MODEL_ID"
+ENV_EMBEDDING_BACKEND = "EMBEDDING_BACKEND"
+ENV_MAX_BATCH_SIZE = "MAX_BATCH_SIZE"
+ENV_MAX_WAIT_MS = "MAX_WAIT_MS"
+ENV_LOG_LEVEL = "LOG_LEVEL"
+
+# Setup Logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Retrieve config
+port = int(os.environ.get(ENV_EMBEDDING_PORT, "8080"))
+model_name = os.environ.get(ENV_EMBEDDING_MODEL, "sentence-transformers/all-MiniLM-L6-v2")
+model_id = os.environ.get(ENV_EMBEDDING_MODEL_ID, model_name.split("/")[-1])
+backend = os.environ.get(ENV_EMBEDDING_BACKEND, "torch")
+max_batch_size = int(os.environ.get(ENV_MAX_BATCH_SIZE, "64"))
+max_wait_seconds = int(os.environ.get(ENV_MAX_WAIT_MS, "5")) / 1000
+logger.info("Embedding Model: %s (served as %s). Backend: %s", model_name, model_id, backend)
+logger.info("Max Batch Size: %s. Max Wait: %ss", max_batch_size, max_wait_seconds)
+
+# Metrics
+QUEUE_DEPTH = Gauge("embedding_queue_depth", "Texts waiting to be embedded")
+BATCH_SIZE = Histogram("embedding_batch_size", "Texts per model batch",
+                       buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+BATCH_LATENCY = Histogram("embedding_batch_seconds", "Model time per batch")
+REQUEST_LATENCY = Histogram("embedding_request_seconds", "End to end request latency",
+                            ["endpoint"])
+TEXTS_EMBEDDED = Counter("embedding_texts_total", "Texts embedded")
+
+
+class MicroBatcher:
+    """ Collects texts from concurrent requests into model sized batches.
+
+        A batch is run as soon as it is full, or when the oldest waiting text
+        has waited max_wait_seconds.
+    """
+
+    def __init__(self, model, batch_size: int, max_wait: float):
+        self.model = model
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.queue = None
+        # The model is only ever called from this one thread
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed")
+
+    def start(self):
+        """ Starts the batching loop on the running event loop. """
+        self.queue = asyncio.Queue()
+        asyncio.get_running_loop().create_task(self._run())
+
+    async def embed(self, texts: list[str]) -> tuple[list[list[float]], int]:
+        """ Embeds the texts, sharing model batches with other requests.
+
+            Returns the embeddings and the number of tokens in the texts.
+        """
+        loop = asyncio.get_running_loop()
+        futures = []
+        for text in texts:
+            future = loop.create_future()
+            self.queue.put_nowait((text, future))
+            futures.append(future)
+        QUEUE_DEPTH.set(self.queue.qsize())
+        results = await asyncio.gather(*futures)
+        return [embedding for embedding, _ in results], sum(tokens for _, tokens in results)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            QUEUE_DEPTH.set(self.queue.qsize())
+            BATCH_SIZE.observe(len(batch))
+
+            texts = [text for text, _ in batch]
+            start = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(self.executor, self._encode, texts)
+            except Exception as e:
+                logger.exception("Unable to embed batch of %s texts", len(texts))
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            BATCH_LATENCY.observe(time.perf_counter() - start)
+            TEXTS_EMBEDDED.inc(len(texts))
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def _encode(self, texts: list[str]) -> list[tuple[list[float], int]]:
+        # tokens are counted here too: the tokenizer is not thread safe, so
+        # it is only used from the model's thread
+        embeddings = self.model.encode(texts, batch_size=len(texts), normalize_embeddings=True).tolist()
+        return [(embedding, len(self.model.tokenizer.tokenize(text))) for embedding, text in zip(embeddings, texts)]
+
+
+def load_model():
+    """ Loads the embedding model with the configured backend (torch or onnx). """
+    # pylint: disable=import-outside-toplevel
+    from sentence_transformers import SentenceTransformer
+
+    logger.info("Loading embedding model...")
+    model = SentenceTransformer(model_name, backend=backend, device="cpu")
+    logger.info("Model loaded.  Dimension=%s", model.get_sentence_embedding_dimension())
+    return model
+
+
+def content_to_text(content) -> str:
+    """ Flattens LLama Stack interleaved content into plain text. """
+    if isinstance(content, str):
+        return content
+    if isinstance(content, dict):
+        return content.get("text", "")
+    return " ".join(content_to_text(c) for c in content)
+
+
+async def inference_embeddings(request: Request):
+    """ LLama Stack /v1/inference/embeddings """
+    start = time.perf_counter()
+    body = await request.json()
+    if body.get("model_id", model_id) != model_id:
+        return JSONResponse({"detail": f"Model '{body['model_id']}' not found"}, status_code=404)
+
+    texts = [content_to_text(c) for c in body.get("contents", [])]
+    embeddings, _ = await batcher.embed(texts)
+    REQUEST_LATENCY.labels("inference").observe(time.perf_counter() - start)
+    return JSONResponse({"embeddings": embeddings})
+
+
+async def openai_embeddings(request: Request):
+    """ OpenAI compatible /v1/openai/v1/embeddings """
+    start = time.perf_counter()
+    body = await request.json()
+    if body.get("model", model_id) != model_id:
+        return JSONResponse({"error": {"message": f"Model '{body['model']}' not found"}}, status_code=404)
+
+    texts = body.get("input", [])
+    if isinstance(texts, str):
+        texts = [texts]
+    embeddings, token_count = await batcher.embed(texts)
+    REQUEST_LATENCY.labels("openai").observe(time.perf_counter() - start)
+    return JSONResponse({
+        "object": "list",
+        "model": model_id,
+        "data": [
+            {"object": "embedding", "index": i, "embedding": embedding}
+            for i, embedding in enumerate(embeddings)
+        ],
+        "usage": {"prompt_tokens": token_count, "total_tokens": token_count},
+    })
+
+
+async def list_models(request: Request):
+    """ LLama Stack /v1/models, listing just the served embedding model. """
+    return JSONResponse({"data": [{
+        "identifier": model_id,
+        "provider_resource_id": model_id,
+        "provider_id": "local-embedding-server",
+        "type": "model",
+        "model_type": "embedding",
+        "metadata": {"embedding_dimension": model.get_sentence_embedding_dimension()},
+    }]})
+
+
+async def health_check(request: Request):
+    """ Health check endpoint for the Embedding Server. """
+    return JSONResponse({"status": "OK"})
+
+
+async def metrics(request: Request):
+    """ Prometheus metrics. """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """ Runs the micro-batcher for the life of the server. """
+    batcher.start()
+    yield
+
+
+model = load_model()
+batcher = MicroBatcher(model, max_batch_size, max_wait_seconds)
+
+app = Starlette(
+    routes=[
+        Route("/v1/inference/embeddings", inference_embeddings, methods=["POST"]),
+        Route("/v1/openai/v1/embeddings", openai_embeddings, methods=["POST"]),
+        Route("/v1/models", list_models),
+        Route("/v1/health", health_check),
+        Route("/health", health_check),
+        Route("/metrics", metrics),
+    ],
+    lifespan=lifespan,
+)
+
+
+if __name__ == "__main__":
+    log_level = os.environ.get(ENV_LOG_LEVEL, "info")
+    print ("Starting Embedding Server on port", port)
+    uvicorn.run(app, host="0.0.0.0", port=port, log_level=log_level)
@@ -0,0 +1,55 @@
+""" Embedding Benchmark
+
+Drives an embedding endpoint with concurrent single text requests, the way
+query-time retrieval does, and reports throughput and latency percentiles.
+
+    python bench.py http://localhost:8080 --clients 16 --requests 50
+"""
+import time
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+import click
+import requests
+
+SAMPLE_TEXTS = [
+    "What are possible causes for a slow engine crank?",
+    "What are the steps to drain and refill the cooling system?",
+    "What do the identification numbers stamped on the engine block mean?",
+    "What are the water tank requirements for a food truck?",
+    "How far from a public park can a food truck operate?",
+]
+
+
+@click.command()
+@click.argument('base_url')
+@click.option('--model', default="all-MiniLM-L6-v2", help="Embedding model id")
+@click.option('--clients', default=8, help="Concurrent clients")
+@click.option('--requests', 'requests_per_client', default=25, help="Requests per client")
+def cli(base_url: str, model: str, clients: int, requests_per_client: int):
+    """ Benchmarks the embedding endpoint at BASE_URL. """
+    url = base_url.rstrip("/") + "/v1/inference/embeddings"
+
+    def client(client_id: int) -> list[float]:
+        latencies = []
+        with requests.Session() as session:
+            for i in range(requests_per_client):
+                text = SAMPLE_TEXTS[(client_id + i) % len(SAMPLE_TEXTS)]
+                start = time.perf_counter()
+                response = session.post(url, json={"model_id": model, "contents": [text]}, timeout=60)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        latencies = [l for result in executor.map(client, range(clients)) for l in result]
+    elapsed = time.perf_counter() - start
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"Requests: {len(latencies)} in {elapsed:.2f}s ({len(latencies) / elapsed:.1f} req/s)")
+    print(f"Latency p50={quantiles[49] * 1000:.1f}ms p95={quantiles[94] * 1000:.1f}ms "
+          f"p99={quantiles[98] * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    cli()
@@ -102,18 +102,71 @@ def import_test_pdfs(
 
 @dsl.component(
     base_image=PYTHON_BASE_IMAGE,
+    packages_to_install=["pypdf"],
 )
 def create_pdf_splits(
     input_path: dsl.InputPath("input-pdfs"),
     num_splits: int,
+    max_pages_per_split: int = 0,
 ) -> List[List[str]]:
+    import heapq
+    import math
     import pathlib
 
-    # Split our entire directory of pdfs into n batches, where n == num_splits
-    all_pdfs = [path.name for path in pathlib.Path(input_path).glob("*.pdf")]
-    splits = [
-        batch for batch in (all_pdfs[i::num_splits] for i in range(num_splits)) if batch
-    ]
+    from pypdf import PdfReader
+
+    def page_count(path: pathlib.Path) -> int:
+        try:
+            return len(PdfReader(path).pages)
+        except Exception as e:
+            print(f"Unable to read page count of {path.name}: {e}")
+            return 0
+
+    # Work out what each PDF will cost to convert.  Page count tracks docling's
+    # conversion time far better than file size, so size is only used when a
+    # page count can't be read for every file.
+    all_pdfs = sorted(pathlib.Path(input_path).glob("*.pdf"))
+    pages = {path.name: page_count(path) for path in all_pdfs}
+    if all(pages.values()):
+        costs = pages
+    else:
+        costs = {path.name: path.stat().st_size for path in all_pdfs}
+
+    # Cut large PDFs into page ranges ("name.pdf#pages=1-200") so a single
+    # document can be spread across several workers.  By default (0) a PDF is
+    # sharded once it is bigger than a fair share of the total page count, so
+    # a split of one large PDF still fans out to every worker.
+    min_pages_per_shard = 20
+    if max_pages_per_split == 0 and num_splits > 1:
+        max_pages_per_split = max(
+            math.ceil(sum(pages.values()) / num_splits), min_pages_per_shard
+        )
+
+    work_items = []
+    for name, cost in costs.items():
+        num_pages = pages[name]
+        if max_pages_per_split > 0 and num_pages > max_pages_per_split:
+            num_ranges = math.ceil(num_pages / max_pages_per_split)
+            range_size = math.ceil(num_pages / num_ranges)
+            for start in range(1, num_pages + 1, range_size):
+                end = min(start + range_size - 1, num_pages)
+                work_items.append(
+                    (cost * (end - start + 1) / num_pages, f"{name}#pages={start}-{end}")
+                )
+        else:
+            work_items.append((cost, name))
+
+    # Longest-processing-time-first: hand the most expensive remaining item to
+    # the least loaded split
+    splits = [(0, i, []) for i in range(max(num_splits, 1))]
+    for cost, item in sorted(work_items, key=lambda w: (-w[0], w[1])):
+        load, i, batch = heapq.heappop(splits)
+        batch.append(item)
+        heapq.heappush(splits, (load + cost, i, batch))
+
+    for load, i, batch in sorted(splits, key=lambda s: s[1]):
+        print(f"Split {i}: cost={load:.0f} items={batch}")
+    splits = [batch for _, _, batch in sorted(splits, key=lambda s: s[1]) if batch]
     return splits or [[]]
 
 
@@ -130,7 +183,8 @@ def create_pdf_splits(
         "fire",
         "rapidocr-onnxruntime",
         "rapidocr",
-        "onnxruntime"
+        "onnxruntime",
+        "s3fs",
     ],
 )
 def docling_convert(
@@ -141,15 +195,32 @@ def docling_convert(
     max_tokens: int,
     service_url: str,
     vector_db_id: str,
+    embed_batch_size: int = 32,
+    insert_batch_size: int = 128,
+    queue_depth: int = 64,
+    cache_dir: str = "",
+    ocr_mode: str = "auto",
+    generate_page_images: bool = False,
+    min_chars_per_page: int = 200,
 ):
+    import hashlib
+    import importlib.metadata
     import pathlib
+    import queue
+    import resource
+    import threading
+    import time
 
     from docling.datamodel.base_models import InputFormat, ConversionStatus
     from docling.datamodel.pipeline_options import PdfPipelineOptions, RapidOcrOptions
+    from docling.datamodel.settings import DEFAULT_PAGE_RANGE, settings
     from docling.document_converter import DocumentConverter, PdfFormatOption
     from transformers import AutoTokenizer
     from sentence_transformers import SentenceTransformer
     from docling.chunking import HybridChunker
+    from docling_core.types.doc import DoclingDocument
+    import fsspec
+    import pypdfium2
     import logging
     from llama_stack_client import LlamaStackClient
     import uuid
@@ -158,6 +229,9 @@ def docling_convert(
 
     _log = logging.getLogger(__name__)
 
+    # Marks the end of a stage's output stream
+    end_of_stream = object()
+
     # ---- Helper functions ----
     def setup_chunker_and_embedder(embed_model_id: str, max_tokens: int):
         tokenizer = AutoTokenizer.from_pretrained(embed_model_id)
@@ -167,35 +241,251 @@ def docling_convert(
         )
         return embedding_model, chunker
 
-    def embed_text(text: str, embedding_model) -> list[float]:
-        return embedding_model.encode([text], normalize_embeddings=True).tolist()[0]
+    def embed_texts(texts: list[str], embedding_model) -> list[list[float]]:
+        return embedding_model.encode(
+            texts, batch_size=embed_batch_size, normalize_embeddings=True
+        ).tolist()
+
+    def put(q: queue.Queue, item):
+        # Blocks while the downstream stage is behind (backpressure), but keeps
+        # checking for a failure elsewhere so a dead consumer can't hang us
+        while not failed.is_set():
+            try:
+                q.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
 
-    def process_and_insert_embeddings(conv_results):
+    def get(q: queue.Queue):
+        # Treats a failure elsewhere as the end of the stream
+        while not failed.is_set():
+            try:
+                return q.get(timeout=1)
+            except queue.Empty:
+                continue
+        return end_of_stream
+
+    def run_stage(name: str, target):
+        def runner():
+            started = time.monotonic()
+            try:
+                target()
+            except Exception as e:  # surfaced to the main thread below
+                _log.exception(f"Ingest stage '{name}' failed: {e}")
+                errors.append(e)
+                failed.set()
+            finally:
+                busy_seconds[name] = time.monotonic() - started
+
+        thread = threading.Thread(target=runner, name=f"ingest-{name}", daemon=True)
+        thread.start()
+        return thread
+
+    def conversion_cache_key(pdf_path: pathlib.Path, page_range, options_hash: str) -> str:
+        # Content addressed: same PDF bytes, page range, pipeline options and
+        # docling version always produce the same DoclingDocument
+        pdf_hash = hashlib.sha256()
+        with open(pdf_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                pdf_hash.update(block)
+        key = f"{pdf_hash.hexdigest()}-{page_range[0]}-{page_range[1]}-{options_hash}"
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def load_cached_document(key: str):
+        if not cache_dir:
+            return None
+        cache_file = f"{cache_dir.rstrip('/')}/{key}.json"
+        try:
+            with fsspec.open(cache_file, "r") as f:
+                return DoclingDocument.model_validate_json(f.read())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            _log.warning(f"Ignoring unreadable conversion cache entry {cache_file}: {e}")
+            return None
+
+    def store_cached_document(key: str, document):
+        if not cache_dir:
+            return
+        cache_file = f"{cache_dir.rstrip('/')}/{key}.json"
+        try:
+            fs, path = fsspec.core.url_to_fs(cache_file)
+            fs.makedirs(path.rsplit("/", 1)[0], exist_ok=True)
+            # Write then move so a killed worker never leaves a partial entry
+            fs.pipe_file(f"{path}.tmp", document.model_dump_json().encode())
+            fs.mv(f"{path}.tmp", path)
+        except Exception as e:
+            _log.warning(f"Unable to write conversion cache entry {cache_file}: {e}")
+
+    def plan_ocr_runs(pdf_path: pathlib.Path, page_range):
+        """ Splits a page range into runs of consecutive pages that do or don't
+            need OCR.  A page needs OCR when its text layer is missing or too
+            sparse to hold the page's content, i.e. a scanned page.
+        """
+        pdf = pypdfium2.PdfDocument(pdf_path)
+        try:
+            start = page_range[0]
+            end = min(page_range[1], len(pdf))
+            if ocr_mode != "auto":
+                return [(start, end, ocr_mode == "always")]
+
+            needs_ocr = []
+            for page_no in range(start, end + 1):
+                page = pdf[page_no - 1]
+                needs_ocr.append(page.get_textpage().count_chars() < min_chars_per_page)
+                page.close()
+        finally:
+            pdf.close()
+        return group_ocr_runs(needs_ocr, start)
+
+    def group_ocr_runs(needs_ocr: list, start: int):
+        """ (first page, last page, needs OCR) runs of the pages from start,
+            given whether each page needs OCR.
+        """
+        runs = []
+        for page_no, ocr in enumerate(needs_ocr, start=start):
+            if runs and runs[-1][2] == ocr:
+                runs[-1][1] = page_no
+            else:
+                runs.append([page_no, page_no, ocr])
+
+        # A separate conversion costs more than OCRing a few pages that
+        # didn't need it, so short text runs between two OCR runs are folded
+        # into them.  Leading and trailing text runs keep their text layer.
+        merged = []
+        for i, run in enumerate(runs):
+            if not run[2] and run[1] - run[0] + 1 < min_text_run_pages and 0 < i < len(runs) - 1:
+                run[2] = True
+            if merged and merged[-1][2] == run[2]:
+                merged[-1][1] = run[1]
+            else:
+                merged.append(run)
+        return [tuple(run) for run in merged]
+
+    # ---- Pipeline stages ----
+    # convert -> chunk -> embed (batched) -> insert (batched), each running in
+    # its own thread and connected by bounded queues
+    def parse_work_item(item: str):
+        # Work items are file names, optionally with a page range suffix
+        # assigned by create_pdf_splits, i.e. "c3_repair.pdf#pages=1-200"
+        name, _, fragment = item.partition("#pages=")
+        if not fragment:
+            return input_path / name, DEFAULT_PAGE_RANGE
+        start, _, end = fragment.partition("-")
+        return input_path / name, (int(start), int(end))
+
+    def convert_stage():
         processed_docs = 0
-        for conv_res in conv_results:
-            if conv_res.status != ConversionStatus.SUCCESS:
-                _log.warning(
-                    f"Conversion failed for {conv_res.input.file.stem}: {conv_res.status}"
+        for item in pdf_split:
+            pdf_path, page_range = parse_work_item(item)
+            for start, end, needs_ocr in plan_ocr_runs(pdf_path, page_range):
+                run = f"{pdf_path.name}#pages={start}-{end}"
+                converter, options_hash = converters[needs_ocr]
+                shard = None if (start, end) == (1, page_counts[pdf_path]) else f"{start}-{end}"
+
+                cache_key = (
+                    conversion_cache_key(pdf_path, (start, end), options_hash)
+                    if cache_dir else None
                 )
-                continue
+                document = load_cached_document(cache_key) if cache_key else None
+                if document is not None:
+                    processed_docs += 1
+                    _log.info(f"Loaded {run} from the conversion cache")
+                    put(documents_q, (pdf_path.stem, shard, document))
+                    continue
+
+                run_started = time.monotonic()
+                conv_res = converter.convert(
+                    pdf_path,
+                    raises_on_error=True,
+                    page_range=(start, end),
+                )
+                if conv_res.status != ConversionStatus.SUCCESS:
+                    _log.warning(
+                        f"Conversion failed for {conv_res.input.file.stem}: {conv_res.status}"
+                    )
+                    continue
 
-            processed_docs += 1
-            file_name = conv_res.input.file.stem
-            document = conv_res.document
+                file_name = conv_res.input.file.stem
+                document = conv_res.document
 
-            if document is None:
-                _log.warning(f"Document conversion failed for {file_name}")
-                continue
+                if document is None:
+                    _log.warning(f"Document conversion failed for {file_name}")
+                    continue
 
-            embedding_model, chunker = setup_chunker_and_embedder(
-                embed_model_id, max_tokens
-            )
+                processed_docs += 1
+                record_profile(run, needs_ocr, end - start + 1, run_started, conv_res)
+                if cache_key:
+                    store_cached_document(cache_key, document)
+                put(documents_q, (file_name, shard, document))
+        put(documents_q, end_of_stream)
+        _log.info(f"Processed {processed_docs} documents successfully.")
 
-            chunks_with_embedding = []
-            for chunk in chunker.chunk(dl_doc=document):
-                raw_chunk = chunker.contextualize(chunk)
-                embedding = embed_text(raw_chunk, embedding_model)
+    def record_profile(run: str, needs_ocr: bool, num_pages: int, run_started: float, conv_res):
+        seconds = time.monotonic() - run_started
+        # ru_maxrss is reported in KiB on Linux
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        stage_seconds_per_page = {
+            stage: sum(timing.times) / num_pages
+            for stage, timing in conv_res.timings.items()
+        }
+        profile.append(
+            {
+                "run": run,
+                "ocr": needs_ocr,
+                "pages": num_pages,
+                "seconds": seconds,
+                "seconds_per_page": seconds / num_pages,
+                "stage_seconds_per_page": stage_seconds_per_page,
+                "peak_rss_mb": peak_rss_mb,
+            }
+        )
+        _log.info(
+            f"Converted {run} (ocr={needs_ocr}) in {seconds:.1f}s, "
+            f"{seconds / num_pages:.2f}s/page, peak RSS {peak_rss_mb:.0f} MiB"
+        )
 
+    def chunk_stage():
+        while (item := get(documents_q)) is not end_of_stream:
+            file_name, shard, document = item
+            for chunk in chunker.chunk(dl_doc=document):
+                # docling numbers pages from the start of the original PDF even
+                # when only a page range was converted, so shards stitch back
+                # together without any renumbering
+                page_numbers = sorted(
+                    {
+                        prov.page_no
+                        for doc_item in chunk.meta.doc_items
+                        for prov in doc_item.prov
+                    }
+                )
+                provenance = {"page_numbers": page_numbers}
+                if shard is not None:
+                    provenance["shard"] = shard
+                put(chunks_q, (file_name, provenance, chunker.contextualize(chunk)))
+        put(chunks_q, end_of_stream)
+
+    def embed_stage():
+        done = False
+        while not done:
+            item = get(chunks_q)
+            if item is end_of_stream:
+                break
+
+            # Take whatever else is already waiting, up to a full batch
+            batch = [item]
+            while len(batch) < embed_batch_size:
+                try:
+                    item = chunks_q.get_nowait()
+                except queue.Empty:
+                    break
+                if item is end_of_stream:
+                    done = True
+                    break
+                batch.append(item)
+
+            embeddings = embed_texts([raw_chunk for _, _, raw_chunk in batch], embedding_model)
+            for (file_name, provenance, raw_chunk), embedding in zip(batch, embeddings):
                 chunk_id = str(uuid.uuid4())  # Generate a unique ID for the chunk
                 content_token_count = chunker.tokenizer.count_tokens(raw_chunk)
 
@@ -204,63 +494,133 @@ def docling_convert(
                     "file_name": file_name,
                     "document_id": chunk_id,
                     "token_count": content_token_count,
+                    **provenance,
                 }
 
                 metadata_str = json.dumps(metadata_obj)
                 metadata_token_count = chunker.tokenizer.count_tokens(metadata_str)
                 metadata_obj["metadata_token_count"] = metadata_token_count
 
-                chunks_with_embedding.append(
+                put(
+                    embedded_q,
                     {
                         "content": raw_chunk,
                         "mime_type": "text/markdown",
                         "embedding": embedding,
                         "metadata": metadata_obj,
-                    }
+                    },
                 )
-            if chunks_with_embedding:
-                try:
-                    client.vector_io.insert(
-                        vector_db_id=vector_db_id, chunks=chunks_with_embedding
-                    )
-                except Exception as e:
-                    _log.error(f"Failed to insert embeddings into vector database: {e}")
+        put(embedded_q, end_of_stream)
 
-        _log.info(f"Processed {processed_docs} documents successfully.")
+    def insert_batch(chunks_with_embedding):
+        try:
+            client.vector_io.insert(
+                vector_db_id=vector_db_id, chunks=chunks_with_embedding
+            )
+            inserted[0] += len(chunks_with_embedding)
+        except Exception as e:
+            _log.error(f"Failed to insert embeddings into vector database: {e}")
+
+    def insert_stage():
+        pending = []
+        while (item := get(embedded_q)) is not end_of_stream:
+            pending.append(item)
+            if len(pending) >= insert_batch_size:
+                insert_batch(pending)
+                pending = []
+        if pending:
+            insert_batch(pending)
 
     # ---- Main logic ----
     input_path = pathlib.Path(input_path)
     output_path = pathlib.Path(output_path)
     output_path.mkdir(parents=True, exist_ok=True)
 
-    # Original code using splits
-    input_pdfs = [input_path / name for name in pdf_split]
-    # Alternative not using splits
-    # input_pdfs = pathlib.Path(input_path).glob("*.pdf")
-
     # Required models are automatically downloaded when they are
-    # not provided in PdfPipelineOptions initialization
-    pipeline_options = PdfPipelineOptions()
-    pipeline_options.do_ocr = True
-    pipeline_options.generate_page_images = True
-    pipeline_options.ocr_options = RapidOcrOptions()
-
-    doc_converter = DocumentConverter(
-        format_options={
-            InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
-        }
-    )
+    # not provided in PdfPipelineOptions initialization.  Page images are only
+    # kept when asked for since nothing downstream uses them, and OCR is only
+    # run on the pages that have no usable text layer (see ocr_mode).
+    def create_converter(do_ocr: bool):
+        pipeline_options = PdfPipelineOptions()
+        pipeline_options.do_ocr = do_ocr
+        pipeline_options.generate_page_images = generate_page_images
+        pipeline_options.ocr_options = RapidOcrOptions()
+
+        doc_converter = DocumentConverter(
+            format_options={
+                InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
+            }
+        )
 
-    conv_results = doc_converter.convert_all(
-        input_pdfs,
-        raises_on_error=True,
-    )
+        # Changing the conversion options or upgrading docling invalidates the cache
+        options_hash = hashlib.sha256(
+            (
+                pipeline_options.model_dump_json()
+                + importlib.metadata.version("docling")
+            ).encode()
+        ).hexdigest()
+        return doc_converter, options_hash
+
+    if ocr_mode not in ("auto", "always", "never"):
+        raise ValueError(f"Unknown ocr_mode '{ocr_mode}'.  Expected auto, always or never.")
+    min_text_run_pages = 5
+    settings.debug.profile_pipeline_timings = True
+    converters = {True: create_converter(True), False: create_converter(False)}
+    profile = []
+
+    page_counts = {}
+    for item in pdf_split:
+        pdf_path, _ = parse_work_item(item)
+        pdf = pypdfium2.PdfDocument(pdf_path)
+        page_counts[pdf_path] = len(pdf)
+        pdf.close()
+
+    # Load the chunker and embedding model once for the whole split
+    embedding_model, chunker = setup_chunker_and_embedder(embed_model_id, max_tokens)
 
     # Initialize LlamaStack client
     client = LlamaStackClient(base_url=service_url)
 
-    # Process the conversion results and insert embeddings into the vector database
-    process_and_insert_embeddings(conv_results)
+    # Bounded queues between the stages provide backpressure, so a slow
+    # stage throttles the ones ahead of it instead of buffering whole documents
+    documents_q = queue.Queue(maxsize=2)
+    chunks_q = queue.Queue(maxsize=queue_depth)
+    embedded_q = queue.Queue(maxsize=queue_depth)
+
+    failed = threading.Event()
+    errors = []
+    busy_seconds = {}
+    inserted = [0]
+
+    # Run the stages concurrently and wait for the insert stage to drain
+    started = time.monotonic()
+    stages = [
+        run_stage("convert", convert_stage),
+        run_stage("chunk", chunk_stage),
+        run_stage("embed", embed_stage),
+        run_stage("insert", insert_stage),
+    ]
+    for stage in stages:
+        stage.join()
+    if errors:
+        raise errors[0]
+
+    _log.info(
+        f"Inserted {inserted[0]} chunks in {time.monotonic() - started:.1f}s. "
+        f"Stage times: {', '.join(f'{k}={v:.1f}s' for k, v in busy_seconds.items())}"
+    )
+
+    # Keep the conversion profile with the step's outputs for sizing workers
+    with open(output_path / "conversion_profile.json", "w") as f:
+        json.dump(profile, f, indent=2)
+    if profile:
+        total_pages = sum(p["pages"] for p in profile)
+        ocr_pages = sum(p["pages"] for p in profile if p["ocr"])
+        _log.info(
+            f"Converted {total_pages} pages ({ocr_pages} with OCR) at "
+            f"{sum(p['seconds'] for p in profile) / total_pages:.2f}s/page. "
+            f"Peak RSS {max(p['peak_rss_mb'] for p in profile):.0f} MiB"
+        )
 
 
 @dsl.pipeline()
@@ -268,11 +628,15 @@ def docling_convert_pipeline(
     base_url: str = "https://raw.githubusercontent.com/glroland/mechanic/refs/heads/main/chatbot/src/assets",
     pdf_filenames: str = "c3_repair.pdf",
     num_workers: int = 1,
+    max_pages_per_split: int = 0,
     vector_db_id: str = "mechanic_vector_db",
     service_url: str = "https://my-llama-stack-my-llama-stack.apps.ocp.home.glroland.com",
     embed_model_id: str = "ibm-granite/granite-embedding-125m-english",
     max_tokens: int = 2500,
     use_gpu: bool = False,
+    conversion_cache_dir: str = "",
+    ocr_mode: str = "auto",
+    generate_page_images: bool = False,
     # tolerations: Optional[list] = [{"effect": "NoSchedule", "key": "nvidia.com/gpu", "operator": "Exists"}],
     # node_selector: Optional[dict] = {},
 ):
@@ -281,11 +645,15 @@ def docling_convert_pipeline(
     :param base_url: Base URL to fetch PDF files from
     :param pdf_filenames: Comma-separated list of PDF filenames to download and convert
     :param num_workers: Number of docling worker pods to use
+    :param max_pages_per_split: Split PDFs longer than this many pages into page ranges that can run on separate workers (0 = fair share of the total pages per worker, -1 disables)
     :param use_gpu: Enable GPU in the docling workers
     :param vector_db_id: ID of the vector database to store embeddings
     :param service_url: URL of the Milvus service
     :param embed_model_id: Model ID for embedding generation
     :param max_tokens: Maximum number of tokens per chunk
+    :param ocr_mode: OCR every page ("always"), no pages ("never") or only pages without a usable text layer ("auto")
+    :param generate_page_images: Keep rendered page images in the converted documents
+    :param conversion_cache_dir: Directory or object store URL (i.e. s3://bucket/docling-cache) for caching converted documents between runs (empty disables)
     :return:
     """
 
@@ -305,6 +673,7 @@ def docling_convert_pipeline(
     pdf_splits = create_pdf_splits(
         input_path=import_task.output,
         num_splits=num_workers,
+        max_pages_per_split=max_pages_per_split,
     ).set_caching_options(True)
 
     with dsl.ParallelFor(pdf_splits.output) as pdf_split:
@@ -316,6 +685,9 @@ def docling_convert_pipeline(
                 max_tokens=max_tokens,
                 service_url=service_url,
                 vector_db_id=vector_db_id,
+                cache_dir=conversion_cache_dir,
+                ocr_mode=ocr_mode,
+                generate_page_images=generate_page_images,
             )
             convert_task.set_caching_options(False)
             convert_task.set_cpu_request("500m")
@@ -343,6 +715,9 @@ def docling_convert_pipeline(
                 max_tokens=max_tokens,
                 service_url=service_url,
                 vector_db_id=vector_db_id,
+                cache_dir=conversion_cache_dir,
+                ocr_mode=ocr_mode,
+                generate_page_images=generate_page_images,
             )
             convert_task.set_caching_options(False)
             convert_task.set_cpu_request("500m")
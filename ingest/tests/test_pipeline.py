@@ -0,0 +1,48 @@
+""" Tests of the docling_convert helpers in pipeline.py.
+
+KFP components must be self-contained, so the helpers are nested in the
+component function.  They are compiled from the source here, which also
+keeps the tests free of the kfp and docling dependencies.
+"""
+import ast
+import os
+import pytest
+
+PIPELINE = os.path.join(os.path.dirname(__file__), "..", "src", "pipeline.py")
+
+
+def nested_function(component: str, name: str, **scope):
+    """ The function name nested in the component, closing over scope. """
+    with open(PIPELINE, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    outer = next(n for n in tree.body if isinstance(n, ast.FunctionDef) and n.name == component)
+    inner = next(n for n in outer.body if isinstance(n, ast.FunctionDef) and n.name == name)
+    namespace = dict(scope)
+    exec(compile(ast.Module(body=[inner], type_ignores=[]), "pipeline.py", "exec"), namespace)
+    return namespace[name]
+
+
+@pytest.fixture
+def group_ocr_runs():
+    return nested_function("docling_convert", "group_ocr_runs", min_text_run_pages=5)
+
+
+def test_short_text_run_between_ocr_runs_is_folded(group_ocr_runs):
+    needs_ocr = [True] * 3 + [False] * 2 + [True] * 3
+    assert group_ocr_runs(needs_ocr, 10) == [(10, 17, True)]
+
+
+def test_long_text_run_between_ocr_runs_is_kept(group_ocr_runs):
+    needs_ocr = [True] * 2 + [False] * 5 + [True] * 2
+    assert group_ocr_runs(needs_ocr, 1) == [(1, 2, True), (3, 7, False), (8, 9, True)]
+
+
+def test_short_leading_and_trailing_text_runs_are_kept(group_ocr_runs):
+    assert group_ocr_runs([False, False, True, True, True], 1) == [(1, 2, False), (3, 5, True)]
+    assert group_ocr_runs([True, True, True, False], 1) == [(1, 3, True), (4, 4, False)]
+    assert group_ocr_runs([False, True, False], 4) == [(4, 4, False), (5, 5, True), (6, 6, False)]
+
+
+def test_uniform_pages_are_one_run(group_ocr_runs):
+    assert group_ocr_runs([False] * 3, 1) == [(1, 3, False)]
+    assert group_ocr_runs([True] * 3, 1) == [(1, 3, True)]
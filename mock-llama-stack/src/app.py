@@ -0,0 +1,431 @@
+""" Mock LLama Stack Server
+
+Stand-in for LLama Stack that implements just the endpoints the chatbots call
+(models, providers, vector_dbs, rag_tool insert/query, vector_io insert, inference
+chat_completion and embeddings, and the OpenAI compatible streaming responses
+API), with
+configurable retrieval latency, time to first token and token rate.  Used to
+load test the Streamlit apps without a GPU or a vector database.
+
+Like vLLM, the mock can keep an automatic prefix cache: prompts are split
+into blocks of tokens hashed together with everything before them, and only
+tokens past the longest cached prefix are "prefilled" at
+PREFILL_TOKENS_PER_SECOND, so prompt layouts can be compared for prefix reuse
+and time to first token.  Cached tokens are reported in the usage.
+
+Models listed in SMALL_MODELS stand in for a small model in a cascade: they
+are SMALL_MODEL_SPEEDUP times faster, and for SMALL_MODEL_UNSURE_RATE of
+prompts they answer that they are unsure (or, asked for JSON, give no
+scorecard), so escalation to the large model can be exercised.
+
+Faults can be injected at runtime through /mock/fault, so several mocks can
+stand in for LLama Stack replicas when testing endpoint routing: extra
+latency on every request, or an unhealthy server that answers 503 to
+everything (health checks included).
+"""
+import os
+import json
+import time
+import uuid
+import hashlib
+import asyncio
+import logging
+import itertools
+from collections import OrderedDict
+import uvicorn
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+# configurable parameters
+ENV_MOCK_PORT = "MOCK_PORT"
+ENV_MOCK_MODELS = "MOCK_MODELS"
+ENV_RETRIEVAL_LATENCY_MS = "RETRIEVAL_LATENCY_MS"
+ENV_INSERT_LATENCY_MS = "INSERT_LATENCY_MS"
+ENV_TTFT_MS = "TTFT_MS"
+ENV_TOKENS_PER_SECOND = "TOKENS_PER_SECOND"
+ENV_OUTPUT_TOKENS = "OUTPUT_TOKENS"
+ENV_PREFILL_TOKENS_PER_SECOND = "PREFILL_TOKENS_PER_SECOND"
+ENV_PREFIX_CACHE_BLOCKS = "PREFIX_CACHE_BLOCKS"
+ENV_SMALL_MODELS = "SMALL_MODELS"
+ENV_SMALL_MODEL_SPEEDUP = "SMALL_MODEL_SPEEDUP"
+ENV_SMALL_MODEL_UNSURE_RATE = "SMALL_MODEL_UNSURE_RATE"
+ENV_LOG_LEVEL = "LOG_LEVEL"
+
+# Constants
+PROVIDER_ID = "mock-vector-io"
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBEDDING_DIMENSION = 384
+MECHANIC_VECTOR_DB_NAME = "mechanic_vector_db"
+CHARS_PER_TOKEN = 4
+PREFIX_BLOCK_TOKENS = 16
+STORED_RESPONSES = 10000
+
+# Canned content
+CHUNK_TEXT = ("Hand washing sink: minimum 10 inches wide x 10 inches long x 5 inches deep.  "
+              "Water temperature: 100F to 120F at the faucet.  Wastewater tank must be at "
+              "least 15% larger than the clean water tank.")
+ANSWER_WORDS = ("Based on the regulations provided, the unit must meet the listed water, "
+                "equipment and commissary requirements before a permit is issued.").split()
+SCORECARD = {
+    "overall_score": 72,
+    "recommendation": "NEEDS_REVISION",
+    "categories": {
+        category: {"score": 72, "findings": ["Mock finding"], "required_actions": ["Mock action"]}
+        for category in ("completeness", "accuracy", "compliance", "documentation", "safety_requirements")
+    },
+    "summary": "Mock evaluation.",
+    "next_steps": ["Resubmit with the missing documents"],
+}
+UNSURE_ANSWER = "I'm not sure.  The provided regulations do not cover this."
+UNSURE_EVALUATION = "I cannot complete a full evaluation of this application from the information provided."
+
+# Setup Logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Retrieve config
+port = int(os.environ.get(ENV_MOCK_PORT, "8321"))
+models = os.environ.get(ENV_MOCK_MODELS, "llama-4-scout-17b-16e-w4a16,llama32,openai/gpt-4").split(",")
+retrieval_latency = int(os.environ.get(ENV_RETRIEVAL_LATENCY_MS, "50")) / 1000
+insert_latency = int(os.environ.get(ENV_INSERT_LATENCY_MS, "500")) / 1000
+ttft = int(os.environ.get(ENV_TTFT_MS, "300")) / 1000
+tokens_per_second = float(os.environ.get(ENV_TOKENS_PER_SECOND, "40"))
+output_tokens = int(os.environ.get(ENV_OUTPUT_TOKENS, "200"))
+prefill_tokens_per_second = float(os.environ.get(ENV_PREFILL_TOKENS_PER_SECOND, "0"))
+prefix_cache_blocks = int(os.environ.get(ENV_PREFIX_CACHE_BLOCKS, "0"))
+small_models = [m for m in os.environ.get(ENV_SMALL_MODELS, "").split(",") if m]
+small_model_speedup = float(os.environ.get(ENV_SMALL_MODEL_SPEEDUP, "3"))
+small_model_unsure_rate = float(os.environ.get(ENV_SMALL_MODEL_UNSURE_RATE, "0.2"))
+logger.info("Retrieval Latency: %ss. Insert Latency: %ss", retrieval_latency, insert_latency)
+logger.info("TTFT: %ss. Tokens/s: %s. Output Tokens: %s", ttft, tokens_per_second, output_tokens)
+logger.info("Prefill Tokens/s: %s. Prefix Cache Blocks: %s", prefill_tokens_per_second, prefix_cache_blocks)
+logger.info("Small Models: %s. Speedup: %s. Unsure Rate: %s", small_models, small_model_speedup,
+            small_model_unsure_rate)
+
+# Injected faults, set through /mock/fault
+fault = {"latency_ms": 0, "healthy": True}
+
+# Registered vector databases, by id
+vector_dbs = {
+    MECHANIC_VECTOR_DB_NAME: {
+        "identifier": MECHANIC_VECTOR_DB_NAME,
+        "vector_db_name": MECHANIC_VECTOR_DB_NAME,
+        "provider_id": PROVIDER_ID,
+        "provider_resource_id": MECHANIC_VECTOR_DB_NAME,
+        "type": "vector_db",
+        "embedding_model": EMBEDDING_MODEL,
+        "embedding_dimension": EMBEDDING_DIMENSION,
+    }
+}
+
+
+class PrefixCache:
+    """ LRU of prompt blocks, each keyed by a hash chained through the blocks before it. """
+
+    def __init__(self, max_blocks: int):
+        self.max_blocks = max_blocks
+        self.blocks = OrderedDict()
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def prefill(self, prompt: str) -> tuple[int, int]:
+        """ Caches the prompt's blocks.
+
+        :returns: Prompt tokens and how many of them were already cached
+        """
+        tokens = [prompt[i:i + CHARS_PER_TOKEN] for i in range(0, len(prompt), CHARS_PER_TOKEN)]
+        cached = 0
+        if self.max_blocks > 0:
+            digest = b""
+            hit = True
+            # only full blocks are cached
+            for i in range(0, len(tokens) - PREFIX_BLOCK_TOKENS + 1, PREFIX_BLOCK_TOKENS):
+                digest = hashlib.sha1(digest + "".join(tokens[i:i + PREFIX_BLOCK_TOKENS]).encode("utf-8")).digest()
+                if hit and digest in self.blocks:
+                    cached += PREFIX_BLOCK_TOKENS
+                    self.blocks.move_to_end(digest)
+                else:
+                    hit = False
+                    self.blocks[digest] = True
+            while len(self.blocks) > self.max_blocks:
+                self.blocks.popitem(last=False)
+        self.prompt_tokens += len(tokens)
+        self.cached_tokens += cached
+        return len(tokens), cached
+
+    def first_token_delay(self, uncached_tokens: int) -> float:
+        """ Seconds before the first output token. """
+        if prefill_tokens_per_second <= 0:
+            return ttft
+        return ttft + uncached_tokens / prefill_tokens_per_second
+
+
+prefix_cache = PrefixCache(prefix_cache_blocks)
+
+# Prompt and output of stored responses, for previous_response_id
+stored_responses = OrderedDict()
+
+
+def chat_prompt(messages: list) -> str:
+    """ Flattened chat, as a chat template would render it. """
+    return "".join(f"<|{m.get('role')}|>{m.get('content', '')}<|end|>" for m in messages)
+
+
+def generate_answer(prompt: str, model: str = None) -> list[str]:
+    """ Output tokens for a prompt: a scorecard when JSON is asked for, filler otherwise.
+        A small model is unsure of some prompts, the same ones every time.
+    """
+    if model in small_models and \
+            int(hashlib.md5(prompt.encode("utf-8")).hexdigest(), 16) % 1000 < small_model_unsure_rate * 1000:
+        text = UNSURE_EVALUATION if "JSON format" in prompt else UNSURE_ANSWER
+        return [word + " " for word in text.split()]
+    if "JSON format" in prompt:
+        text = json.dumps(SCORECARD)
+        return [text[i:i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN)]
+    return [word + " " for word in itertools.islice(itertools.cycle(ANSWER_WORDS), output_tokens)]
+
+
+def slowdown(model: str) -> float:
+    """ Factor applied to the model's latencies. """
+    return 1 / small_model_speedup if model in small_models else 1.0
+
+
+def embed(text: str) -> list[float]:
+    """ Hashed bag of words, so texts sharing words have similar embeddings. """
+    vector = [0.0] * EMBEDDING_DIMENSION
+    for word in text.lower().split():
+        digest = hashlib.md5(word.encode("utf-8")).digest()
+        vector[int.from_bytes(digest[:4], "little") % EMBEDDING_DIMENSION] += 1.0
+    return vector
+
+
+async def list_models(request: Request):
+    """ /v1/models """
+    return JSONResponse({"data": [
+        {"identifier": model_id, "provider_resource_id": model_id, "provider_id": "mock",
+         "type": "model", "model_type": "llm", "metadata": {}}
+        for model_id in models
+    ] + [
+        {"identifier": EMBEDDING_MODEL, "provider_resource_id": EMBEDDING_MODEL, "provider_id": "mock",
+         "type": "model", "model_type": "embedding",
+         "metadata": {"embedding_dimension": EMBEDDING_DIMENSION}}
+    ]})
+
+
+async def list_providers(request: Request):
+    """ /v1/providers """
+    return JSONResponse({"data": [
+        {"api": "vector_io", "provider_id": PROVIDER_ID, "provider_type": "inline::mock",
+         "config": {}, "health": {"status": "OK"}},
+        {"api": "inference", "provider_id": "mock", "provider_type": "inline::mock",
+         "config": {}, "health": {"status": "OK"}},
+    ]})
+
+
+async def vector_dbs_endpoint(request: Request):
+    """ /v1/vector-dbs: list (GET) and register (POST) """
+    if request.method == "GET":
+        return JSONResponse({"data": list(vector_dbs.values())})
+
+    body = await request.json()
+    vector_db = {
+        "identifier": body["vector_db_id"],
+        "vector_db_name": body.get("vector_db_name", body["vector_db_id"]),
+        "provider_id": body.get("provider_id", PROVIDER_ID),
+        "provider_resource_id": body["vector_db_id"],
+        "type": "vector_db",
+        "embedding_model": body.get("embedding_model", EMBEDDING_MODEL),
+        "embedding_dimension": body.get("embedding_dimension", EMBEDDING_DIMENSION),
+    }
+    vector_dbs[vector_db["identifier"]] = vector_db
+    return JSONResponse(vector_db)
+
+
+async def rag_insert(request: Request):
+    """ /v1/tool-runtime/rag-tool/insert """
+    body = await request.json()
+    if body.get("vector_db_id") not in vector_dbs:
+        return JSONResponse({"detail": "Vector DB not found"}, status_code=400)
+    await asyncio.sleep(insert_latency)
+    return JSONResponse(None)
+
+
+async def vector_io_insert(request: Request):
+    """ /v1/vector-io/insert, chunks with precomputed embeddings """
+    body = await request.json()
+    if body.get("vector_db_id") not in vector_dbs:
+        return JSONResponse({"detail": "Vector DB not found"}, status_code=400)
+    await asyncio.sleep(insert_latency)
+    return JSONResponse(None)
+
+
+async def rag_query(request: Request):
+    """ /v1/tool-runtime/rag-tool/query """
+    body = await request.json()
+    max_chunks = (body.get("query_config") or {}).get("max_chunks", 5)
+    await asyncio.sleep(retrieval_latency)
+    return JSONResponse({
+        "metadata": {"document_ids": [f"doc-{i}" for i in range(max_chunks)]},
+        "content": [{"type": "text", "text": CHUNK_TEXT} for _ in range(max_chunks)],
+    })
+
+
+async def chat_completion(request: Request):
+    """ /v1/inference/chat-completion, optionally streaming """
+    body = await request.json()
+    prompt = chat_prompt(body.get("messages", []))
+    tokens = generate_answer(prompt, body.get("model_id"))
+    factor = slowdown(body.get("model_id"))
+    prompt_tokens, cached_tokens = prefix_cache.prefill(prompt)
+    metrics = [
+        {"metric": "prompt_tokens", "value": prompt_tokens, "unit": "tokens"},
+        {"metric": "completion_tokens", "value": len(tokens), "unit": "tokens"},
+        {"metric": "total_tokens", "value": prompt_tokens + len(tokens), "unit": "tokens"},
+        {"metric": "cached_prompt_tokens", "value": cached_tokens, "unit": "tokens"},
+    ]
+
+    def event(event_type: str, text: str, **kwargs) -> str:
+        data = {"event": {"event_type": event_type, "delta": {"type": "text", "text": text}, **kwargs}}
+        return f"data: {json.dumps(data)}\n\n"
+
+    async def stream():
+        yield event("start", "")
+        await asyncio.sleep(prefix_cache.first_token_delay(prompt_tokens - cached_tokens) * factor)
+        for token in tokens:
+            yield event("progress", token)
+            await asyncio.sleep(factor / tokens_per_second)
+        data = {"event": {"event_type": "complete", "delta": {"type": "text", "text": ""},
+                          "stop_reason": "end_of_turn"}, "metrics": metrics}
+        yield f"data: {json.dumps(data)}\n\n"
+
+    if body.get("stream"):
+        return StreamingResponse(stream(), media_type="text/event-stream")
+    await asyncio.sleep((prefix_cache.first_token_delay(prompt_tokens - cached_tokens)
+                         + len(tokens) / tokens_per_second) * factor)
+    return JSONResponse({
+        "completion_message": {"role": "assistant", "content": "".join(tokens),
+                               "stop_reason": "end_of_turn", "tool_calls": []},
+        "metrics": metrics,
+    })
+
+
+async def embeddings(request: Request):
+    """ /v1/inference/embeddings """
+    body = await request.json()
+    contents = [c if isinstance(c, str) else c.get("text", "") for c in body.get("contents", [])]
+    await asyncio.sleep(retrieval_latency)
+    return JSONResponse({"embeddings": [embed(text) for text in contents]})
+
+
+async def openai_responses(request: Request):
+    """ /v1/openai/v1/responses, streaming text deltas at the configured token rate """
+    body = await request.json()
+    user_input = body.get("input")
+    if not isinstance(user_input, str):
+        user_input = json.dumps(user_input)
+    # instructions, then the earlier turns of the conversation, then the new input
+    history = stored_responses.get(body.get("previous_response_id"), "")
+    prompt = chat_prompt([{"role": "system", "content": body.get("instructions") or ""}]) \
+        + history + chat_prompt([{"role": "user", "content": user_input}])
+    tokens = generate_answer(prompt, body.get("model"))
+    factor = slowdown(body.get("model"))
+    response_id = f"resp_{uuid.uuid4().hex}"
+    response = {"id": response_id, "object": "response", "created_at": int(time.time()),
+                "model": body.get("model"), "status": "in_progress", "output": []}
+
+    def event(data: dict) -> str:
+        return f"event: {data['type']}\ndata: {json.dumps(data)}\n\n"
+
+    async def stream():
+        sequence = itertools.count()
+        yield event({"type": "response.created", "sequence_number": next(sequence), "response": response})
+        await asyncio.sleep(prefix_cache.first_token_delay(input_tokens - cached_tokens) * factor)
+        for token in tokens:
+            yield event({"type": "response.output_text.delta", "sequence_number": next(sequence),
+                         "item_id": "msg_0", "output_index": 0, "content_index": 0,
+                         "delta": token, "logprobs": []})
+            await asyncio.sleep(factor / tokens_per_second)
+
+        text = "".join(tokens)
+        if body.get("store", True):
+            stored_responses[response_id] = history + chat_prompt([{"role": "user", "content": user_input},
+                                                                   {"role": "assistant", "content": text}])
+            while len(stored_responses) > STORED_RESPONSES:
+                stored_responses.popitem(last=False)
+        yield event({"type": "response.completed", "sequence_number": next(sequence), "response": {
+            **response,
+            "status": "completed",
+            "output": [{"type": "message", "id": "msg_0", "role": "assistant", "status": "completed",
+                        "content": [{"type": "output_text", "text": text, "annotations": []}]}],
+            "usage": {"input_tokens": input_tokens, "output_tokens": len(tokens),
+                      "total_tokens": input_tokens + len(tokens),
+                      "input_tokens_details": {"cached_tokens": cached_tokens},
+                      "output_tokens_details": {"reasoning_tokens": 0}},
+        }})
+
+    if not body.get("stream"):
+        return JSONResponse({"detail": "Only streaming responses are mocked"}, status_code=400)
+    input_tokens, cached_tokens = prefix_cache.prefill(prompt)
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+async def prefix_cache_endpoint(request: Request):
+    """ /mock/prefix-cache: statistics (GET), or statistics then clear (DELETE) """
+    stats = {"blocks": len(prefix_cache.blocks), "prompt_tokens": prefix_cache.prompt_tokens,
+             "cached_tokens": prefix_cache.cached_tokens}
+    if request.method == "DELETE":
+        prefix_cache.blocks.clear()
+        prefix_cache.prompt_tokens = prefix_cache.cached_tokens = 0
+    return JSONResponse(stats)
+
+
+async def fault_endpoint(request: Request):
+    """ /mock/fault: the injected faults (GET), or update them from a JSON body (POST) """
+    if request.method == "POST":
+        body = await request.json()
+        fault["latency_ms"] = int(body.get("latency_ms", fault["latency_ms"]))
+        fault["healthy"] = bool(body.get("healthy", fault["healthy"]))
+        logger.info("Injected faults: %s", fault)
+    return JSONResponse(fault)
+
+
+async def inject_faults(request: Request, call_next):
+    """ Applies the injected faults to every request outside /mock. """
+    if request.url.path.startswith("/mock/"):
+        return await call_next(request)
+    if not fault["healthy"]:
+        return JSONResponse({"detail": "Injected fault: unhealthy"}, status_code=503)
+    if fault["latency_ms"]:
+        await asyncio.sleep(fault["latency_ms"] / 1000)
+    return await call_next(request)
+
+
+async def health_check(request: Request):
+    """ Health check endpoint for the Mock LLama Stack Server. """
+    return JSONResponse({"status": "OK"})
+
+
+app = Starlette(routes=[
+    Route("/v1/models", list_models),
+    Route("/v1/providers", list_providers),
+    Route("/v1/vector-dbs", vector_dbs_endpoint, methods=["GET", "POST"]),
+    Route("/v1/tool-runtime/rag-tool/insert", rag_insert, methods=["POST"]),
+    Route("/v1/tool-runtime/rag-tool/query", rag_query, methods=["POST"]),
+    Route("/v1/vector-io/insert", vector_io_insert, methods=["POST"]),
+    Route("/v1/inference/chat-completion", chat_completion, methods=["POST"]),
+    Route("/v1/inference/embeddings", embeddings, methods=["POST"]),
+    Route("/v1/openai/v1/responses", openai_responses, methods=["POST"]),
+    Route("/v1/health", health_check),
+    Route("/mock/prefix-cache", prefix_cache_endpoint, methods=["GET", "DELETE"]),
+    Route("/mock/fault", fault_endpoint, methods=["GET", "POST"]),
+], middleware=[Middleware(BaseHTTPMiddleware, dispatch=inject_faults)])
+
+
+if __name__ == "__main__":
+    log_level = os.environ.get(ENV_LOG_LEVEL, "info")
+    print ("Starting Mock LLama Stack Server on port", port)
+    uvicorn.run(app, host="0.0.0.0", port=port, log_level=log_level)